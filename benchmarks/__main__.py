@@ -0,0 +1,92 @@
+"""
+Run all climate_ip benchmarks and print results as JSON.
+
+Results of a previous run can be compared with the current one, exit code is 1
+if any measurement got slower (or any throughput lower, or memory use higher) by more than threshold.
+
+Run from repository root:
+    python -m benchmarks --output baseline.json
+    python -m benchmarks --compare baseline.json --threshold 0.2
+"""
+import argparse
+import json
+import platform
+import sys
+
+from . import bench_2878_parser, bench_memory, bench_profiles
+
+BENCHMARKS = {
+    'profiles' : bench_profiles.run,
+    '2878_parser' : bench_2878_parser.run,
+    'memory' : bench_memory.run,
+}
+
+CONST_DEFAULT_THRESHOLD = 0.2 # relative
+
+def environment():
+    import jinja2
+    return { 'python' : platform.python_version(), 'jinja2' : jinja2.__version__, 'machine' : platform.machine() }
+
+def flatten(result, prefix = ''):
+    """Return dictionary mapping slash separated paths to numeric leaves of result."""
+    values = {}
+    for key, value in result.items():
+        path = prefix + str(key)
+        if isinstance(value, dict):
+            values.update(flatten(value, path + '/'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+def is_measurement(path):
+    return 'usec' in path or path.endswith('_per_sec') or path.endswith('bytes')
+
+def compare(baseline, current, threshold):
+    """Return list of (path, baseline value, current value, relative change) of regressions."""
+    old = flatten(baseline.get('results', {}))
+    new = flatten(current.get('results', {}))
+    regressions = []
+    for path, value in sorted(new.items()):
+        if path not in old or not is_measurement(path) or old[path] <= 0:
+            continue
+        change = (value - old[path]) / old[path]
+        if path.endswith('_per_sec'):
+            change = -change # throughput, higher is better
+        if change > threshold:
+            regressions.append((path, old[path], value, change))
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = 'python -m benchmarks', description = 'Run climate_ip benchmarks.')
+    parser.add_argument('--output', help = 'write results to file instead of standard output')
+    parser.add_argument('--compare', metavar = 'BASELINE', help = 'compare results with results of previous run')
+    parser.add_argument('--threshold', type = float, default = CONST_DEFAULT_THRESHOLD,
+        help = 'relative slowdown reported as regression (default: %(default)s)')
+    parser.add_argument('--only', choices = sorted(BENCHMARKS.keys()), action = 'append', help = 'run only selected benchmarks')
+    args = parser.parse_args(argv)
+
+    names = args.only or sorted(BENCHMARKS.keys())
+    current = { 'environment' : environment(), 'results' : { name : BENCHMARKS[name]() for name in names } }
+
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(current, stream, indent = 2)
+    else:
+        json.dump(current, sys.stdout, indent = 2)
+        sys.stdout.write('\n')
+
+    if args.compare:
+        with open(args.compare, 'r') as stream:
+            baseline = json.load(stream)
+        if baseline.get('environment') != current['environment']:
+            sys.stderr.write('Warning: baseline was measured in different environment: {}\n'.format(baseline.get('environment')))
+        regressions = compare(baseline, current, args.threshold)
+        for path, old, new, change in regressions:
+            sys.stderr.write('Regression {}: {} -> {} ({:+.0%})\n'.format(path, old, new, change))
+        if regressions:
+            return 1
+        sys.stderr.write('No regressions above {:.0%}\n'.format(args.threshold))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+Microbenchmark of the 2878 socket frame parser.
+
+Compares Samsung2878StreamParser with the former str.find / split("><") / re.match
+handling, using xml_test fixture from samsung_2878.py.
+
+Run from repository root:
+    python -m benchmarks.bench_2878_parser
+"""
+import json
+import re
+import sys
+import timeit
+
+from custom_components.climate_ip.samsung_2878 import (
+    Samsung2878StreamParser, xml_test,
+)
+
+CONST_REPEAT = 5
+CONST_NUMBER = 2000
+
+def legacy_parse(reply):
+    """Parse single reply the way ConnectionSamsung2878 did before stream parser was added."""
+    device_status = {}
+    if reply.find('Response Type="DeviceState" Status="Okay"') != -1:
+        attrs = reply.split("><")
+        for attr in attrs:
+            f = re.match('Attr ID="(.*)" Type=".*" Value="(.*)"', attr)
+            if f:
+                k, v = f.group(1, 2)
+                device_status[k] = v
+    return device_status
+
+def stream_parse(parser, data):
+    return parser.feed(data)[0].values
+
+def stream_parse_chunked(parser, chunks):
+    frames = []
+    for chunk in chunks:
+        frames.extend(parser.feed(chunk))
+    return frames[0].values
+
+def measure(func, *args):
+    best = min(timeit.repeat(lambda: func(*args), repeat = CONST_REPEAT, number = CONST_NUMBER))
+    return { 'usec_per_frame' : round(best / CONST_NUMBER * 1e6, 3), 'frames_per_sec' : round(CONST_NUMBER / best) }
+
+def run():
+    data = xml_test.encode('utf-8')
+    # frame split across two socket reads
+    chunks = [data[:len(data) // 2], data[len(data) // 2:]]
+    parser = Samsung2878StreamParser()
+    assert legacy_parse(xml_test) == stream_parse(parser, data) == stream_parse_chunked(parser, chunks)
+
+    return {
+        'legacy_find_split_match' : measure(legacy_parse, xml_test),
+        'stream_parser' : measure(stream_parse, parser, data),
+        'stream_parser_split_frame' : measure(stream_parse_chunked, parser, chunks),
+    }
+
+if __name__ == '__main__':
+    json.dump(run(), sys.stdout, indent = 2)
+    sys.stdout.write('\n')
@@ -0,0 +1,133 @@
+"""
+Memory report of every shipped profile:
+
+    definitions     connections and properties loaded once per profile and shared by all entities:
+                    object counts and bytes of connection objects with their parameters
+    entity          objects and bytes added by every additional entity using the profile
+
+Nothing leaves the host, devices are created without connecting to them.
+Compare results of two revisions with --output / --compare of python -m benchmarks.
+
+Run from repository root:
+    python -m benchmarks.bench_memory
+"""
+import gc
+import glob
+import json
+import logging
+import os
+import sys
+import tracemalloc
+
+from custom_components.climate_ip import connection, profile_cache
+from custom_components.climate_ip.controller_yaml import create_device_profile
+
+CONST_ENTITIES = 50
+
+PROFILES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'custom_components', 'climate_ip')
+
+def entity_config(path, index):
+    return { 'config_file' : path, 'ip_address' : '10.0.{}.{}'.format(index // 256, index % 256),
+        'token' : 'token{}'.format(index), 'mac' : '00:00:00:00:{:02x}:{:02x}'.format(index // 256, index % 256) }
+
+def profile_connections(profile):
+    """Return distinct connections used by profile definitions, including embedded commands."""
+    found = {}
+    def add(c):
+        if c is not None and id(c) not in found:
+            found[id(c)] = c
+            add(getattr(c, 'embedded_command', None))
+    add(profile.connection)
+    for definition in [profile.state_getter] + profile.operations + profile.properties:
+        add(definition.get_connection(None))
+        for value in getattr(definition, 'values', []):
+            add(definition.get_connection(value))
+    return list(found.values())
+
+def profile_containers(node):
+    """Return ids of dictionaries and lists of parsed profile, they are shared by all connections."""
+    found = set()
+    pending = [node]
+    while pending:
+        obj = pending.pop()
+        if isinstance(obj, (dict, list)) and id(obj) not in found:
+            found.add(id(obj))
+            pending.extend(obj.values() if isinstance(obj, dict) else obj)
+    return found
+
+def container_size(roots, shared):
+    """Return number and size of distinct containers owned by roots: the objects themselves, their
+    attribute dictionaries and parameter dictionaries or layers. Containers of the parsed profile (shared),
+    strings, numbers and templates are shared with the profile and template cache and are not counted."""
+    seen = set(shared)
+    pending = list(roots)
+    count = 0
+    size = 0
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        count += 1
+        size += sys.getsizeof(obj)
+        for referent in gc.get_referents(obj):
+            if isinstance(referent, (dict, list, connection.Connection, connection.ConnectionParams)):
+                pending.append(referent)
+    return count, size
+
+def allocated(func, number):
+    """Return result of the first call and bytes allocated and kept by one call of func."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = [func(i) for i in range(number)]
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return results[0], (after - before) // number
+
+def bench_definitions(path, logger):
+    node = profile_cache.load_profile(path)
+    # the first run compiles templates, they are cached and shared by all profiles
+    create_device_profile(node, logger)
+    profile, definitions_bytes = allocated(lambda i: create_device_profile(node, logger), 1)
+    connections = profile_connections(profile)
+    containers, connections_bytes = container_size(connections, profile_containers(node))
+    return profile, {
+        'connections' : len(connections),
+        'connection_containers' : containers,
+        'connections_bytes' : connections_bytes,
+        'properties' : 1 + len(profile.operations) + len(profile.properties),
+        'bytes' : definitions_bytes,
+    }
+
+def create_entity(profile, path, index, logger):
+    device = profile.connection.create_device(entity_config(path, index), logger)
+    states = [definition.create_state(device) for definition in
+        [profile.state_getter] + profile.operations + profile.properties]
+    return device, states
+
+def bench_entity(profile, path, logger):
+    """Measure device handle and property states created by YamlController.initialize for every entity."""
+    (device, states), entity_bytes = allocated(lambda i: create_entity(profile, path, i, logger), CONST_ENTITIES)
+    return {
+        'objects' : 1 + len(states),
+        'bytes' : entity_bytes,
+    }
+
+def bench_profile(path, logger):
+    profile, definitions = bench_definitions(path, logger)
+    return { 'definitions' : definitions, 'entity' : bench_entity(profile, path, logger) }
+
+def run():
+    logger = logging.getLogger('benchmarks')
+    logger.setLevel(logging.ERROR)
+    result = {}
+    for path in sorted(glob.glob(os.path.join(PROFILES_DIR, '*.yaml'))):
+        result[os.path.basename(path)] = bench_profile(path, logger)
+    return result
+
+if __name__ == '__main__':
+    json.dump(run(), sys.stdout, indent = 2)
+    sys.stdout.write('\n')
@@ -0,0 +1,223 @@
+"""
+Microbenchmarks of the YAML profile hot paths, measured for every shipped profile:
+
+    initialize      YamlController.initialize with cold and warm template and profile cache,
+                    cold start still reads profile from the cache directory as after restart
+    update_state    full update cycle over a stub connection, with unchanged and changed device state
+    templates       render cost of every property status_template and status_path
+
+Before measuring, every template of the profile and OPTIMIZER_CASES are checked to render the same
+with and without templates.optimize_template.
+
+Devices are replaced by StubConnection returning test_json fixture from connection_request.py
+(REST profiles) or xml_test fixture from samsung_2878.py (2878 profiles), so nothing leaves the host.
+
+Run from repository root:
+    python -m benchmarks.bench_profiles
+"""
+import contextlib
+import copy
+import glob
+import json
+import logging
+import os
+import sys
+import timeit
+
+import yaml
+
+from custom_components.climate_ip import connection, profile_cache, templates
+from custom_components.climate_ip.connection_request import test_json
+from custom_components.climate_ip.controller_yaml import YamlController
+from custom_components.climate_ip.samsung_2878 import (
+    CONNECTION_TYPE_S2878, Samsung2878StreamParser, xml_test,
+)
+
+CONST_REPEAT = 5
+CONST_INITIALIZE_NUMBER = 5
+CONST_UPDATE_NUMBER = 200
+CONST_RENDER_NUMBER = 1000
+
+# loops optimize_template must leave alone or rewrite without changing output
+OPTIMIZER_CASES = [
+    '[{% for key, value in device_state.items() %}{% if key == "AC_FUN_POWER" %}{{value}} {%- endif %}{% endfor %}]',
+    '[{% for key, value in device_state.items() %}{% if key == "AC_FUN_POWER" %}{{value}}{% endif %}{% endfor -%} ]',
+    '[ {%- for key, value in device_state.items() %}{% if key == "AC_FUN_POWER" %}{{value}}{% endif %}{% endfor %}]',
+    '[{% for key, value in device_state.items() %}{% if key == "AC_FUN_POWER" %} {{- value }}{% endif %}{% endfor %}]',
+    '[{% for key, value in device_state.items() %}{% if key == "AC_FUN_POWER" %}{{ value }} {{ key }}{% endif %}{% endfor %}]',
+]
+
+PROFILES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'custom_components', 'climate_ip')
+
+class StubDevice(connection.Device):
+    def __init__(self, config, logger):
+        super(StubDevice, self).__init__(config, logger)
+        self.index = 0
+
+class StubConnection(connection.Connection):
+    """Connection answering every command with the next of fixture device states.
+    Templates passed to execute are still rendered, as real connections do."""
+    fixtures = [{}]
+
+    @staticmethod
+    def match_type(type):
+        return True
+
+    def load_from_yaml(self, node, connection_base):
+        return True
+
+    def create_device(self, config, logger):
+        return StubDevice(config, logger)
+
+    def create_updated(self, node):
+        return StubConnection(self.logger)
+
+    def execute(self, device, template, value, device_state):
+        if template is not None:
+            template.render(value = value, device_state = device_state)
+        fixtures = type(self).fixtures
+        device.index = (device.index + 1) % len(fixtures)
+        return fixtures[device.index]
+
+@contextlib.contextmanager
+def stub_connections(fixtures):
+    """Make controllers created inside the block use StubConnection returning fixtures.
+    Shared definitions are dropped, so they are not reused with other connections."""
+    StubConnection.fixtures = fixtures
+    connection.CLIMATE_IP_CONNECTIONS.insert(0, StubConnection)
+    profile_cache.clear_cache()
+    try:
+        yield
+    finally:
+        connection.CLIMATE_IP_CONNECTIONS.remove(StubConnection)
+        profile_cache.clear_cache()
+
+def rest_fixtures():
+    """Return two REST device states differing in current temperature.
+    Second device with more temperature sensors is read by heat pump profiles (Devices.1)."""
+    state = copy.deepcopy(test_json)
+    heat_pump = dict(copy.deepcopy(state['Devices'][0]), id = '032000000')
+    heat_pump['Temperatures'] += [dict(heat_pump['Temperatures'][0], id = str(i)) for i in (1, 2)]
+    state['Devices'].append(heat_pump)
+    changed = copy.deepcopy(state)
+    for device in changed['Devices']:
+        device['Temperatures'][0]['current'] += 1.0
+    return [state, changed]
+
+def samsung_2878_fixtures():
+    """Return two 2878 device states differing in current temperature."""
+    state = Samsung2878StreamParser().feed(xml_test.encode('utf-8'))[0].values
+    changed = dict(state, AC_FUN_TEMPNOW = str(int(state['AC_FUN_TEMPNOW']) + 1))
+    return [state, changed]
+
+def profile_fixtures(path):
+    with open(path, 'r') as stream:
+        node = yaml.safe_load(stream)
+    connection_type = node.get('device', {}).get('connection', {}).get('type', None)
+    return samsung_2878_fixtures() if connection_type == CONNECTION_TYPE_S2878 else rest_fixtures()
+
+def profile_templates(node):
+    """Return sources of all templates in profile node."""
+    sources = []
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if str(key).endswith('_template') and isinstance(value, str):
+                sources.append(value)
+            else:
+                sources += profile_templates(value)
+    elif isinstance(node, list):
+        for value in node:
+            sources += profile_templates(value)
+    return sources
+
+def check_optimized_templates(sources, device_states):
+    """Check that optimized templates render the same as original ones."""
+    environment = templates.get_environment()
+    for source in sources:
+        optimized = templates.optimize_template(source)
+        if optimized == source:
+            continue
+        original, rewritten = environment.from_string(source), environment.from_string(optimized)
+        for device_state in device_states + [{}]:
+            for value in [None, 'On', 'Off']:
+                params = { 'device_state' : device_state, 'value' : value, 'duid' : 'duid', 'token' : 'token' }
+                assert original.render(**params) == rewritten.render(**params), \
+                    'optimized template renders differently: {}'.format(source)
+
+def create_controller(path, logger):
+    config = { 'config_file' : path, 'ip_address' : '127.0.0.1', 'token' : 'token', 'mac' : '00:00:00:00:00:00' }
+    return YamlController(config, logger)
+
+def measure(func, number):
+    best = min(timeit.repeat(func, repeat = CONST_REPEAT, number = number))
+    return round(best / number * 1e6, 3)
+
+def bench_initialize(path, logger):
+    def cold():
+        templates.clear_cache()
+        profile_cache.clear_cache()
+        return create_controller(path, logger).initialize()
+
+    def warm():
+        return create_controller(path, logger).initialize()
+
+    assert cold(), 'initialization of {} failed'.format(path)
+    return {
+        'cold_usec' : measure(cold, CONST_INITIALIZE_NUMBER),
+        'warm_usec' : measure(warm, CONST_INITIALIZE_NUMBER),
+    }
+
+def bench_update_state(controller):
+    device = controller._device
+
+    def unchanged():
+        # the same device state each time, properties are not evaluated again
+        device.index = 0
+        controller.update_state()
+
+    def changed():
+        controller.update_state()
+
+    return {
+        'unchanged_usec' : measure(unchanged, CONST_UPDATE_NUMBER),
+        'changed_usec' : measure(changed, CONST_UPDATE_NUMBER),
+    }
+
+def bench_templates(controller):
+    """Return render cost of status templates and of status paths replacing them."""
+    device_state = controller._state_getter.value
+    templates_result = {}
+    paths_result = {}
+    props = list(controller._operations.values()) + list(controller._properties.values())
+    for prop in props:
+        template = prop.definition.status_template
+        if template is not None:
+            templates_result[prop.id] = measure(lambda: template.render(device_state = device_state), CONST_RENDER_NUMBER)
+        path = prop.definition.status_path
+        if path is not None:
+            paths_result[prop.id] = measure(lambda: path.render(device_state), CONST_RENDER_NUMBER)
+    return templates_result, paths_result
+
+def bench_profile(path, logger):
+    check_optimized_templates(profile_templates(profile_cache.load_profile(path)) + OPTIMIZER_CASES, 
+        profile_fixtures(path))
+    with stub_connections(profile_fixtures(path)):
+        result = { 'initialize' : bench_initialize(path, logger) }
+        controller = create_controller(path, logger)
+        controller.initialize()
+        result['update_state'] = bench_update_state(controller)
+        result['template_render_usec'], result['status_path_render_usec'] = bench_templates(controller)
+        result['properties'] = len(controller.operations) + len(controller.attributes)
+    return result
+
+def run():
+    logger = logging.getLogger('benchmarks')
+    result = {}
+    for path in sorted(glob.glob(os.path.join(PROFILES_DIR, '*.yaml'))):
+        result[os.path.basename(path)] = bench_profile(path, logger)
+    return result
+
+if __name__ == '__main__':
+    json.dump(run(), sys.stdout, indent = 2)
+    sys.stdout.write('\n')
@@ -7,6 +7,7 @@ from .controller_yaml import (
 from .connection_request import (
     ConnectionRequest, 
     ConnectionRequestPrint,
+    ConnectionRequestAsync,
     )
 
 from .samsung_2878 import (
@@ -13,7 +13,7 @@ import homeassistant.helpers.entity_component
 import homeassistant.helpers.config_validation as cv
 
 from homeassistant.components.climate.const import (
-    ATTR_MAX_TEMP, ATTR_MIN_TEMP,
+    ATTR_MAX_TEMP, ATTR_MIN_TEMP, HVAC_MODE_OFF,
     SUPPORT_TARGET_TEMPERATURE, SUPPORT_TARGET_TEMPERATURE_RANGE,
     SUPPORT_FAN_MODE, SUPPORT_SWING_MODE, SUPPORT_PRESET_MODE,
 )   
@@ -30,24 +30,27 @@ from homeassistant.const import (
     CONF_ACCESS_TOKEN, CONF_TEMPERATURE_UNIT,
     ATTR_TEMPERATURE, ATTR_NAME, ATTR_ENTITY_ID,
     STATE_OFF, STATE_ON, 
-    CONF_IP_ADDRESS, CONF_TOKEN, CONF_MAC
+    CONF_IP_ADDRESS, CONF_TOKEN, CONF_MAC,
+    EVENT_HOMEASSISTANT_STOP
 )
  
 from .yaml_const import (
     DEFAULT_CONF_CONFIG_FILE, CONF_CONFIG_FILE, CONF_CERT, CONF_DEBUG, 
-    CONF_CONTROLLER, CONFIG_DEVICE_NAME,
-    CONFIG_DEVICE_POLL, CONFIG_DEVICE_UPDATE_DELAY, 
+    CONF_CONTROLLER, CONF_PROFILE, CONFIG_DEVICE_NAME,
+    CONFIG_DEVICE_POLL, CONFIG_DEVICE_PUSH, CONFIG_DEVICE_UPDATE_DELAY, 
 )
 
 import voluptuous as vol
 from datetime import timedelta
-import functools as ft
 import json
 import logging
-import time
 import asyncio
+import time
 
-from .controller import (ATTR_POWER, ClimateController, create_controller)
+from .controller import (ATTR_POWER, ClimateController, async_create_controller)
+from .connection import (async_run_in_executor)
+from .hub import (ClimateIPHub, PollStatus)
+from .metrics import (prometheus_text, register_metrics, unregister_metrics)
 
 SUPPORTED_FEATURES_MAP = {
     ATTR_TEMPERATURE : SUPPORT_TARGET_TEMPERATURE,
@@ -68,10 +71,18 @@ REQUIREMENTS = ['requests>=2.21.0', 'xmljson>=0.2.0']
 
 CLIMATE_IP_DATA = 'climate_ip_data'
 ENTITIES = 'entities'
+HUB = 'hub'
 DEFAULT_CLIMATE_IP_TEMP_MIN = 16
 DEFAULT_CLIMATE_IP_TEMP_MAX = 32
 DEFAULT_UPDATE_DELAY = 1.5
 SERVICE_SET_CUSTOM_OPERATION = 'climate_ip_set_property'
+SERVICE_DUMP_METRICS = 'climate_ip_dump_metrics'
+SERVICE_DUMP_PROFILE = 'climate_ip_dump_profile'
+SERVICE_DUMP_TRACE = 'climate_ip_dump_trace'
+ATTR_FILENAME = 'filename'
+DEFAULT_METRICS_FILE = 'climate_ip_metrics.prom'
+DEFAULT_PROFILE_FILE = 'climate_ip_profile'
+DEFAULT_TRACE_FILE = 'climate_ip_trace.log'
 _LOGGER = logging.getLogger(__name__)
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
@@ -84,17 +95,63 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Optional(CONF_TEMPERATURE_UNIT, default=DEFAULT_CONF_TEMP_UNIT): cv.string,
     vol.Optional(CONF_CONTROLLER, default=DEFAULT_CONF_CONTROLLER): cv.string,
     vol.Optional(CONF_DEBUG, default=False): cv.boolean,
+    vol.Optional(CONF_PROFILE, default=0): cv.positive_int,
     vol.Optional(CONFIG_DEVICE_POLL, default=""): cv.string,
+    vol.Optional(CONFIG_DEVICE_PUSH, default=""): cv.string,
     vol.Optional(CONFIG_DEVICE_UPDATE_DELAY, default=DEFAULT_UPDATE_DELAY): cv.string,
 })
 
+def get_hub(hass):
+    """Return hub shared by all climate_ip entities, create it on first use."""
+    if CLIMATE_IP_DATA not in hass.data:
+        hass.data[CLIMATE_IP_DATA] = {}
+        hass.data[CLIMATE_IP_DATA][ENTITIES] = []
+    data = hass.data[CLIMATE_IP_DATA]
+    if HUB not in data:
+        hub = ClimateIPHub(poll_interval = SCAN_INTERVAL.total_seconds())
+        data[HUB] = hub
+
+        async def async_stop_hub(event):
+            await hub.async_stop()
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_stop_hub)
+    return data[HUB]
+
+def write_metrics(filename):
+    with open(filename, 'w') as f:
+        f.write(prometheus_text())
+
+def write_profiles(prefix, devices):
+    """Write pstats and folded stacks file of every profiled device."""
+    for device in devices:
+        profiler = device.rac.profiler
+        if profiler is None or not profiler.enabled:
+            continue
+        filename = '{}_{}'.format(prefix, device.entity_id.replace('.', '_'))
+        _LOGGER.info("climate_ip: writing profile of {} to {}.pstats and {}.folded".format(device.entity_id, 
+            filename, filename))
+        profiler.dump_stats(filename + '.pstats')
+        profiler.dump_folded(filename + '.folded')
+
+def write_traces(filename, devices):
+    """Write the last trace events of every device."""
+    with open(filename, 'w') as f:
+        for device in devices:
+            trace = device.rac.trace
+            if trace is None:
+                continue
+            f.write('# {}\n'.format(device.entity_id))
+            f.writelines(line + '\n' for line in trace.format_events())
+
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
 
     _LOGGER.setLevel(logging.INFO if config.get('debug', False) else logging.ERROR)
     _LOGGER.info("climate_ip: async setup platform")
 
+    hub = get_hub(hass)
     try:
-        device_controller = create_controller(config.get(CONF_CONTROLLER), config, _LOGGER)
+        device_controller = await hub.async_run(config.get(CONF_IP_ADDRESS), async_create_controller,
+            config.get(CONF_CONTROLLER), config, _LOGGER)
     except:
         _LOGGER.error("climate_ip: error while creating controller!")
         raise
@@ -102,7 +159,7 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
     if device_controller is None:
         return PlatformNotReady
 
-    async_add_entities([ClimateIP(device_controller, config)], True)
+    async_add_entities([ClimateIP(device_controller, config, hub)], True)
 
     async def async_service_handler(service):
         params = {key: value for key, value in service.data.items()
@@ -117,15 +174,11 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
             else:
                 devices = hass.data[CLIMATE_IP_DATA][ENTITIES]
 
-        update_tasks = []
         for device in devices:
             if not hasattr(device, 'async_set_custom_operation'):
                 continue
             await getattr(device, 'async_set_custom_operation')(**params)
-            update_tasks.append(device.async_update_ha_state(True))
-
-        if update_tasks:
-            await asyncio.wait(update_tasks, loop=hass.loop)
+            device.async_write_ha_state()
 
     service_schema = device_controller.service_schema_map if device_controller.service_schema_map else {}
     if CLIMATE_IP_DATA in hass.data:
@@ -137,11 +190,47 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
         hass.services.async_register(DOMAIN, SERVICE_SET_CUSTOM_OPERATION, 
             async_service_handler, schema = vol.Schema(service_schema))
 
+    async def async_dump_metrics_handler(service):
+        filename = service.data.get(ATTR_FILENAME, None) or hass.config.path(DEFAULT_METRICS_FILE)
+        _LOGGER.info("climate_ip: writing metrics to {}".format(filename))
+        await hass.async_add_executor_job(write_metrics, filename)
+
+    if not hass.services.has_service(DOMAIN, SERVICE_DUMP_METRICS):
+        hass.services.async_register(DOMAIN, SERVICE_DUMP_METRICS, async_dump_metrics_handler,
+            schema = vol.Schema({ vol.Optional(ATTR_FILENAME) : cv.string }))
+
+    async def async_dump_profile_handler(service):
+        prefix = service.data.get(ATTR_FILENAME, None) or hass.config.path(DEFAULT_PROFILE_FILE)
+        entity_ids = service.data.get(ATTR_ENTITY_ID)
+        devices = [device for device in hass.data[CLIMATE_IP_DATA][ENTITIES] if not entity_ids or 
+            device.entity_id in entity_ids]
+        await hass.async_add_executor_job(write_profiles, prefix, devices)
+
+    if not hass.services.has_service(DOMAIN, SERVICE_DUMP_PROFILE):
+        hass.services.async_register(DOMAIN, SERVICE_DUMP_PROFILE, async_dump_profile_handler,
+            schema = vol.Schema({ vol.Optional(ATTR_ENTITY_ID) : cv.comp_entity_ids, 
+                vol.Optional(ATTR_FILENAME) : cv.string }))
+
+    async def async_dump_trace_handler(service):
+        filename = service.data.get(ATTR_FILENAME, None) or hass.config.path(DEFAULT_TRACE_FILE)
+        entity_ids = service.data.get(ATTR_ENTITY_ID)
+        devices = [device for device in hass.data[CLIMATE_IP_DATA][ENTITIES] if not entity_ids or 
+            device.entity_id in entity_ids]
+        _LOGGER.info("climate_ip: writing trace to {}".format(filename))
+        await hass.async_add_executor_job(write_traces, filename, devices)
+
+    if not hass.services.has_service(DOMAIN, SERVICE_DUMP_TRACE):
+        hass.services.async_register(DOMAIN, SERVICE_DUMP_TRACE, async_dump_trace_handler,
+            schema = vol.Schema({ vol.Optional(ATTR_ENTITY_ID) : cv.comp_entity_ids, 
+                vol.Optional(ATTR_FILENAME) : cv.string }))
+
 class ClimateIP(ClimateEntity):
     """Representation of a Samsung climate device."""
 
-    def __init__(self, rac_controller, config):
+    def __init__(self, rac_controller, config, hub = None):
         self.rac = rac_controller
+        self._hub = hub if hub is not None else ClimateIPHub()
+        self._host = config.get(CONF_IP_ADDRESS)
         self._name = config.get(CONFIG_DEVICE_NAME, None)
         self._poll = None
         str_poll = config.get(CONFIG_DEVICE_POLL, "")
@@ -151,6 +240,13 @@ class ClimateIP(ClimateEntity):
                 self._poll = False
             elif str_poll == "true":
                 self._poll = True
+        self._push = None
+        str_push = config.get(CONFIG_DEVICE_PUSH, "")
+        if str_push:
+            self._push = str_push.lower() == "true"
+        elif self.rac.push is not None:
+            self._push = bool(self.rac.push)
+        self._push_active = bool(self._push)
         features = 0
         for f in SUPPORTED_FEATURES_MAP.keys():
             if f in self.rac.operations:
@@ -160,6 +256,9 @@ class ClimateIP(ClimateEntity):
                 features |= SUPPORTED_FEATURES_MAP[f]
         self._supported_features = features
         self._update_delay = float(config.get(CONFIG_DEVICE_UPDATE_DELAY, DEFAULT_UPDATE_DELAY))
+        self._last_command = None
+        self._last_current_temperature = None
+        self._temperature_changing = False
 
     @property
     def controller(self) -> ClimateController:
@@ -185,12 +284,18 @@ class ClimateIP(ClimateEntity):
 
     @property
     def should_poll(self):
+        """Polling is driven by the shared hub, see wants_poll."""
+        return False
+
+    @property
+    def wants_poll(self):
         res = False
         if self._poll is not None:
             res = self._poll
+        elif self._push_active:
+            res = False
         elif self.rac.poll is not None:
             res = self.rac.poll
-        _LOGGER.info("Should poll: {}".format(res))
         return res
 
     @property
@@ -204,7 +309,6 @@ class ClimateIP(ClimateEntity):
 
     @property
     def state_attributes(self):
-        _LOGGER.info("state_attributes")
         attrs = self.rac.state_attributes
         attrs.update(super(ClimateIP, self).state_attributes)
         if self._name is not None:
@@ -212,9 +316,36 @@ class ClimateIP(ClimateEntity):
         return attrs
 
     async def async_update(self):
-        time.sleep(self._update_delay)
+        if self._update_delay > 0:
+            await asyncio.sleep(self._update_delay)
         _LOGGER.info("async_update")
-        self.rac.update_state()
+        await self._hub.async_run(self._host, self.rac.async_update_state)
+
+    async def async_poll(self):
+        """Called by the hub when device is due for polling."""
+        await self._hub.async_run(self._host, self.rac.async_update_state)
+        current = self.current_temperature
+        self._temperature_changing = current is not None and self._last_current_temperature is not None \
+            and current != self._last_current_temperature
+        self._last_current_temperature = current
+        self.async_write_ha_state()
+
+    @property
+    def poll_status(self):
+        """Device state used by the hub to adapt polling interval."""
+        powered_off = self.rac.get_property(ATTR_POWER) == STATE_OFF or self.hvac_mode == HVAC_MODE_OFF
+        return PollStatus(self.rac.failed_updates, powered_off, self._temperature_changing, self._last_command)
+
+    def command_sent(self):
+        """Poll device more often for a while, so the state written by command is confirmed soon.
+        Device is polled at once if written values could not be applied to the last device state."""
+        self._last_command = time.monotonic()
+        self._hub.async_poll_soon(self, 0 if self.rac.refresh_needed else None)
+
+    async def async_set_device_property(self, name, value):
+        result = await self._hub.async_run(self._host, self.rac.async_set_property, name, value)
+        self.command_sent()
+        return result
 
     @property
     def temperature_unit(self):
@@ -278,19 +409,38 @@ class ClimateIP(ClimateEntity):
         if kwargs.get(ATTR_TARGET_TEMP_LOW) is not None:
             self.rac.set_property(ATTR_TARGET_TEMP_LOW, convert_temperature(
                 int(kwargs.get(ATTR_TARGET_TEMP_LOW)), self.temperature_unit, TEMP_CELSIUS))
-        self.schedule_update_ha_state(True)
+        self.schedule_update_ha_state(self.rac.refresh_needed)
+
+    async def async_set_temperature(self, **kwargs):
+        for attr in [ATTR_TEMPERATURE, ATTR_TARGET_TEMP_HIGH, ATTR_TARGET_TEMP_LOW]:
+            if kwargs.get(attr) is not None:
+                await self.async_set_device_property(attr, convert_temperature(
+                    int(kwargs.get(attr)), self.temperature_unit, TEMP_CELSIUS))
+        self.async_write_ha_state()
 
     def set_swing_mode(self, swing_mode):
         self.rac.set_property(ATTR_SWING_MODE, swing_mode)
-        self.schedule_update_ha_state(True)
+        self.schedule_update_ha_state(self.rac.refresh_needed)
+
+    async def async_set_swing_mode(self, swing_mode):
+        await self.async_set_device_property(ATTR_SWING_MODE, swing_mode)
+        self.async_write_ha_state()
 
     def set_fan_mode(self, fan_mode):
         self.rac.set_property(ATTR_FAN_MODE, fan_mode)
-        self.schedule_update_ha_state(True)
+        self.schedule_update_ha_state(self.rac.refresh_needed)
+
+    async def async_set_fan_mode(self, fan_mode):
+        await self.async_set_device_property(ATTR_FAN_MODE, fan_mode)
+        self.async_write_ha_state()
 
     def set_hvac_mode(self, operation_mode):
         self.rac.set_property(ATTR_HVAC_MODE, operation_mode)
-        self.schedule_update_ha_state(True)
+        self.schedule_update_ha_state(self.rac.refresh_needed)
+
+    async def async_set_hvac_mode(self, operation_mode):
+        await self.async_set_device_property(ATTR_HVAC_MODE, operation_mode)
+        self.async_write_ha_state()
 
     @property
     def swing_mode(self):
@@ -298,7 +448,11 @@ class ClimateIP(ClimateEntity):
 
     def set_preset_mode(self, preset_mode: str):
         self.rac.set_property(ATTR_PRESET_MODE, preset_mode)
-        self.schedule_update_ha_state(True)
+        self.schedule_update_ha_state(self.rac.refresh_needed)
+
+    async def async_set_preset_mode(self, preset_mode: str):
+        await self.async_set_device_property(ATTR_PRESET_MODE, preset_mode)
+        self.async_write_ha_state()
 
     @property
     def swing_modes(self):
@@ -306,51 +460,87 @@ class ClimateIP(ClimateEntity):
 
     def turn_on(self):
         self.rac.set_property(ATTR_POWER, STATE_ON)
-        self.schedule_update_ha_state(True)
+        self.schedule_update_ha_state(self.rac.refresh_needed)
+
+    async def async_turn_on(self):
+        await self.async_set_device_property(ATTR_POWER, STATE_ON)
+        self.async_write_ha_state()
 
     def turn_off(self):
         self.rac.set_property(ATTR_POWER, STATE_OFF)
-        self.schedule_update_ha_state(True)
+        self.schedule_update_ha_state(self.rac.refresh_needed)
+
+    async def async_turn_off(self):
+        await self.async_set_device_property(ATTR_POWER, STATE_OFF)
+        self.async_write_ha_state()
+
+    @staticmethod
+    def custom_operation_steps(kwargs):
+        """Split custom operation into lists of (property, value) pairs, each list is written in one batch.
+        Device is turned on first and turned off at the end."""
+        steps = []
+        if kwargs.get(ATTR_POWER, None) == STATE_ON:
+            steps.append([(ATTR_POWER, STATE_ON)])
+        values = [(key, value) for key, value in kwargs.items() if key != ATTR_POWER and key != 'debug']
+        if values:
+            steps.append(values)
+        if kwargs.get(ATTR_POWER, None) == STATE_OFF:
+            steps.append([(ATTR_POWER, STATE_OFF)])
+        return steps
 
     def set_custom_operation(self, **kwargs):
         """Set custom device mode to specified value."""
-        # first, turn device on if requested
-        for key, value in kwargs.items():
-            if key == 'debug':
-                _LOGGER.info("custom operation, setting property {} to {}".format(key, value))
-                self.rac.set_debug(value)
-
-        for key, value in kwargs.items():
-            if key == ATTR_POWER and value == STATE_ON:
-                _LOGGER.info("custom operation, setting property {} to {}".format(key, value))
-                if not self.rac.set_property(key, value):
-                    _LOGGER.error("ERROR setting property {} to {}".format(key, value))
-
-        for key, value in kwargs.items():
-            if key != ATTR_POWER:
-                _LOGGER.info("custom operation, setting property {} to {}".format(key, value))
-                if not self.rac.set_property(key, value):
-                    _LOGGER.error("ERROR setting property {} to {}".format(key, value))
-
-        # at the end turn device off if requested
-        for key, value in kwargs.items():
-            if key == ATTR_POWER and value == STATE_OFF:
-                _LOGGER.info("custom operation, setting property {} to {}".format(key, value))
-                if not self.rac.set_property(key, value):
-                    _LOGGER.error("ERROR setting property {} to {}".format(key, value))
-
-        self.schedule_update_ha_state(True)
-
-    def async_set_custom_operation(self, **kwargs):
-        return self.hass.async_add_job(
-            ft.partial(self.set_custom_operation, **kwargs))
+        if 'debug' in kwargs:
+            _LOGGER.info("custom operation, setting property {} to {}".format('debug', kwargs['debug']))
+            self.rac.set_debug(kwargs['debug'])
+
+        for values in self.custom_operation_steps(kwargs):
+            _LOGGER.info("custom operation, setting properties {}".format(values))
+            if not self.rac.set_properties(values):
+                _LOGGER.error("ERROR setting properties {}".format(values))
+
+        self.schedule_update_ha_state(self.rac.refresh_needed)
+
+    async def async_set_custom_operation(self, **kwargs):
+        if 'debug' in kwargs:
+            _LOGGER.info("custom operation, setting property {} to {}".format('debug', kwargs['debug']))
+            self.rac.set_debug(kwargs['debug'])
+
+        for values in self.custom_operation_steps(kwargs):
+            _LOGGER.info("custom operation, setting properties {}".format(values))
+            if not await self._hub.async_run(self._host, self.rac.async_set_properties, values):
+                _LOGGER.error("ERROR setting properties {}".format(values))
+        self.command_sent()
+
+    def handle_push_update(self, device_state):
+        """Called from push reader thread. Pushed state is applied on the event loop, where polls and commands
+        update the controller too, so updates of the same controller never run at the same time."""
+        self.hass.loop.call_soon_threadsafe(self.async_apply_push_update, device_state)
+
+    def async_apply_push_update(self, device_state):
+        if not self._push_active:
+            return # removed while state was waiting for event loop
+        self.rac.apply_push_update(device_state)
+        self.async_write_ha_state()
 
     async def async_added_to_hass(self):
-        if CLIMATE_IP_DATA not in self.hass.data:
-            self.hass.data[CLIMATE_IP_DATA] = {}
-            self.hass.data[CLIMATE_IP_DATA][ENTITIES] = []
+        get_hub(self.hass)
         self.hass.data[CLIMATE_IP_DATA][ENTITIES].append(self)
+        if self.rac.metrics is not None:
+            register_metrics(self.entity_id, self.rac.metrics, { 'entity_id' : self.entity_id, 'host' : self._host })
+        if self._push:
+            self._push_active = await async_run_in_executor(
+                self.rac.start_push_updates, self.handle_push_update)
+            if not self._push_active:
+                _LOGGER.error("Push updates not supported by device, falling back to polling")
+        if self.wants_poll:
+            self._hub.async_register(self)
 
     async def async_will_remove_from_hass(self):
+        self._hub.async_unregister(self)
+        unregister_metrics(self.entity_id)
+        if self._push_active:
+            self._push_active = False
+            await async_run_in_executor(self.rac.stop_push_updates)
         if CLIMATE_IP_DATA  in self.hass.data:
-            self.hass.data[CLIMATE_IP_DATA].remove(self)
+            self.hass.data[CLIMATE_IP_DATA][ENTITIES].remove(self)
@@ -1,18 +1,53 @@
 from .yaml_const import (CONFIG_TYPE)
 from .yaml_const import (CONFIG_DEVICE_CONNECTION_PARAMS)
+from .metrics import (DeviceMetrics)
+from .trace import (TraceBuffer)
+from .profile_cache import (bind_node, placeholder_replacements)
+from homeassistant.const import (CONF_TOKEN, CONF_IP_ADDRESS)
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+import asyncio
+import contextvars
+import functools as ft
    
 CLIMATE_IP_CONNECTIONS = []
+CLIMATE_IP_EXECUTOR_WORKERS = 8
+
+_EXECUTOR = None
+
+BatchCommand = namedtuple('BatchCommand', ['connection', 'data'])
+BatchCommand.__doc__ = """Single property write prepared for batching. 
+data is connection specific, commands are merged and executed by connection.execute_batch."""
+
+def get_executor():
+    """Return executor shared by all climate_ip devices for blocking I/O."""
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=CLIMATE_IP_EXECUTOR_WORKERS, thread_name_prefix='climate_ip')
+    return _EXECUTOR
+
+async def async_run_in_executor(func, *args):
+    """Run blocking function in the bounded climate_ip executor. Function runs in copy of the current 
+    context, so stages it measures belong to the profiled cycle of the caller."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), ft.partial(context.run, func, *args))
 
 def register_connection(conn):
     """Decorate a function to register a propery."""
     CLIMATE_IP_CONNECTIONS.append(conn)
     return conn
 
-class Connection:
+class Device():
+    """Handle of a single configured device. Keeps everything which differs between devices using 
+    the same profile: Home Assistant configuration, parameters, metrics, trace and open connections."""
     def __init__(self, config, logger):
-        self._params = {}
-        self._logger = logger
         self._config = config
+        self._logger = logger
+        self._params = {}
+        self._replacements = placeholder_replacements(config.get(CONF_TOKEN, None), config.get(CONF_IP_ADDRESS, None))
+        self._metrics = DeviceMetrics()
+        self._trace = TraceBuffer(logger)
 
     @property
     def logger(self):
@@ -22,24 +57,138 @@ class Connection:
     def config(self):
         return self._config
 
+    @property
+    def params(self):
+        """Parameters of the device from Home Assistant configuration, e.g. certificate."""
+        return self._params
+
+    @property
+    def metrics(self):
+        """Performance metrics of the device, shared by all its connections and properties."""
+        return self._metrics
+
+    @property
+    def trace(self):
+        """Trace of the last events of the device, shared like metrics."""
+        return self._trace
+
+    def bind_params(self, params):
+        """Return connection params (ConnectionParams) merged over device params as new dictionary,
+        with token and host placeholders replaced."""
+        merged = dict(self._params)
+        params.update_dict(merged)
+        return bind_node(merged, self._replacements)
+
+    @property
+    def state_attributes(self):
+        """Return dictionary with connection diagnostic attributes."""
+        return {}
+
+    def start_push_updates(self, callback):
+        """Start receiving state pushed by device. Callback is called with new device state.
+        Return True if connection supports push updates."""
+        return False
+
+    def stop_push_updates(self):
+        """Stop receiving state pushed by device."""
+        pass
+
+class ConnectionParams():
+    """Connection parameters layered over parameters of the base connection. Layers are never modified,
+    connections created from the same base share its parameters instead of copying them.
+    Values are not copied either, they are shared with the parsed profile."""
+    __slots__ = ('_values', '_base')
+
+    def __init__(self, values = None, base = None):
+        self._values = values if values is not None else {}
+        self._base = base
+
+    def updated(self, values):
+        """Return parameters with values added over these ones, self if there is nothing to add."""
+        if not values:
+            return self
+        return ConnectionParams(values, self)
+
+    def get(self, key, default = None):
+        layer = self
+        while layer is not None:
+            if key in layer._values:
+                return layer._values[key]
+            layer = layer._base
+        return default
+
+    def __contains__(self, key):
+        layer = self
+        while layer is not None:
+            if key in layer._values:
+                return True
+            layer = layer._base
+        return False
+
+    def update_dict(self, target):
+        """Copy parameters into target dictionary, values of upper layers win."""
+        if self._base is not None:
+            self._base.update_dict(target)
+        target.update(self._values)
+        return target
+
+    def to_dict(self):
+        return self.update_dict({})
+
+class Connection:
+    """Connection loaded from device profile. Connections keep no state of a device, single connection 
+    is shared by all devices using the profile and every method gets Device it is executed for."""
+    __slots__ = ('_params', '_logger')
+
+    def __init__(self, logger):
+        self._params = ConnectionParams()
+        self._logger = logger
+
+    @property
+    def logger(self):
+        return self._logger
+
     def load_from_yaml(self, node, connection_base):
         """Load configuration from yaml node dictionary. Use connection base as base but DO NOT modify it.
         Return True if successful False otherwise."""
         return False
 
-    def execute(self, template, value, device_state):
+    def create_device(self, config, logger):
+        """Create handle of device from Home Assistant configuration or return None if configuration is invalid."""
+        return Device(config, logger)
+
+    def execute(self, device, template, value, device_state):
         """execute connection and return JSON object as result or None if unsuccesful."""
         return None
 
+    async def async_execute(self, device, template, value, device_state):
+        """Asynchronous version of execute. By default runs execute in the executor."""
+        return await async_run_in_executor(self.execute, device, template, value, device_state)
+
+    def prepare_batch(self, device, template, value, device_state):
+        """Prepare command which can be merged with other commands by execute_batch.
+        Return BatchCommand or None if command has to be executed on its own."""
+        return None
+
+    def execute_batch(self, device, commands):
+        """Merge commands prepared by prepare_batch into as few requests as possible and execute them.
+        Return True if all commands were executed successfully."""
+        return False
+
+    async def async_execute_batch(self, device, commands):
+        """Asynchronous version of execute_batch. By default runs execute_batch in the executor."""
+        return await async_run_in_executor(self.execute_batch, device, commands)
+
     def create_updated(self, yaml_node):
-        """Create a copy of connection object and update this object from YAML configuration node"""
+        """Return connection updated from YAML configuration node. Connections do not change after loading,
+        so connection itself is returned when node does not change anything."""
         return None
 
-def create_connection(node, config, logger) -> Connection:
+def create_connection(node, logger) -> Connection:
     for conn in CLIMATE_IP_CONNECTIONS:
         if CONFIG_TYPE in node:
             if conn.match_type(node[CONFIG_TYPE]):
-                c = conn(config, logger)
+                c = conn(logger)
                 if c.load_from_yaml(node, None):
                     return c
     return None
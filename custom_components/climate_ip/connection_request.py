@@ -1,27 +1,329 @@
 from .connection import (
     register_connection,
     Connection,
+    ConnectionParams,
+    Device,
+    BatchCommand,
+    async_run_in_executor,
 )
+from .metrics import (
+    METRIC_REQUEST, COUNTER_RETRIES, COUNTER_SKIPPED, COUNTER_TIMEOUTS, COUNTER_ERRORS,
+    COUNTER_BYTES_IN, COUNTER_BYTES_OUT,
+)
+from .profiling import (STAGE_PARSE, profile_stage)
+from .templates import (get_template)
 from .yaml_const import (
     CONFIG_DEVICE_CONNECTION_PARAMS, CONF_CERT, CONFIG_DEVICE_CONNECTION, CONFIG_DEVICE_CONDITION_TEMPLATE,
 )
 from homeassistant.const import (CONF_PORT, CONF_TOKEN, CONF_MAC, CONF_IP_ADDRESS)
+import asyncio
+import copy
 import json
 import logging
 import os
+import random
+import ssl
+import sys
+import threading
 import traceback
 import time
 
 CONNECTION_TYPE_REQUEST = 'request'
 CONNECTION_TYPE_REQUEST_PRINT = 'request_print'
+CONNECTION_TYPE_REQUEST_ASYNC = 'request_async'
+
+CONST_SESSION_POOL_SIZE = 2
+CONST_SESSION_IDLE_TIMEOUT = 60 # in seconds
+CONST_MAX_ATTEMPTS = 2
+CONST_RETRY_DELAY = 1.0 # in seconds, doubled for each next attempt
+CONST_RETRY_JITTER = 0.2 # relative
+CONST_BREAKER_FAILURE_THRESHOLD = 3
+CONST_BREAKER_RESET_TIMEOUT = 10 # in seconds, doubled each time circuit opens again
+CONST_BREAKER_MAX_RESET_TIMEOUT = 300 # in seconds
+
+# shared by all REST connections, parameters are never modified
+DEFAULT_PARAMS = ConnectionParams({ 'timeout' : 5 })
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+def backoff_delay(base, attempt, jitter, limit = None):
+    """Return base delay doubled attempt times, limited and randomized by +-jitter."""
+    delay = base * 2 ** min(attempt, 16)
+    if limit is not None:
+        delay = min(delay, limit)
+    return delay * random.uniform(1 - jitter, 1 + jitter)
+
+class CircuitBreaker():
+    """Stop sending requests to a device which keeps failing. Shared by all connections of a single device.
+
+    closed - requests are sent, consecutive failures are counted, threshold failures open the circuit
+    open - requests fail immediately until reset timeout passes, timeout doubles each time circuit opens again
+    half_open - single trial request is sent, success closes circuit, failure opens it again"""
+    def __init__(self, threshold = CONST_BREAKER_FAILURE_THRESHOLD, reset_timeout = CONST_BREAKER_RESET_TIMEOUT,
+            max_reset_timeout = CONST_BREAKER_MAX_RESET_TIMEOUT):
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._max_reset_timeout = max_reset_timeout
+        self._state = CIRCUIT_CLOSED
+        self._failures = 0
+        self._open_count = 0
+        self._open_until = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def failures(self):
+        return self._failures
+
+    def allow_request(self):
+        with self._lock:
+            if self._state == CIRCUIT_CLOSED:
+                return True
+            now = time.monotonic()
+            if now < self._open_until:
+                return False
+            # let one trial request through, next one is allowed if trial does not finish in reset timeout
+            self._state = CIRCUIT_HALF_OPEN
+            self._open_until = now + self._reset_timeout
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = CIRCUIT_CLOSED
+            self._failures = 0
+            self._open_count = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == CIRCUIT_HALF_OPEN or self._failures >= self._threshold:
+                timeout = backoff_delay(self._reset_timeout, self._open_count, CONST_RETRY_JITTER, self._max_reset_timeout)
+                self._open_count += 1
+                self._state = CIRCUIT_OPEN
+                self._open_until = time.monotonic() + timeout
+
+class DeviceSession():
+    """Keep-alive HTTP session shared by all connections of a single device.
+
+    Connections are pooled (at most pool_size per device) so TCP connection and
+    TLS handshake are done once and reused by status polls and commands.
+    Session idle for longer than idle_timeout is closed and created again on next use."""
+    def __init__(self, pool_size = CONST_SESSION_POOL_SIZE, idle_timeout = CONST_SESSION_IDLE_TIMEOUT):
+        self._pool_size = pool_size
+        self._idle_timeout = idle_timeout
+        self._session = None
+        self._last_used = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        import requests
+        with self._lock:
+            now = time.monotonic()
+            if self._session is not None and now - self._last_used > self._idle_timeout:
+                self._session.close()
+                self._session = None
+            if self._session is None:
+                adapter = requests.adapters.HTTPAdapter(pool_connections = 1, 
+                    pool_maxsize = self._pool_size, pool_block = True)
+                self._session = requests.sessions.Session()
+                self._session.mount('https://', adapter)
+                self._session.mount('http://', adapter)
+            self._last_used = now
+            return self._session
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+class AsyncDeviceSession():
+    """Keep-alive aiohttp session shared by all asynchronous connections of a single device.
+
+    The session is bound to the event loop it was created in and recreated if used from another one."""
+    def __init__(self, pool_size = CONST_SESSION_POOL_SIZE, idle_timeout = CONST_SESSION_IDLE_TIMEOUT):
+        self._pool_size = pool_size
+        self._idle_timeout = idle_timeout
+        self._session = None
+        self._loop = None
+        self._ssl_contexts = {}
+        self._ssl_lock = None
+
+    async def async_get(self):
+        import aiohttp
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(limit = self._pool_size, keepalive_timeout = self._idle_timeout)
+            self._session = aiohttp.ClientSession(connector = connector)
+            self._loop = loop
+        return self._session
+
+    async def async_get_ssl_context(self, verify, cert):
+        """Return SSL context equivalent to requests 'verify' and 'cert' parameters."""
+        key = (str(verify), str(cert))
+        if key not in self._ssl_contexts:
+            if self._ssl_lock is None:
+                self._ssl_lock = asyncio.Lock()
+            async with self._ssl_lock:
+                if key not in self._ssl_contexts:
+                    self._ssl_contexts[key] = await async_run_in_executor(self.create_ssl_context, verify, cert)
+        return self._ssl_contexts[key]
+
+    @staticmethod
+    def create_ssl_context(verify, cert):
+        if isinstance(verify, str):
+            context = ssl.create_default_context(cafile = verify)
+        else:
+            context = ssl.create_default_context()
+            if not verify:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+        if cert:
+            # device certificates are signed with weak digests rejected by default security level
+            context.set_ciphers('DEFAULT:@SECLEVEL=0')
+            context.load_cert_chain(cert)
+        return context
+
+    async def async_close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+class RequestDevice(Device):
+    """REST device. Session and circuit breaker are shared by all connections of the device."""
+    def __init__(self, config, logger):
+        super(RequestDevice, self).__init__(config, logger)
+        self._session = DeviceSession()
+        self._breaker = CircuitBreaker()
+        cert_file = config.get(CONF_CERT, None)
+        if cert_file is not None:
+            if cert_file.find('\\') == -1 and cert_file.find('/') == -1:
+                cert_file = os.path.join(os.path.dirname(__file__), cert_file)
+        self._params[CONF_CERT] = cert_file
+
+    @property
+    def state_attributes(self):
+        return { 'circuit' : self._breaker.state, 'failures' : self._breaker.failures }
+
+    @staticmethod
+    def is_failure(code):
+        """Connection errors and server errors are retried and counted by circuit breaker."""
+        return code == 0 or 500 <= code < 600
+
+    @staticmethod
+    def request_size(params):
+        """Return size of request body in bytes."""
+        if 'json' in params:
+            return len(json.dumps(params['json']).encode('utf-8'))
+        data = params.get('data', None)
+        if isinstance(data, str):
+            return len(data.encode('utf-8'))
+        return len(data) if isinstance(data, bytes) else 0
+
+    def record_exception(self, timeout_error):
+        """Count exception being handled as timeout or error."""
+        self.metrics.increment(COUNTER_TIMEOUTS if isinstance(sys.exc_info()[1], timeout_error) else COUNTER_ERRORS)
+
+    def execute_request_with_retry(self, params) -> (json, bool, int):
+        """Synchronous API only, calling thread sleeps before retry. Entities use async_execute_request_with_retry."""
+        result = (None, False, 0)
+        for attempt in range(CONST_MAX_ATTEMPTS):
+            if attempt > 0:
+                self.metrics.increment(COUNTER_RETRIES)
+                time.sleep(backoff_delay(CONST_RETRY_DELAY, attempt - 1, CONST_RETRY_JITTER))
+            if not self._breaker.allow_request():
+                self.logger.warning("Device is not responding, request skipped")
+                self.metrics.increment(COUNTER_SKIPPED)
+                break
+            with self.metrics.timer(METRIC_REQUEST):
+                result = self.execute_request(params)
+            if not self.is_failure(result[2]):
+                self._breaker.record_success()
+                break
+            self._breaker.record_failure()
+        return result
+
+    def execute_request(self, params) -> (json, bool, int):
+        import requests, warnings
+        from requests.packages.urllib3.exceptions import InsecureRequestWarning
+
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", category=InsecureRequestWarning)
+            session = self._session.get()
+            self.trace.record("{}", params)
+            try:
+                self.metrics.increment(COUNTER_BYTES_OUT, self.request_size(params))
+                resp = session.request(**params)
+                self.metrics.increment(COUNTER_BYTES_IN, len(resp.content))
+                self.trace.record("Command executed with code: {0.status_code}, text: {0.text}", resp)
+            except:
+                # something goes wrong, drop pooled connections, print callstack and return None
+                self.record_exception(requests.exceptions.Timeout)
+                self._session.close()
+                self.logger.error("Request execution failed. Stack trace:")
+                traceback.print_exc()
+                self.trace.dump("Request execution failed")
+                return (None, False, 0)
+
+        if resp and resp.ok:
+            if resp.status_code == 200:
+                try:
+                    with profile_stage(STAGE_PARSE):
+                        j = resp.json()
+                    return (j, True, resp.status_code)
+                except:
+                    self.logger.warning("Parsing response json failed!")
+            else:
+                return ({}, True, resp.status_code)
+
+            return (None, False, resp.status_code)
+        elif resp is not None:
+            self.logger.error("Execution failed, status code: {}, text: {}".format(resp.status_code, resp.text))
+            self.trace.dump("Execution failed")
+            return (None, False, resp.status_code)
+        else:
+            self.logger.error("Execution failed, unknown error")
+        
+        return (None, False, 0)
+
+    async def async_execute_request_with_retry(self, params) -> (json, bool, int):
+        """Asynchronous version of execute_request_with_retry. Each attempt is submitted to the executor on its own,
+        waiting for retry happens on the event loop, so failing device does not hold executor thread."""
+        result = (None, False, 0)
+        for attempt in range(CONST_MAX_ATTEMPTS):
+            if attempt > 0:
+                self.metrics.increment(COUNTER_RETRIES)
+                await asyncio.sleep(backoff_delay(CONST_RETRY_DELAY, attempt - 1, CONST_RETRY_JITTER))
+            if not self._breaker.allow_request():
+                self.logger.warning("Device is not responding, request skipped")
+                self.metrics.increment(COUNTER_SKIPPED)
+                break
+            with self.metrics.timer(METRIC_REQUEST):
+                result = await self.async_execute_request(params)
+            if not self.is_failure(result[2]):
+                self._breaker.record_success()
+                break
+            self._breaker.record_failure()
+        return result
+
+    async def async_execute_request(self, params) -> (json, bool, int):
+        """Asynchronous version of execute_request. By default runs execute_request in the executor."""
+        return await async_run_in_executor(self.execute_request, params)
 
 class ConnectionRequestBase(Connection):
-    def __init__(self, hass_config, logger):
-        super(ConnectionRequestBase, self).__init__(hass_config, logger)
-        self._params = { 'timeout' : 5 }
+    __slots__ = ('_embedded_command', '_condition_template')
+    device_class = RequestDevice
+
+    def __init__(self, logger):
+        super(ConnectionRequestBase, self).__init__(logger)
+        self._params = DEFAULT_PARAMS
         self._embedded_command = None
         logging.getLogger('urllib3.connectionpool').setLevel(logging.ERROR)
-        self.update_configuration_from_hass(hass_config)
         self._condition_template = None
 
     @property
@@ -32,134 +334,227 @@ class ConnectionRequestBase(Connection):
     def condition_template(self):
         return self._condition_template
 
-    def update_configuration_from_hass(self, hass_config):
-        if hass_config is not None:
-            cert_file = hass_config.get(CONF_CERT, None)
-            if cert_file is not None:
-                if cert_file.find('\\') == -1 and cert_file.find('/') == -1:
-                    cert_file = os.path.join(os.path.dirname(__file__), cert_file)
-
-            self._params[CONF_CERT] = cert_file
+    def create_device(self, config, logger):
+        return self.device_class(config, logger)
 
     def load_from_yaml(self, node, connection_base):
-        from jinja2 import Template
         if connection_base:
-            self._params.update(connection_base._params.copy())
+            self._params = connection_base._params
             self._condition_template = connection_base._condition_template
         
         if node:
-            self._params.update(node.get(CONFIG_DEVICE_CONNECTION_PARAMS, {}))
+            self._params = self._params.updated(node.get(CONFIG_DEVICE_CONNECTION_PARAMS, {}))
             if CONFIG_DEVICE_CONNECTION in node:
                 self._embedded_command = self.create_updated(node[CONFIG_DEVICE_CONNECTION])
             if CONFIG_DEVICE_CONDITION_TEMPLATE in node:
-                self._condition_template = Template(node[CONFIG_DEVICE_CONDITION_TEMPLATE])
+                self._condition_template = get_template(node[CONFIG_DEVICE_CONDITION_TEMPLATE])
         
         return True
 
-    def check_execute_condition(self, device_state):
+    def create_updated(self, node):
+        if not node and self._embedded_command is None:
+            return self
+        c = type(self)(self.logger)
+        c.load_from_yaml(node, self)
+        return c
+
+    def check_execute_condition(self, device, device_state):
         do_execute = True
-        self.logger.info("Checking execute condition")
+        device.trace.record("Checking execute condition")
         if self.condition_template is not None:
-            self.logger.info("Execute condition found, evaluating")
+            device.trace.record("Execute condition found, evaluating")
             try:
                 rendered_condition = self.condition_template.render(device_state = device_state)
-                self.logger.info("Execute condition evaluated: {0}".format(rendered_condition))
+                device.trace.record("Execute condition evaluated: {0}", rendered_condition)
                 do_execute = rendered_condition == '1'
             except:
-                self.logger.error("Execute condition found, error while evaluating, executing command")
+                device.logger.error("Execute condition found, error while evaluating, executing command")
                 do_execute = True
         else:
-            self.logger.warning("Execute condition not found, executing")
+            device.logger.warning("Execute condition not found, executing")
     
         return do_execute
 
-    def execute_internal(self, template, value, device_state) -> (json, bool, int):
-        import requests, warnings
-        from requests.packages.urllib3.exceptions import InsecureRequestWarning
-
-        params = self._params
+    def prepare_params(self, device, template, value):
+        """Return request parameters of device updated with rendered connection template."""
+        params = device.bind_params(self._params)
         if template is not None:
             params.update(json.loads(template.render(value=value)))
-        
-        with warnings.catch_warnings():
-            warnings.filterwarnings("ignore", category=InsecureRequestWarning)
-            with requests.sessions.Session() as session:
-                self.logger.info(self._params)
-                try:
-                    resp = session.request(**self._params)
-                    self.logger.info("Command executed with code: {}, text: {}".format(resp.status_code, resp.text))
-                except:
-                    # something goes wrong, print callstack and return None
-                    self.logger.error("Request execution failed. Stack trace:")
-                    traceback.print_exc()
-                    return (None, False, 0)
+        return params
 
-        if resp and resp.ok:
-            if resp.status_code == 200:
-                try:
-                    j = resp.json()
-                    return (j, True, resp.status_code)
-                except:
-                    self.logger.warning("Parsing response json failed!")
-            else:
-                return ({}, True, resp.status_code)
+    def execute_internal(self, device, template, value, device_state) -> (json, bool, int):
+        return device.execute_request_with_retry(self.prepare_params(device, template, value))
 
-        elif resp:
-            self.logger.error("Execution failed, status code: {}, text: {}".format(resp.status_code, resp.text))
-            return (None, False, resp.status_code)
-        else:
-            self.logger.error("Execution failed, unknown error")
-        
-        return (None, False, 0)
+    def execute(self, device, template, value, device_state):
+        if self.embedded_command:
+            device.trace.record("Embedded command found, executing...")
+            self.embedded_command.execute(device, template, value, device_state)
+
+        if not self.check_execute_condition(device, device_state):
+            device.trace.record("Execute condition not met, skipping command")
+            return ({}, True, 200)
 
-    def execute(self, template, value, device_state):
+        device.trace.record("Executing command...")
+        return self.execute_internal(device, template, value, device_state)[0]
+
+    async def async_execute_internal(self, device, template, value, device_state) -> (json, bool, int):
+        return await device.async_execute_request_with_retry(self.prepare_params(device, template, value))
+
+    async def async_execute(self, device, template, value, device_state):
         if self.embedded_command:
-            self.logger.info("Embedded command found, executing...")
-            self.embedded_command.execute(template, value, device_state)
+            device.trace.record("Embedded command found, executing...")
+            await self.embedded_command.async_execute(device, template, value, device_state)
 
-        if not self.check_execute_condition(device_state):
-            self.logger.info("Execute condition not met, skipping command")
+        if not self.check_execute_condition(device, device_state):
+            device.trace.record("Execute condition not met, skipping command")
             return ({}, True, 200)
 
-        self.logger.info("Executing command...")
-        j, ok, code = self.execute_internal(template, value, device_state)
-        if not j and 500 <= code < 505:
-            # server error, try again
-            time.sleep(1.0)
-            j = self.execute_internal(template, value, device_state)[0]
-        
-        return j
+        device.trace.record("Executing command...")
+        return (await self.async_execute_internal(device, template, value, device_state))[0]
+
+    def prepare_batch(self, device, template, value, device_state):
+        """Only plain JSON writes are batched, commands with embedded command or 
+        execute condition are executed on their own."""
+        if self.embedded_command is not None or self.condition_template is not None:
+            return None
+        params = self.prepare_params(device, template, value)
+        if 'json' not in params or 'data' in params:
+            return None
+        return BatchCommand(self, params)
+
+    @staticmethod
+    def merge_json(target, source):
+        """Merge source JSON object into target. Nested objects are merged, lists are concatenated."""
+        for key, value in source.items():
+            current = target.get(key, None)
+            if isinstance(value, dict) and isinstance(current, dict):
+                ConnectionRequestBase.merge_json(current, value)
+            elif isinstance(value, list) and isinstance(current, list):
+                current.extend([v for v in value if v not in current])
+            else:
+                target[key] = copy.deepcopy(value)
+
+    @staticmethod
+    def merge_batch(commands):
+        """Return list of request parameters, writes to the same endpoint are merged into one request."""
+        merged = {}
+        for command in commands:
+            params = command.data
+            key = json.dumps({ k : v for k, v in params.items() if k != 'json' }, sort_keys = True, default = str)
+            if key in merged:
+                ConnectionRequestBase.merge_json(merged[key]['json'], params['json'])
+            else:
+                merged[key] = params.copy()
+                merged[key]['json'] = copy.deepcopy(params['json'])
+        return list(merged.values())
+
+    def execute_batch(self, device, commands):
+        result = True
+        for params in self.merge_batch(commands):
+            device.trace.record("Executing batched command...")
+            j, ok, code = device.execute_request_with_retry(params)
+            result = ok and result
+        return result
+
+    async def async_execute_batch(self, device, commands):
+        result = True
+        for params in self.merge_batch(commands):
+            device.trace.record("Executing batched command...")
+            j, ok, code = await device.async_execute_request_with_retry(params)
+            result = ok and result
+        return result
 
 @register_connection
 class ConnectionRequest(ConnectionRequestBase):
-    def __init__(self, hass_config, logger):
-        super(ConnectionRequest, self).__init__(hass_config, logger)
+    __slots__ = ()
+
+    def __init__(self, logger):
+        super(ConnectionRequest, self).__init__(logger)
 
     @staticmethod
     def match_type(type):
         return type == CONNECTION_TYPE_REQUEST
 
-    def create_updated(self, node):
-        c = ConnectionRequest(None, self.logger)
-        c.load_from_yaml(node, self)
-        return c
+class AsyncRequestDevice(RequestDevice):
+    """REST device using aiohttp, synchronous requests are sent by requests session."""
+    def __init__(self, config, logger):
+        super(AsyncRequestDevice, self).__init__(config, logger)
+        self._async_session = AsyncDeviceSession()
 
-test_json = {'Devices' : [{'Alarms':[{'alarmType':'Device','code':'FilterAlarm','id':'0','triggeredTime':'2019-02-25T08:46:01'}],'ConfigurationLink':{'href':'/devices/0/configuration'},'Diagnosis':{'diagnosisStart':'Ready'},'EnergyConsumption':{'saveLocation':'/files/usage.db'},'InformationLink':{'href':'/devices/0/information'},'Mode':{'modes':['Auto'],'options':['Comode_Off','Sleep_0','Autoclean_Off','Spi_Off','FilterCleanAlarm_0','OutdoorTemp_63','CoolCapa_35','WarmCapa_40','UsagesDB_254','FilterTime_10000','OptionCode_54458','UpdateAllow_0','FilterAlarmTime_500','Function_15','Volume_100'],'supportedModes':['Cool','Dry','Wind','Auto']},'Operation':{'power':'Off'},'Temperatures':[{'current':22.0,'desired':25.0,'id':'0','maximum':30,'minimum':16,'unit':'Celsius'}],'Wind':{'direction':'Fix','maxSpeedLevel':4,'speedLevel':0},'connected':True,'description':'TP6X_RAC_16K','id':'0','name':'RAC','resources':['Alarms','Configuration','Diagnosis','EnergyConsumption','Information','Mode','Operation','Temperatures','Wind'],'type':'Air_Conditioner','uuid':'00000000-0000-0000-0000-000000000000' } ] }
+    async def async_execute_request(self, params) -> (json, bool, int):
+        import aiohttp
+
+        self.trace.record("{}", params)
+        request = { 'method' : params.get('method', 'GET'), 'url' : params.get('url') }
+        for key in ['params', 'data', 'json', 'headers', 'cookies']:
+            if key in params:
+                request[key] = params[key]
+        request['timeout'] = aiohttp.ClientTimeout(total = params.get('timeout', None))
+
+        try:
+            request['ssl'] = await self._async_session.async_get_ssl_context(params.get('verify', True), params.get(CONF_CERT, None))
+            session = await self._async_session.async_get()
+            self.metrics.increment(COUNTER_BYTES_OUT, self.request_size(request))
+            async with session.request(**request) as resp:
+                status_code = resp.status
+                self.metrics.increment(COUNTER_BYTES_IN, len(await resp.read()))
+                text = await resp.text()
+            self.trace.record("Command executed with code: {}, text: {}", status_code, text)
+        except:
+            # something goes wrong, drop pooled connections, print callstack and return None
+            self.record_exception(asyncio.TimeoutError)
+            await self._async_session.async_close()
+            self.logger.error("Request execution failed. Stack trace:")
+            traceback.print_exc()
+            self.trace.dump("Request execution failed")
+            return (None, False, 0)
+
+        if 200 <= status_code < 400:
+            if status_code == 200:
+                try:
+                    with profile_stage(STAGE_PARSE):
+                        j = json.loads(text)
+                    return (j, True, status_code)
+                except:
+                    self.logger.warning("Parsing response json failed!")
+            else:
+                return ({}, True, status_code)
+        else:
+            self.logger.error("Execution failed, status code: {}, text: {}".format(status_code, text))
+            self.trace.dump("Execution failed")
+        
+        return (None, False, status_code)
 
 @register_connection
-class ConnectionRequestPrint(ConnectionRequestBase):
-    def __init__(self, hass_config, logger):
-        super(ConnectionRequestPrint, self).__init__(hass_config, logger)
+class ConnectionRequestAsync(ConnectionRequestBase):
+    """REST connection using aiohttp. Accepts the same parameters as 'request' connection
+    and falls back to it when executed synchronously."""
+    __slots__ = ()
+    device_class = AsyncRequestDevice
+
+    def __init__(self, logger):
+        super(ConnectionRequestAsync, self).__init__(logger)
 
     @staticmethod
     def match_type(type):
-        return type == CONNECTION_TYPE_REQUEST_PRINT
+        return type == CONNECTION_TYPE_REQUEST_ASYNC
 
-    def create_updated(self, node):
-        c = ConnectionRequestPrint(None, self.logger)
-        c.load_from_yaml(node, self)
-        return c
+test_json = {'Devices' : [{'Alarms':[{'alarmType':'Device','code':'FilterAlarm','id':'0','triggeredTime':'2019-02-25T08:46:01'}],'ConfigurationLink':{'href':'/devices/0/configuration'},'Diagnosis':{'diagnosisStart':'Ready'},'EnergyConsumption':{'saveLocation':'/files/usage.db'},'InformationLink':{'href':'/devices/0/information'},'Mode':{'modes':['Auto'],'options':['Comode_Off','Sleep_0','Autoclean_Off','Spi_Off','FilterCleanAlarm_0','OutdoorTemp_63','CoolCapa_35','WarmCapa_40','UsagesDB_254','FilterTime_10000','OptionCode_54458','UpdateAllow_0','FilterAlarmTime_500','Function_15','Volume_100'],'supportedModes':['Cool','Dry','Wind','Auto']},'Operation':{'power':'Off'},'Temperatures':[{'current':22.0,'desired':25.0,'id':'0','maximum':30,'minimum':16,'unit':'Celsius'}],'Wind':{'direction':'Fix','maxSpeedLevel':4,'speedLevel':0},'connected':True,'description':'TP6X_RAC_16K','id':'0','name':'RAC','resources':['Alarms','Configuration','Diagnosis','EnergyConsumption','Information','Mode','Operation','Temperatures','Wind'],'type':'Air_Conditioner','uuid':'00000000-0000-0000-0000-000000000000' } ] }
 
-    def execute_internal(self, template, value, device_state) -> (json, bool, int):
-        self.logger.info("ConnectionRequestPrint, execute with params: {}".format(self._params))
+class PrintRequestDevice(RequestDevice):
+    """Device answering every request with test_json."""
+    def execute_request(self, params) -> (json, bool, int):
+        self.trace.record("ConnectionRequestPrint, execute with params: {}", params)
         return (test_json, True, 200)
+
+@register_connection
+class ConnectionRequestPrint(ConnectionRequestBase):
+    __slots__ = ()
+    device_class = PrintRequestDevice
+
+    def __init__(self, logger):
+        super(ConnectionRequestPrint, self).__init__(logger)
+
+    @staticmethod
+    def match_type(type):
+        return type == CONNECTION_TYPE_REQUEST_PRINT
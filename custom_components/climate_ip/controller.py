@@ -1,3 +1,5 @@
+from .connection import (async_run_in_executor)
+
 ATTR_POWER = 'power'
 
 CLIMATE_CONTROLLERS = []
@@ -9,10 +11,17 @@ class ClimateController:
     def initialize(self):
         return False
 
+    async def async_initialize(self):
+        return await async_run_in_executor(self.initialize)
+
     @property
     def poll(self):
         return None
 
+    @property
+    def push(self):
+        return None
+
     @property
     def id(self):
         return None
@@ -24,16 +33,69 @@ class ClimateController:
     @property
     def debug(self):
         return False
+
+    @property
+    def failed_updates(self):
+        """Number of consecutive failed state updates."""
+        return 0
+
+    @property
+    def metrics(self):
+        """Performance metrics of the device (DeviceMetrics) or None."""
+        return None
+
+    @property
+    def profiler(self):
+        """Profiler of device state updates (Profiler) or None."""
+        return None
+
+    @property
+    def trace(self):
+        """Trace of the last device events (TraceBuffer) or None."""
+        return None
         
+    @property
+    def refresh_needed(self):
+        """Check if state written by the last command has to be read from device now."""
+        return True
+
     def update_state(self):
         return False
 
+    async def async_update_state(self):
+        return await async_run_in_executor(self.update_state)
+
     def set_property(self, property_name, new_value):
         return False
 
+    async def async_set_property(self, property_name, new_value):
+        return await async_run_in_executor(self.set_property, property_name, new_value)
+
+    def set_properties(self, values):
+        """Set properties from list of (name, value) pairs. Return True if all were set."""
+        result = True
+        for property_name, new_value in values:
+            result = self.set_property(property_name, new_value) and result
+        return result
+
+    async def async_set_properties(self, values):
+        return await async_run_in_executor(self.set_properties, values)
+
     def get_property(self, property_name):
         return None
 
+    def start_push_updates(self, callback):
+        """Start receiving state pushed by device, callback(device_state) is called from connection thread.
+        Return False if device does not push its state."""
+        return False
+
+    def stop_push_updates(self):
+        pass
+
+    def apply_push_update(self, device_state):
+        """Update controller from device state passed to push callback."""
+        pass
+
     @property
     def state_attributes(self):
         raise NotImplementedError()
@@ -72,3 +134,14 @@ def create_controller(type, config, logger) -> ClimateController:
     logger.error("climate_ip: controller for type {} not found!".format(type))
     return None
 
+async def async_create_controller(type, config, logger) -> ClimateController:
+    for ctrl in CLIMATE_CONTROLLERS:
+        if ctrl.match_type(type):
+            c = ctrl(config, logger)
+            if await c.async_initialize():
+                return c
+            else:
+                logger.error("climate_ip: error while initializing controller for type {}!".format(type))
+    logger.error("climate_ip: controller for type {} not found!".format(type))
+    return None
+
@@ -1,12 +1,15 @@
 import yaml
+import itertools
 import logging
 import os
+from collections import namedtuple
 
 from .yaml_const import (
     CONFIG_DEVICE, CONFIG_DEVICE_CONNECTION, CONFIG_DEVICE_STATUS,
     CONFIG_DEVICE_OPERATIONS, CONFIG_DEVICE_ATTRIBUTES,
     CONF_CONFIG_FILE, CONFIG_DEVICE_NAME, CONFIG_DEVICE_VALIDATE_PROPS,
-    CONFIG_DEVICE_CONNECTION_PARAMS, CONFIG_DEVICE_POLL,
+    CONFIG_DEVICE_POLL, CONFIG_DEVICE_PUSH,
+    CONF_PROFILE,
 )
 
 from .controller import (
@@ -15,11 +18,29 @@ from .controller import (
 
 from .properties import (
     create_status_getter, 
-    create_property
+    create_property,
+    StateChanges,
 )
 
 from .connection import (
-    create_connection
+    create_connection, async_run_in_executor,
+)
+
+from .metrics import (
+    DeviceMetrics, METRIC_UPDATE,
+)
+
+from .trace import (
+    TraceBuffer,
+)
+
+from .profile_cache import (
+    load_definitions,
+)
+
+from .profiling import (
+    Profiler, profile_stage,
+    STAGE_UPDATE, STAGE_PUSH_UPDATE, STAGE_STATUS, STAGE_OPERATION, STAGE_ATTRIBUTE,
 )
 
 from homeassistant.const import (
@@ -36,30 +57,50 @@ import voluptuous as vol
 CONST_CONTROLLER_TYPE = 'yaml'
 CONST_MAX_GET_STATUS_RETRIES = 4
 
-class StreamWrapper(object):
-    def __init__(self, stream, token, ip_address):
-        self.stream = stream
-        self.leftover = ''
-        self.token = token
-        self.ip_address = ip_address
+DeviceProfile = namedtuple('DeviceProfile', ['name', 'poll', 'push', 'validate_props', 'connection',
+    'state_getter', 'operations', 'properties', 'service_schema_map'])
+DeviceProfile.__doc__ = """Connection and property definitions loaded from profile, shared by all devices using it."""
+
+def create_device_profile(yaml_device, logger):
+    """Create definitions from parsed profile. Return None if profile is invalid."""
+    if not isinstance(yaml_device, dict) or CONFIG_DEVICE not in yaml_device:
+        logger.error("Missing '{}' configuration node".format(CONFIG_DEVICE))
+        return None
 
-    def read(self, size):
-        data = self.leftover
-        count = len(self.leftover)
+    ac = yaml_device.get(CONFIG_DEVICE, {})
+    validate_props = ac.get(CONFIG_DEVICE_VALIDATE_PROPS, False)
+    logger.info("Validate properties: {} ({})".format(validate_props, ac.get(CONFIG_DEVICE_VALIDATE_PROPS, False)))
+    connection_node = ac.get(CONFIG_DEVICE_CONNECTION, {})
+    connection = create_connection(connection_node, logger)
+    
+    if connection is None:
+        logger.error("Cannot create connection object!")
+        return None
 
-        if count < size:
-            chunk = self.stream.read(size)
+    state_getter = create_status_getter('state', ac.get(CONFIG_DEVICE_STATUS, {}), connection)
+    if state_getter == None:
+        logger.error("Missing 'state' configuration node")
+        return None
 
-            if self.token is not None:
-                chunk = chunk.replace('__CLIMATE_IP_TOKEN__', self.token)
-            if self.ip_address is not None:
-                chunk = chunk.replace('__CLIMATE_IP_HOST__', self.ip_address)
+    operations = []
+    service_schema_map = { vol.Optional(ATTR_ENTITY_ID) : cv.comp_entity_ids }
+    nodes = ac.get(CONFIG_DEVICE_OPERATIONS, {})
+    for op_key in nodes.keys():
+        op = create_property(op_key, nodes[op_key], connection)
+        if op is not None:
+            operations.append(op)
+            service_schema_map[vol.Optional(op.id)] = op.config_validation_type
 
-            data += chunk
-            count += len(chunk)
+    properties = []
+    nodes = ac.get(CONFIG_DEVICE_ATTRIBUTES, {})
+    for key in nodes.keys():
+        prop = create_property(key, nodes[key], connection)
+        if prop is not None:
+            properties.append(prop)
 
-        self.leftover = data[size:]
-        return data[:size]
+    return DeviceProfile(ac.get(ATTR_NAME, CONST_CONTROLLER_TYPE), ac.get(CONFIG_DEVICE_POLL, None), 
+        ac.get(CONFIG_DEVICE_PUSH, None), validate_props, connection, state_getter, operations, properties,
+        service_schema_map)
 
 @register_controller
 class YamlController(ClimateController):
@@ -73,6 +114,7 @@ class YamlController(ClimateController):
         self._name = CONST_CONTROLLER_TYPE
         self._attributes = { 'controller' : self.id }
         self._state_getter = None
+        self._device = None
         self._debug = config.get('debug', False)
         self._temp_unit = TEMP_CELSIUS
         self._service_schema_map = { vol.Optional(ATTR_ENTITY_ID) : cv.comp_entity_ids }
@@ -81,21 +123,44 @@ class YamlController(ClimateController):
         self._ip_address = config.get(CONF_IP_ADDRESS, None)
         self._token = config.get(CONF_TOKEN, None)
         self._config = config
-        self._retries_count = 0
+        self._failed_updates = 0
         self._last_device_state = None
+        self._evaluated_state = None
+        self._pending_writes = set()
         self._poll = None
+        self._push = None
+        self._push_callback = None
+        self._validate_props = False
+        self._metrics = DeviceMetrics()
+        self._trace = TraceBuffer(logger)
+        self._profiler = Profiler(os.path.basename(str(self._yaml)), config.get(CONF_PROFILE, 0))
 
     @property
     def poll(self):
         return self._poll
+
+    @property
+    def push(self):
+        return self._push
        
     @property
     def id(self):
         return CONST_CONTROLLER_TYPE
 
     def initialize(self):
-        connection_params = { CONFIG_DEVICE_CONNECTION_PARAMS : { } }
-        
+        if not self.load_profile():
+            return False
+        self.update_state()
+        return self.validate_operations()
+
+    async def async_initialize(self):
+        if not await async_run_in_executor(self.load_profile):
+            return False
+        await self.async_update_state()
+        return self.validate_operations()
+
+    def load_profile(self):
+        """Load device profile and create state of its operations and properties."""
         file = self._yaml
         if file is not None and file.find('\\') == -1 and file.find('/') == -1:
             file = os.path.join(os.path.dirname(__file__), file)
@@ -106,54 +171,47 @@ class YamlController(ClimateController):
         if self._token is not None:
             self._logger.info("token: {}".format(self._token))
 
-        with open(file, 'r') as stream:
-            try:
-                yaml_device = yaml.load(StreamWrapper(stream, self._token, self._ip_address), Loader=yaml.FullLoader)
-            except yaml.YAMLError as exc:
-                if self._logger is not None:
-                    self._logger.error("YAML error: {}".format(exc))
-                return False
-            except FileNotFoundError:
-                if self._logger is not None:
-                    self._logger.error("Cannot open YAML configuration file '{}'".format(self._yaml))
-                return False
-    
-        validate_props = False
-        if CONFIG_DEVICE in yaml_device:
-            ac = yaml_device.get(CONFIG_DEVICE, {})
-            self._poll = ac.get(CONFIG_DEVICE_POLL, None)
-            validate_props = ac.get(CONFIG_DEVICE_VALIDATE_PROPS, False)
-            self._logger.info("Validate properties: {} ({})".format(validate_props, ac.get(CONFIG_DEVICE_VALIDATE_PROPS, False)))
-            connection_node = ac.get(CONFIG_DEVICE_CONNECTION, {})
-            connection = create_connection(connection_node, self._config, self._logger)
-            
-            if connection is None:
-                self._logger.error("Cannot create connection object!")
-                return False
-
-            self._state_getter = create_status_getter('state', ac.get(CONFIG_DEVICE_STATUS, {}), connection)
-            if self._state_getter == None:
-                self._logger.error("Missing 'state' configuration node")
-                return False
-
-            nodes = ac.get(CONFIG_DEVICE_OPERATIONS, {})
-            for op_key in nodes.keys():
-                op = create_property(op_key, nodes[op_key], connection)
-                if op is not None:
-                    self._operations[op.id] = op
-                    self._service_schema_map[vol.Optional(op.id)] = op.config_validation_type
-
-            nodes = ac.get(CONFIG_DEVICE_ATTRIBUTES, {})
-            for key in nodes.keys():
-                prop = create_property(key, nodes[key], connection)
-                if prop is not None:
-                    self._properties[prop.id] = prop
-
-            self._name = ac.get(ATTR_NAME, CONST_CONTROLLER_TYPE)
-
-        self.update_state()
-
-        if validate_props:
+        try:
+            # definitions are shared, device keeps only the state of this device
+            profile = load_definitions(file, lambda yaml_device: create_device_profile(yaml_device, self._logger), 
+                self._token, self._ip_address)
+        except yaml.YAMLError as exc:
+            if self._logger is not None:
+                self._logger.error("YAML error: {}".format(exc))
+            return False
+        except FileNotFoundError:
+            if self._logger is not None:
+                self._logger.error("Cannot open YAML configuration file '{}'".format(self._yaml))
+            return False
+        if profile is None:
+            self._logger.error("Invalid YAML configuration file '{}'".format(self._yaml))
+            return False
+
+        self._device = profile.connection.create_device(self._config, self._logger)
+        if self._device is None:
+            return False
+        self._metrics = self._device.metrics
+        self._trace = self._device.trace
+        self._poll = profile.poll
+        self._push = profile.push
+        self._validate_props = profile.validate_props
+
+        self._state_getter = profile.state_getter.create_state(self._device)
+        self._service_schema_map = dict(profile.service_schema_map)
+        for definition in profile.operations:
+            op = definition.create_state(self._device)
+            self._operations[op.id] = op
+
+        for definition in profile.properties:
+            prop = definition.create_state(self._device)
+            self._properties[prop.id] = prop
+
+        self._name = profile.name
+        return True
+
+    def validate_operations(self):
+        """Drop operations not valid for current device state if profile asks for it."""
+        if self._validate_props:
             ops = {}
             device_state = self._state_getter.value
             for op in self._operations.values():
@@ -181,44 +239,232 @@ class YamlController(ClimateController):
     @property
     def debug(self):
         return self._debug
+
+    @property
+    def failed_updates(self):
+        return self._failed_updates
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def profiler(self):
+        return self._profiler
+
+    @property
+    def trace(self):
+        return self._trace
+
+    @property
+    def refresh_needed(self):
+        return len(self._pending_writes) > 0
         
     def update_state(self):
-        debug = self._debug
-        self._logger.info("Updating state...")
+        self._trace.record("Updating state...")
+        if self._state_getter is not None:
+            with self._metrics.timer(METRIC_UPDATE), self._profiler.cycle(STAGE_UPDATE):
+                self._trace.record("Updating getter...")
+                with profile_stage(STAGE_STATUS):
+                    self._state_getter.update_state(self._state_getter.value, self._debug)
+                self.update_properties()
+
+    async def async_update_state(self):
+        self._trace.record("Updating state asynchronously...")
         if self._state_getter is not None:
-            self._attributes = { ATTR_NAME : self.name }
-            self._logger.info("Updating getter...")
-            self._state_getter.update_state(self._state_getter.value, debug)
+            with self._metrics.timer(METRIC_UPDATE), self._profiler.cycle(STAGE_UPDATE):
+                self._trace.record("Updating getter...")
+                with profile_stage(STAGE_STATUS):
+                    await self._state_getter.async_update_state(self._state_getter.value, self._debug)
+                self.update_properties()
+
+    def update_properties(self):
+        """Update operations and attributes from the state fetched by the status getter."""
+        if self._state_getter is not None:
+            attributes = { ATTR_NAME : self.name }
             device_state = self._state_getter.value
-            self._logger.info("Getter updated with value: {}".format(device_state))
-            if device_state is None and self._retries_count > 0:
-                --self._retries_count
-                device_state = self._last_device_state
-                self._attributes['failed_retries'] = CONST_MAX_GET_STATUS_RETRIES - --self._retries_count
+            self._trace.record("Getter updated with value: {}", device_state)
+            if device_state is None:
+                # keep last known state for a few failed updates
+                self._failed_updates += 1
+                if self._failed_updates <= CONST_MAX_GET_STATUS_RETRIES:
+                    device_state = self._last_device_state
+                    attributes['failed_retries'] = self._failed_updates
             else:
-                self._retries_count = CONST_MAX_GET_STATUS_RETRIES
+                self._failed_updates = 0
                 self._last_device_state = device_state
-            if debug:
-                self._attributes.update(self._state_getter.state_attributes)
-            self._logger.info("Updating operations...")
-            for op in self._operations.values():
-                op.update_state(device_state, debug)
+                self._pending_writes = set()
+            self.evaluate_properties(device_state, attributes)
+
+    def evaluate_properties(self, device_state, attributes):
+        """Update operations and properties from device state. Operations with written values which could not
+        be applied to device state keep showing them until device state is read from device."""
+        debug = self._debug
+        self._attributes = attributes
+        if debug:
+            self._attributes.update(self._state_getter.state_attributes)
+            self._attributes.update(self._metrics.attributes)
+        # only properties reading changed parts of device state are evaluated again
+        changes = None
+        if device_state is not None and self._evaluated_state is not None:
+            changes = StateChanges(self._evaluated_state, device_state)
+            self._trace.record("Device state changes: {0.changes}", changes)
+        self._trace.record("Updating operations...")
+        for op in self._operations.values():
+            if op.id in self._pending_writes:
+                op.device_state = device_state
+            else:
+                with profile_stage(STAGE_OPERATION + op.id):
+                    op.update_changed_state(device_state, debug, changes)
+            self._attributes.update(op.state_attributes)
+        self._trace.record("Updating properties...")
+        for prop in self._properties.values():
+            with profile_stage(STAGE_ATTRIBUTE + prop.id):
+                prop.update_changed_state(device_state, debug, changes)
+            self._attributes.update(prop.state_attributes)
+        self._evaluated_state = device_state
+
+    def start_push_updates(self, callback):
+        """Start receiving state pushed by device. Callback is called with device state from connection thread,
+        it has to pass the state to apply_push_update where polls and commands update the controller (event loop)."""
+        if self._state_getter is None:
+            return False
+        self._push_callback = callback
+        return self._device.start_push_updates(self.handle_push_update)
+
+    def stop_push_updates(self):
+        if self._device is not None:
+            self._device.stop_push_updates()
+        self._push_callback = None
+
+    def handle_push_update(self, device_state):
+        self._trace.record("Device state pushed")
+        callback = self._push_callback
+        if callback is not None:
+            callback(device_state)
+
+    def apply_push_update(self, device_state):
+        """Update properties from device state pushed by device."""
+        self._trace.record("Applying pushed device state")
+        with self._profiler.cycle(STAGE_PUSH_UPDATE):
+            with profile_stage(STAGE_STATUS):
+                self._state_getter.process_device_state(device_state)
+            self.update_properties()
+
+    def apply_optimistic_state(self, writes):
+        """Write values accepted by device into copy of the last device state and update properties from it,
+        so properties derived from written values (e.g. hvac mode from power) change too.
+        Values which cannot be written back are pending until device state is read from device (refresh_needed)."""
+        device_state = self._evaluated_state
+        for op, new_value in writes:
+            written = op.apply_to_device_state(new_value, device_state)
+            if written is None:
+                self._trace.record("Value of {} cannot be applied to device state, refresh needed", op.id)
+                self._pending_writes.add(op.id)
+            else:
+                device_state = written
+                self._pending_writes.discard(op.id)
+        if device_state is self._evaluated_state:
+            for op, _ in writes:
                 self._attributes.update(op.state_attributes)
-            self._logger.info("Updating properties...")
-            for prop in self._properties.values():
-                prop.update_state(device_state, debug)
-                self._attributes.update(prop.state_attributes)
+            return
+        self._trace.record("Applying written values to device state")
+        self._state_getter.current_value = device_state
+        self._last_device_state = device_state
+        self.evaluate_properties(device_state, { ATTR_NAME : self.name })
 
     def set_property(self, property_name, new_value):
-        print("SETTING UP property {} to {}".format(property_name, new_value))
+        self._logger.info("Setting property {} to {}".format(property_name, new_value))
         op = self._operations.get(property_name, None)
         if op is not None:
             result = op.set_value(new_value)
-            print("SETTING UP property {} to {} -> FINISHED with result {}".format(property_name, new_value, result))
+            if result:
+                self.apply_optimistic_state([(op, new_value)])
+            self._logger.info("Setting property {} to {} finished with result {}".format(property_name, new_value, result))
             return result
-        print("SETTING UP property {} to {} -> FAILED - wrong property".format(property_name, new_value))
+        self._logger.error("Cannot set property {} to {}: wrong property".format(property_name, new_value))
         return False
 
+    async def async_set_property(self, property_name, new_value):
+        op = self._operations.get(property_name, None)
+        if op is not None:
+            result = await op.async_set_value(new_value)
+            if result:
+                self.apply_optimistic_state([(op, new_value)])
+            return result
+        self._logger.error("Cannot set property {} to {}: wrong property".format(property_name, new_value))
+        return False
+
+    def prepare_batch(self, values):
+        """Split writes into steps executed in order. Each step is either list of (operation, value, command)
+        executed as one batch or (operation, value) pair which has to be set on its own."""
+        steps = []
+        batch = []
+        for property_name, new_value in values:
+            op = self._operations.get(property_name, None)
+            if op is None:
+                self._logger.error("Cannot set property {} to {}: wrong property".format(property_name, new_value))
+                steps.append((None, new_value))
+                continue
+            command = op.prepare_batch(new_value)
+            if command is not None:
+                batch.append((op, new_value, command))
+                continue
+            if batch:
+                steps.append(batch)
+                batch = []
+            steps.append((op, new_value))
+        if batch:
+            steps.append(batch)
+        return steps
+
+    @staticmethod
+    def group_batch(batch):
+        """Group consecutive writes by connection type, each group is executed by one connection."""
+        for _, group in itertools.groupby(batch, key = lambda write: type(write[2].connection)):
+            group = list(group)
+            yield (group[0][2].connection, group)
+
+    def apply_batch_result(self, writes, result):
+        """Show written values once device accepted the batch."""
+        if result:
+            for op, new_value, _ in writes:
+                op.set_optimistic_value(new_value)
+            self.apply_optimistic_state([(op, new_value) for op, new_value, _ in writes])
+        return result
+
+    def set_properties(self, values):
+        result = True
+        for step in self.prepare_batch(values):
+            if isinstance(step, tuple):
+                op, new_value = step
+                ok = op is not None and op.set_value(new_value)
+                if ok:
+                    self.apply_optimistic_state([(op, new_value)])
+                result = ok and result
+            else:
+                for connection, writes in self.group_batch(step):
+                    self._trace.record("Executing {} batched writes", len(writes))
+                    ok = connection.execute_batch(self._device, [command for _, _, command in writes])
+                    result = self.apply_batch_result(writes, ok) and result
+        return result
+
+    async def async_set_properties(self, values):
+        result = True
+        for step in self.prepare_batch(values):
+            if isinstance(step, tuple):
+                op, new_value = step
+                ok = op is not None and await op.async_set_value(new_value)
+                if ok:
+                    self.apply_optimistic_state([(op, new_value)])
+                result = ok and result
+            else:
+                for connection, writes in self.group_batch(step):
+                    self._trace.record("Executing {} batched writes", len(writes))
+                    ok = await connection.async_execute_batch(self._device, [command for _, _, command in writes])
+                    result = self.apply_batch_result(writes, ok) and result
+        return result
+
     def get_property(self, property_name):
         if property_name in self._operations:
             return self._operations[property_name].value
@@ -230,7 +476,7 @@ class YamlController(ClimateController):
 
     @property
     def state_attributes(self):
-        self._logger.info("Controller::state_attributes")
+        self._trace.record("Controller::state_attributes")
         return self._attributes
 
     @property
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import random
+import time
+from collections import namedtuple
+
+DEFAULT_MAX_CONCURRENT_REQUESTS = 8
+DEFAULT_POLL_INTERVAL = 15 # in seconds
+DEFAULT_FAST_POLL_INTERVAL = 5 # in seconds, used after commands
+DEFAULT_ACTIVE_POLL_INTERVAL = 10 # in seconds, used while temperature is changing
+DEFAULT_IDLE_POLL_INTERVAL = 60 # in seconds, used when device is off
+DEFAULT_MAX_POLL_INTERVAL = 300 # in seconds, limit of backoff while device is unreachable
+CONST_FAST_POLL_PERIOD = 60 # in seconds after command
+CONST_POLL_JITTER = 0.1 # relative
+CONST_POLL_STAGGER = 0.5 # in seconds
+
+PollStatus = namedtuple('PollStatus', ['failures', 'powered_off', 'changing', 'last_command'])
+PollStatus.__doc__ = """Device state used to choose polling interval. failures is number of consecutive
+failed updates, last_command is time.monotonic() of the last command or None."""
+
+_LOGGER = logging.getLogger(__name__)
+
+class AdaptivePollPolicy():
+    """Choose interval to the next poll of a device from its PollStatus."""
+    def __init__(self, interval = DEFAULT_POLL_INTERVAL, fast_interval = DEFAULT_FAST_POLL_INTERVAL,
+            active_interval = DEFAULT_ACTIVE_POLL_INTERVAL, idle_interval = DEFAULT_IDLE_POLL_INTERVAL, 
+            max_interval = DEFAULT_MAX_POLL_INTERVAL, jitter = CONST_POLL_JITTER):
+        self._interval = interval
+        self._fast_interval = min(fast_interval, interval)
+        self._active_interval = min(active_interval, interval)
+        self._idle_interval = max(idle_interval, interval)
+        self._max_interval = max(max_interval, interval)
+        self._jitter = jitter
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def fast_interval(self):
+        return self._fast_interval
+
+    def base_interval(self, status):
+        if status is None:
+            return self._interval
+        if status.failures > 0:
+            # exponential backoff while device is unreachable
+            return min(self._interval * 2 ** min(status.failures, 16), self._max_interval)
+        if status.last_command is not None and time.monotonic() - status.last_command < CONST_FAST_POLL_PERIOD:
+            return self._fast_interval
+        if status.changing:
+            return self._active_interval
+        if status.powered_off:
+            return self._idle_interval
+        return self._interval
+
+    def next_interval(self, status):
+        """Return interval with random jitter, so polls of devices do not synchronize."""
+        return self.base_interval(status) * random.uniform(1 - self._jitter, 1 + self._jitter)
+
+class ClimateIPHub():
+    """I/O hub shared by all climate_ip devices.
+
+    Every device call goes through async_run, which serializes calls to the same host
+    and limits number of calls in flight for the whole integration. Devices registered
+    for polling are polled by a single scheduler loop in order of their due time."""
+    def __init__(self, max_concurrent_requests = DEFAULT_MAX_CONCURRENT_REQUESTS,
+            poll_interval = DEFAULT_POLL_INTERVAL, policy = None):
+        self._max_concurrent_requests = max_concurrent_requests
+        self._poll_interval = poll_interval
+        self._policy = policy if policy is not None else AdaptivePollPolicy(poll_interval)
+        self._semaphore = None
+        self._host_locks = {}
+        self._poll_due = {}
+        self._poll_errors = {}
+        self._polling = set()
+        self._poll_task = None
+        self._poll_device_tasks = set()
+        self._poll_wakeup = None
+
+    @property
+    def poll_interval(self):
+        return self._poll_interval
+
+    def host_lock(self, host):
+        lock = self._host_locks.get(host, None)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._host_locks[host] = lock
+        return lock
+
+    async def async_run(self, host, func, *args):
+        """Run coroutine function func(*args) for device at host and return its result."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrent_requests)
+        async with self.host_lock(host):
+            async with self._semaphore:
+                return await func(*args)
+
+    def async_register(self, device):
+        """Register device for polling. Device must provide async_poll coroutine."""
+        loop = asyncio.get_running_loop()
+        stagger = (len(self._poll_due) * CONST_POLL_STAGGER) % self._poll_interval
+        self._poll_due[device] = loop.time() + stagger
+        if self._poll_task is None:
+            self._poll_wakeup = asyncio.Event()
+            self._poll_task = loop.create_task(self._async_poll_loop())
+        self._poll_wakeup.set()
+
+    def async_unregister(self, device):
+        self._poll_due.pop(device, None)
+        self._poll_errors.pop(device, None)
+
+    def async_poll_soon(self, device, delay = None):
+        """Bring next poll of device forward, e.g. to confirm state after command. 
+        Device is polled after delay, fast poll interval by default."""
+        if device not in self._poll_due or device in self._polling:
+            return
+        due = asyncio.get_running_loop().time() + (self._policy.fast_interval if delay is None else delay)
+        if due < self._poll_due[device]:
+            self._poll_due[device] = due
+            self._poll_wakeup.set()
+
+    async def async_stop(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            try:
+                await self._poll_task
+            except asyncio.CancelledError:
+                pass
+            self._poll_task = None
+        tasks = list(self._poll_device_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+        self._poll_due = {}
+
+    async def _async_poll_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            waiting = [(due, device) for device, due in self._poll_due.items() if device not in self._polling]
+            waiting.sort(key = lambda item: item[0])
+            timeout = None
+            for due, device in waiting:
+                if due > now:
+                    timeout = due - now
+                    break
+                self._polling.add(device)
+                task = loop.create_task(self._async_poll_device(device))
+                self._poll_device_tasks.add(task)
+                task.add_done_callback(self._poll_device_tasks.discard)
+
+            self._poll_wakeup.clear()
+            try:
+                await asyncio.wait_for(self._poll_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _async_poll_device(self, device):
+        loop = asyncio.get_running_loop()
+        try:
+            await device.async_poll()
+            self._poll_errors.pop(device, None)
+        except Exception:
+            _LOGGER.exception("Polling device failed")
+            self._poll_errors[device] = self._poll_errors.get(device, 0) + 1
+        finally:
+            self._polling.discard(device)
+            if device in self._poll_due:
+                status = getattr(device, 'poll_status', None)
+                errors = self._poll_errors.get(device, 0)
+                if errors > 0:
+                    status = status._replace(failures = max(status.failures, errors)) if status is not None \
+                        else PollStatus(errors, False, False, None)
+                interval = self._policy.next_interval(status)
+                _LOGGER.debug("Next poll in %.1fs", interval)
+                self._poll_due[device] = loop.time() + interval
+            self._poll_wakeup.set()
@@ -0,0 +1,183 @@
+import bisect
+import contextlib
+import threading
+import time
+
+CONST_DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # in seconds
+
+METRIC_REQUEST = 'request'
+METRIC_HANDSHAKE = 'handshake'
+METRIC_AUTH = 'auth'
+METRIC_RENDER = 'render'
+METRIC_UPDATE = 'update'
+
+COUNTER_RETRIES = 'retries'
+COUNTER_SKIPPED = 'skipped'
+COUNTER_TIMEOUTS = 'timeouts'
+COUNTER_ERRORS = 'errors'
+COUNTER_BYTES_IN = 'bytes_in'
+COUNTER_BYTES_OUT = 'bytes_out'
+
+HISTOGRAMS = {
+    METRIC_REQUEST : ('climate_ip_request_duration_seconds', 'Time from sending request to receiving its response.'),
+    METRIC_HANDSHAKE : ('climate_ip_handshake_duration_seconds', 'Time of TCP connect and TLS handshake.'),
+    METRIC_AUTH : ('climate_ip_auth_duration_seconds', 'Time of authentication after TLS handshake.'),
+    METRIC_RENDER : ('climate_ip_render_duration_seconds', 'Time of evaluating single property from device state.'),
+    METRIC_UPDATE : ('climate_ip_update_duration_seconds', 'Time of full device state update.'),
+}
+
+COUNTERS = {
+    COUNTER_RETRIES : ('climate_ip_retries_total', 'Requests sent again after failure.'),
+    COUNTER_SKIPPED : ('climate_ip_skipped_total', 'Requests not sent because device is not responding.'),
+    COUNTER_TIMEOUTS : ('climate_ip_timeouts_total', 'Requests which timed out.'),
+    COUNTER_ERRORS : ('climate_ip_errors_total', 'Requests failed because of connection errors.'),
+    COUNTER_BYTES_IN : ('climate_ip_received_bytes_total', 'Bytes received from device.'),
+    COUNTER_BYTES_OUT : ('climate_ip_sent_bytes_total', 'Bytes sent to device.'),
+}
+
+_DEVICES = {}
+_LOCK = threading.Lock()
+
+class Histogram():
+    """Cumulative histogram of durations in seconds with fixed buckets."""
+    def __init__(self, buckets = CONST_DURATION_BUCKETS):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count > 0 else None
+
+    def quantile(self, q):
+        """Return upper bound of bucket containing q-quantile, max for the last bucket."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self._buckets, self._counts):
+            total += count
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def cumulative_counts(self):
+        """Return list of (upper bound, observations not greater than bound), last bound is infinity."""
+        total = 0
+        result = []
+        for bound, count in zip(self._buckets + (float('inf'),), self._counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+class DeviceMetrics():
+    """Performance metrics of a single device, shared by all its connections and properties."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name, None)
+            if histogram is None:
+                histogram = Histogram()
+                self._histograms[name] = histogram
+            histogram.observe(seconds)
+
+    def increment(self, name, value = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def histogram(self, name):
+        return self._histograms.get(name, None)
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+    @property
+    def attributes(self):
+        """Return summary suitable for entity attributes, durations in milliseconds."""
+        attrs = {}
+        with self._lock:
+            for name, histogram in self._histograms.items():
+                attrs[name + '_count'] = histogram.count
+                attrs[name + '_avg_ms'] = round(histogram.mean * 1000, 1)
+                attrs[name + '_p95_ms'] = round(histogram.quantile(0.95) * 1000, 1)
+                attrs[name + '_max_ms'] = round(histogram.max * 1000, 1)
+            attrs.update(self._counters)
+        return attrs
+
+    def prometheus_samples(self, labels):
+        """Return list of (metric name, labels, value) samples in Prometheus text format order."""
+        samples = []
+        with self._lock:
+            for name, histogram in self._histograms.items():
+                metric = HISTOGRAMS[name][0]
+                for bound, count in histogram.cumulative_counts():
+                    samples.append((metric + '_bucket', dict(labels, le = format_value(bound)), count))
+                samples.append((metric + '_sum', labels, histogram.sum))
+                samples.append((metric + '_count', labels, histogram.count))
+            for name, value in self._counters.items():
+                samples.append((COUNTERS[name][0], labels, value))
+        return samples
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def register_metrics(key, metrics, labels):
+    """Make device metrics part of Prometheus dump, labels identify the device."""
+    with _LOCK:
+        _DEVICES[key] = (metrics, labels)
+
+def unregister_metrics(key):
+    with _LOCK:
+        _DEVICES.pop(key, None)
+
+def registered_metrics():
+    """Return dictionary mapping key to (metrics, labels) of all registered devices."""
+    with _LOCK:
+        return dict(_DEVICES)
+
+def prometheus_text():
+    """Return metrics of all registered devices in Prometheus text exposition format."""
+    samples = {}
+    for metrics, labels in registered_metrics().values():
+        for name, sample_labels, value in metrics.prometheus_samples(labels):
+            samples.setdefault(name, []).append((sample_labels, value))
+
+    lines = []
+    families = [(metric, help_text, 'histogram') for metric, help_text in HISTOGRAMS.values()] + \
+        [(metric, help_text, 'counter') for metric, help_text in COUNTERS.values()]
+    for metric, help_text, metric_type in families:
+        names = [metric + suffix for suffix in ('_bucket', '_sum', '_count')] if metric_type == 'histogram' else [metric]
+        if not any(name in samples for name in names):
+            continue
+        lines.append('# HELP {} {}'.format(metric, help_text))
+        lines.append('# TYPE {} {}'.format(metric, metric_type))
+        for name in names:
+            for sample_labels, value in samples.get(name, []):
+                label_text = ','.join('{}="{}"'.format(k, escape_label(v)) for k, v in sample_labels.items())
+                lines.append('{}{{{}}} {}'.format(name, label_text, format_value(value)))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import marshal
+import os
+import threading
+
+from .templates import (cache_directory)
+from .yaml_const import (CONFIG_DEVICE_CONNECTION_PARAMS)
+
+CONST_PROFILE_CACHE_PATTERN = 'climate_ip-profile-{}.cache'
+
+PLACEHOLDER_TOKEN = '__CLIMATE_IP_TOKEN__'
+PLACEHOLDER_HOST = '__CLIMATE_IP_HOST__'
+
+_PROFILES = {}
+_DEFINITIONS = {}
+_LOCK = threading.Lock()
+_LOGGER = logging.getLogger(__name__)
+
+def profile_key(content):
+    return hashlib.sha256(content).hexdigest()
+
+def cache_file(key):
+    directory = cache_directory()
+    return os.path.join(directory, CONST_PROFILE_CACHE_PATTERN.format(key)) if directory is not None else None
+
+def read_cached_profile(key):
+    """Return profile stored by a previous run or None."""
+    filename = cache_file(key)
+    if filename is None:
+        return None
+    try:
+        with open(filename, 'rb') as f:
+            return marshal.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError, TypeError):
+        _LOGGER.warning("Ignoring invalid profile cache file: {}".format(filename))
+        return None
+
+def write_cached_profile(key, profile):
+    filename = cache_file(key)
+    if filename is None:
+        return
+    temp = '{}.{}'.format(filename, os.getpid())
+    try:
+        with open(temp, 'wb') as f:
+            marshal.dump(profile, f)
+        os.replace(temp, filename)
+    except (OSError, ValueError):
+        # cache is optional, e.g. profile contains values marshal does not support
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+
+def parse_profile(content):
+    import yaml
+    return yaml.load(content.decode('utf-8'), Loader=yaml.FullLoader)
+
+def read_profile(file):
+    """Return content hash and parsed YAML profile. Profiles are cached by content hash in memory and in
+    the cache directory, so the file is parsed once, not for every device and Home Assistant start."""
+    with open(file, 'rb') as f:
+        content = f.read()
+    key = profile_key(content)
+    with _LOCK:
+        profile = _PROFILES.get(key, None)
+    if profile is None:
+        profile = read_cached_profile(key)
+        if profile is None:
+            profile = parse_profile(content)
+            write_cached_profile(key, profile)
+        with _LOCK:
+            _PROFILES[key] = profile
+    return (key, profile)
+
+def load_profile(file):
+    """Return parsed YAML profile. Returned structure is shared, use bind_profile to get a copy for a device."""
+    return read_profile(file)[1]
+
+def load_definitions(file, create, token, ip_address):
+    """Return result of create(profile), shared by all devices using profile with the same content.
+    Placeholders in connection params are left for devices to replace when request is sent, profile using
+    them anywhere else is bound first and its definitions are shared only by devices with the same token and host.
+    None results are not cached."""
+    key, profile = read_profile(file)
+    if has_placeholders(profile, CONFIG_DEVICE_CONNECTION_PARAMS):
+        key = (key, token, ip_address)
+        profile = bind_profile(profile, token, ip_address)
+    with _LOCK:
+        definitions = _DEFINITIONS.get(key, None)
+    if definitions is None:
+        definitions = create(profile)
+        if definitions is not None:
+            with _LOCK:
+                definitions = _DEFINITIONS.setdefault(key, definitions)
+    return definitions
+
+def placeholder_replacements(token, ip_address):
+    """Return list of (placeholder, value) pairs, None leaves placeholder unchanged."""
+    return [(placeholder, value) for placeholder, value in [(PLACEHOLDER_TOKEN, token),
+        (PLACEHOLDER_HOST, ip_address)] if value is not None]
+
+def bind_profile(node, token, ip_address):
+    """Return copy of profile with token and host placeholders replaced, None leaves placeholder unchanged."""
+    return bind_node(node, placeholder_replacements(token, ip_address))
+
+def bind_node(node, replacements):
+    if isinstance(node, str):
+        for placeholder, value in replacements:
+            if placeholder in node:
+                node = node.replace(placeholder, value)
+        return node
+    if isinstance(node, dict):
+        return { bind_node(k, replacements) : bind_node(v, replacements) for k, v in node.items() }
+    if isinstance(node, list):
+        return [bind_node(v, replacements) for v in node]
+    return node
+
+def has_placeholders(node, skip_key = None):
+    """Check if node contains token or host placeholder. Values of skip_key nodes are bound when request
+    is sent and are not checked, except templates which are compiled when profile is loaded."""
+    if isinstance(node, str):
+        return PLACEHOLDER_TOKEN in node or PLACEHOLDER_HOST in node
+    if isinstance(node, dict):
+        for k, v in node.items():
+            if k == skip_key and isinstance(v, dict):
+                v = { pk : pv for pk, pv in v.items() if str(pk).endswith('_template') }
+            if has_placeholders(k) or has_placeholders(v, skip_key):
+                return True
+        return False
+    if isinstance(node, list):
+        return any(has_placeholders(v, skip_key) for v in node)
+    return False
+
+def clear_cache():
+    """Drop profiles and definitions cached in memory, e.g. to measure cold start."""
+    with _LOCK:
+        _PROFILES.clear()
+        _DEFINITIONS.clear()
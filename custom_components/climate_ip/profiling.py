@@ -0,0 +1,128 @@
+import collections
+import contextlib
+import contextvars
+import marshal
+import threading
+import time
+
+STAGE_UPDATE = 'update_state'
+STAGE_PUSH_UPDATE = 'push_update'
+STAGE_STATUS = 'status'
+STAGE_NETWORK = 'network'
+STAGE_PARSE = 'parse'
+STAGE_STATUS_TEMPLATE = 'status_template'
+STAGE_STATUS_JSON = 'status_json'
+STAGE_OPERATION = 'operation:'
+STAGE_ATTRIBUTE = 'attribute:'
+
+# stage being measured in the current thread or task, None outside of profiled cycle
+_CURRENT_STAGE = contextvars.ContextVar('climate_ip_profile_stage', default = None)
+
+ProfileCycle = collections.namedtuple('ProfileCycle', ['name', 'started', 'records'])
+
+class ProfileStage():
+    """Stage being measured, path contains names of all enclosing stages."""
+    def __init__(self, path, records):
+        self.path = path
+        self.records = records
+        self.children_time = 0.0
+
+@contextlib.contextmanager
+def measure_stage(parent, name, records):
+    """Measure stage and add (path, total time, own time) record when it ends."""
+    stage = ProfileStage(parent.path + (name,) if parent is not None else (name,), records)
+    token = _CURRENT_STAGE.set(stage)
+    start = time.perf_counter()
+    try:
+        yield stage
+    finally:
+        duration = time.perf_counter() - start
+        _CURRENT_STAGE.reset(token)
+        if parent is not None:
+            parent.children_time += duration
+        records.append((stage.path, duration, duration - stage.children_time))
+
+def profile_stage(name):
+    """Measure stage of the cycle profiled in the current context, outside of cycle do nothing."""
+    parent = _CURRENT_STAGE.get()
+    if parent is None:
+        return contextlib.nullcontext()
+    return measure_stage(parent, name, parent.records)
+
+def stage_name(name):
+    """Stage names are separated by ';' and followed by space in folded stacks."""
+    return str(name).replace(';', '_').replace(' ', '_')
+
+class Profiler():
+    """Opt-in profiler of device state updates, keeps per-stage timings of the last cycles."""
+    def __init__(self, name, max_cycles = 0):
+        self._name = name
+        self._cycles = collections.deque(maxlen = max(max_cycles, 1))
+        self._lock = threading.Lock()
+        self.enabled = max_cycles > 0
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def cycles(self):
+        with self._lock:
+            return list(self._cycles)
+
+    def cycle(self, name):
+        """Start profiled cycle. Cycle started inside another one is measured as its stage."""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        parent = _CURRENT_STAGE.get()
+        if parent is not None:
+            return measure_stage(parent, name, parent.records)
+        return self.measure_cycle(name)
+
+    @contextlib.contextmanager
+    def measure_cycle(self, name):
+        records = []
+        started = time.time()
+        try:
+            with measure_stage(None, name, records):
+                yield
+        finally:
+            with self._lock:
+                self._cycles.append(ProfileCycle(name, started, records))
+
+    def function(self, name):
+        """Every stage is reported as function of the device configuration file."""
+        return (self._name, 0, stage_name(name))
+
+    def stats(self):
+        """Return timings of kept cycles as dictionary in the format stored by pstats."""
+        stats = {}
+        for cycle in self.cycles:
+            for path, total, own in cycle.records:
+                func = self.function(path[-1])
+                primitive = 0 if path[-1] in path[:-1] else 1
+                cc, nc, tt, ct, callers = stats.get(func, (0, 0, 0.0, 0.0, {}))
+                stats[func] = (cc + primitive, nc + 1, tt + own, ct + total * primitive, callers)
+                if len(path) > 1:
+                    caller = self.function(path[-2])
+                    c_nc, c_cc, c_tt, c_ct = callers.get(caller, (0, 0, 0.0, 0.0))
+                    callers[caller] = (c_nc + 1, c_cc + primitive, c_tt + own, c_ct + total)
+        return stats
+
+    def dump_stats(self, filename):
+        """Write timings readable by pstats.Stats, snakeviz and other cProfile viewers."""
+        with open(filename, 'wb') as f:
+            marshal.dump(self.stats(), f)
+
+    def folded(self):
+        """Return own time of stages in microseconds as folded stacks, input of flamegraph tools."""
+        totals = collections.OrderedDict()
+        for cycle in self.cycles:
+            for path, total, own in cycle.records:
+                key = ';'.join(stage_name(name) for name in path)
+                totals[key] = totals.get(key, 0.0) + own
+        return ''.join('{} {}\n'.format(key, int(round(value * 1000000))) for key, value in totals.items())
+
+    def dump_folded(self, filename):
+        with open(filename, 'w') as f:
+            f.write(self.folded())
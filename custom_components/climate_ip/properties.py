@@ -1,13 +1,18 @@
 import json
+import re
 import homeassistant.helpers.config_validation as cv
 from homeassistant.util.temperature import convert as convert_temperature
 from .yaml_const import (
     CONFIG_DEVICE_STATUS_TEMPLATE, CONFIG_DEVICE_CONNECTION_TEMPLATE, CONFIG_DEVICE_VALIDATION_TEMPLATE,
     CONFIG_TYPE, CONFIG_DEVICE_CONNECTION, CONFIG_DEVICE_OPERATION_VALUES, CONFIG_DEVICE_OPERATION_VALUE, 
     CONFIG_DEVICE_OPERATION_NUMBER_MIN, CONFIG_DEVICE_OPERATION_NUMBER_MAX, CONFIG_DEVICE_OPERATION_TEMP_UNIT_TEMPLATE,
+    CONFIG_DEVICE_STATUS_PATH, CONFIG_DEVICE_STATUS_TYPE,
     )
 
 from .connection import (Connection)
+from .templates import (get_template, optimize_template, template_dependencies)
+from .metrics import (METRIC_RENDER)
+from .profiling import (STAGE_NETWORK, STAGE_STATUS_TEMPLATE, STAGE_STATUS_JSON, profile_stage)
 
 from homeassistant.const import (
     STATE_UNKNOWN, STATE_OFF, STATE_ON, TEMP_CELSIUS, TEMP_FAHRENHEIT, 
@@ -22,6 +27,14 @@ PROPERTY_TYPE_NUMBER = 'number'
 PROPERTY_TYPE_TEMP = 'temperature'
 STATUS_GETTER_JSON = 'json_status'
 
+STATUS_TYPE_STRING = 'string'
+STATUS_TYPE_INT = 'int'
+STATUS_TYPE_FLOAT = 'float'
+
+# template which only looks up a value, optionally passed through int, float or string filter
+STATUS_PATH_TEMPLATE_RE = re.compile(
+    r'^\s*\{\{\s*device_state((?:\.(?:\d+|[A-Za-z_]\w*))+)\s*(?:\|\s*(int|float|string)\s*)?\}\}\s*$')
+
 UNIT_MAP = {
     'C': TEMP_CELSIUS,
     'c': TEMP_CELSIUS,
@@ -35,6 +48,168 @@ UNIT_MAP = {
 
 test_json = {'Devices':[{'Alarms':[{'alarmType':'Device','code':'FilterAlarm','id':'0','triggeredTime':'2019-02-25T08:46:01'}],'ConfigurationLink':{'href':'/devices/0/configuration'},'Diagnosis':{'diagnosisStart':'Ready'},'EnergyConsumption':{'saveLocation':'/files/usage.db'},'InformationLink':{'href':'/devices/0/information'},'Mode':{'modes':['Auto'],'options':['Comode_Off','Sleep_0','Autoclean_Off','Spi_Off','FilterCleanAlarm_0','OutdoorTemp_63','CoolCapa_35','WarmCapa_40','UsagesDB_254','FilterTime_10000','OptionCode_54458','UpdateAllow_0','FilterAlarmTime_500','Function_15','Volume_100'],'supportedModes':['Cool','Dry','Wind','Auto']},'Operation':{'power':'Off'},'Temperatures':[{'current':22.0,'desired':25.0,'id':'0','maximum':30,'minimum':16,'unit':'Celsius'}],'Wind':{'direction':'Fix','maxSpeedLevel':4,'speedLevel':0},'connected':True,'description':'TP6X_RAC_16K','id':'0','name':'RAC','resources':['Alarms','Configuration','Diagnosis','EnergyConsumption','Information','Mode','Operation','Temperatures','Wind'],'type':'Air_Conditioner','uuid':'C0972729-EB73-0000-0000-000000000000'}]}
 
+_MISSING = object()
+
+def raise_missing():
+    from jinja2.exceptions import UndefinedError
+    raise UndefinedError("value is undefined")
+
+def cast_string(v):
+    return '' if v is _MISSING else str(v)
+
+def cast_int(v):
+    if v is _MISSING:
+        raise_missing()
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        try:
+            return int(float(v))
+        except (TypeError, ValueError):
+            return 0
+
+def cast_float(v):
+    if v is _MISSING:
+        raise_missing()
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return 0.0
+
+STATUS_TYPES = {
+    STATUS_TYPE_STRING : cast_string,
+    STATUS_TYPE_INT : cast_int,
+    STATUS_TYPE_FLOAT : cast_float,
+}
+
+class StatusPath():
+    """Direct lookup of a value in device state, replaces Jinja render of plain lookup templates.
+
+    Path is a dot separated list of keys, numbers are list indexes, e.g. 'Devices.0.Wind.speedLevel'.
+    Lookup follows Jinja rules: missing last key gives empty value, missing intermediate key raises."""
+    def __init__(self, path, value_type = None, as_text = False):
+        self._path = str(path)
+        self._keys = [int(k) if k.isdigit() else k for k in self._path.split('.')]
+        self._cast = STATUS_TYPES[value_type if value_type is not None else STATUS_TYPE_STRING]
+        self._as_text = as_text
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def keys(self):
+        return tuple(self._keys)
+
+    @staticmethod
+    def from_template(source):
+        """Return StatusPath equivalent to template source or None if template is not a plain lookup."""
+        m = STATUS_PATH_TEMPLATE_RE.match(source)
+        if m is None:
+            return None
+        path = m.group(1)[1:]
+        for key in path.split('.'):
+            # Jinja resolves names of dict and list attributes before items
+            if hasattr(dict, key) or hasattr(list, key):
+                return None
+        return StatusPath(path, m.group(2), True)
+
+    def lookup(self, device_state):
+        v = device_state
+        last = len(self._keys) - 1
+        for i, key in enumerate(self._keys):
+            try:
+                v = v[key]
+            except (TypeError, LookupError):
+                if i < last:
+                    from jinja2.exceptions import UndefinedError
+                    raise UndefinedError("'{}' has no attribute '{}'".format(type(v).__name__, key))
+                return _MISSING
+        return v
+
+    def render(self, device_state):
+        v = self._cast(self.lookup(device_state))
+        return str(v) if self._as_text else v
+
+    def replace(self, device_state, value):
+        """Return copy of device state with value at path replaced. Only containers on the path are copied,
+        the rest is shared with device state. Return None if path does not exist in device state."""
+        v = self._replace(device_state, 0, value)
+        return None if v is _MISSING else v
+
+    def _replace(self, node, index, value):
+        key = self._keys[index]
+        if not isinstance(node, (dict, list)):
+            return _MISSING
+        try:
+            item = node[key]
+        except (TypeError, LookupError):
+            return _MISSING
+        if index + 1 < len(self._keys):
+            value = self._replace(item, index + 1, value)
+            if value is _MISSING:
+                return _MISSING
+        node = type(node)(node)
+        node[key] = value
+        return node
+
+def is_scalar(v):
+    return v is None or isinstance(v, (str, int, float, bool))
+
+def changed_paths(old, new, path = (), changes = None):
+    """Return set of paths of values which differ between old and new device state.
+    For changed list items also paths ending with old and new item are added, so tests like
+    '"Spi_On" in device_state.Mode.options' are matched."""
+    if changes is None:
+        changes = set()
+    if old is new:
+        return changes
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old.keys() | new.keys():
+            if key not in old or key not in new:
+                changes.add(path + (key,))
+            else:
+                changed_paths(old[key], new[key], path + (key,), changes)
+    elif isinstance(old, list) and isinstance(new, list):
+        for i in range(max(len(old), len(new))):
+            items = [l[i] for l in (old, new) if i < len(l)]
+            if len(items) == 2:
+                count = len(changes)
+                changed_paths(items[0], items[1], path + (i,), changes)
+                if count == len(changes):
+                    continue
+            else:
+                changes.add(path + (i,))
+            changes.update([path + (item,) for item in items if is_scalar(item)])
+    elif type(old) is not type(new) or old != new:
+        changes.add(path)
+    return changes
+
+class StateChanges():
+    """Paths changed between two device states, used to skip evaluation of properties which did not change."""
+    def __init__(self, old, new):
+        self._changes = changed_paths(old, new)
+        self._prefixes = set()
+        for path in self._changes:
+            for i in range(len(path) + 1):
+                self._prefixes.add(path[:i])
+
+    @property
+    def changes(self):
+        return self._changes
+
+    def affects(self, dependencies):
+        """Check if any of dependency paths or values under them changed. None dependencies means unknown."""
+        if dependencies is None:
+            return True
+        for path in dependencies:
+            if path in self._prefixes:
+                return True
+            for i in range(len(path)):
+                if path[:i] in self._changes:
+                    return True
+        return False
+
 def register_property(dev_prop):
     """Decorate a function to register a propery."""
     CLIMATE_IP_PROPERTIES.append(dev_prop)
@@ -63,23 +238,95 @@ def create_status_getter(name, node, connection_base):
                     return g
     return None
 
+class PropertyState():
+    """Property of a single device. Property definition is loaded once per profile and shared by all devices 
+    using it, state keeps only current value and device handle. Methods are forwarded to the definition."""
+    __slots__ = ('definition', 'device', 'current_value', 'device_state', 'dirty', 'extra')
+
+    def __init__(self, definition, device, value, extra = None):
+        self.definition = definition
+        self.device = device
+        self.current_value = value
+        self.device_state = None
+        self.dirty = False
+        self.extra = extra
+
+    @property
+    def id(self):
+        return self.definition.id
+
+    @property
+    def name(self):
+        return self.definition.name
+
+    @property
+    def config_validation_type(self):
+        return self.definition.config_validation_type
+
+    @property
+    def value(self):
+        return self.definition.get_value(self)
+
+    @property
+    def state_attributes(self):
+        return self.definition.get_state_attributes(self)
+
+    def is_valid(self, device_state):
+        return self.definition.is_valid(self, device_state)
+
+    def update_state(self, device_state, debug):
+        return self.definition.update_state(self, device_state, debug)
+
+    async def async_update_state(self, device_state, debug):
+        return await self.definition.async_update_state(self, device_state, debug)
+
+    def update_changed_state(self, device_state, debug, changes):
+        return self.definition.update_changed_state(self, device_state, debug, changes)
+
+    def process_device_state(self, device_state):
+        return self.definition.process_device_state(self, device_state)
+
+    def set_value(self, v):
+        return self.definition.set_value(self, v)
+
+    async def async_set_value(self, v):
+        return await self.definition.async_set_value(self, v)
+
+    def set_optimistic_value(self, v):
+        self.definition.set_optimistic_value(self, v)
+
+    def apply_to_device_state(self, v, device_state):
+        return self.definition.apply_to_device_state(self, v, device_state)
+
+    def prepare_batch(self, v):
+        return self.definition.prepare_batch(self, v)
+
+    def match_value(self, v):
+        return self.definition.match_value(self, v)
+
 class DeviceProperty:
+    """Property loaded from device profile. Properties do not change after loading, values of a device
+    are kept in PropertyState created by create_state."""
     def __init__(self, name, connection):
         self._name = name
-        self._value = STATE_UNKNOWN
         self._connection = connection
         self._status_template = None
+        self._status_path = None
+        self._dependencies = frozenset()
         self._id = name
         self._connection_template = None
         self._validation_template = None
-        self._device_state = None
 
     @property
     def id(self):
         return self._id
 
-    def is_valid(self, device_state):
-        self._device_state = device_state
+    def create_state(self, device):
+        """Return state of the property for device."""
+        return PropertyState(self, device, STATE_UNKNOWN)
+
+    def is_valid(self, state, device_state):
+        state.device_state = device_state
         if self.validation_template == None or device_state == None:
             return True
         else:
@@ -99,8 +346,16 @@ class DeviceProperty:
         return self._status_template
 
     @property
-    def value(self):
-        return self._value
+    def status_path(self):
+        return self._status_path
+
+    @property
+    def state_dependencies(self):
+        """Set of device state paths read by property or None if unknown."""
+        return self._dependencies
+
+    def get_value(self, state):
+        return state.current_value
 
     @property
     def name(self):
@@ -119,88 +374,160 @@ class DeviceProperty:
 
     def load_from_yaml(self, node):
         """Load configuration from yaml node dictionary. Return True if successful False otherwise."""
-        from jinja2 import Template
         if node is not None:
             if CONFIG_DEVICE_STATUS_TEMPLATE in node:
-                self._status_template = Template(node[CONFIG_DEVICE_STATUS_TEMPLATE])
+                self._status_template = get_template(node[CONFIG_DEVICE_STATUS_TEMPLATE])
+                self._status_path = StatusPath.from_template(optimize_template(node[CONFIG_DEVICE_STATUS_TEMPLATE]))
+                self._dependencies = template_dependencies(node[CONFIG_DEVICE_STATUS_TEMPLATE])
+            if CONFIG_DEVICE_STATUS_PATH in node:
+                status_type = node.get(CONFIG_DEVICE_STATUS_TYPE, None)
+                if status_type is not None and status_type not in STATUS_TYPES:
+                    return False
+                self._status_path = StatusPath(node[CONFIG_DEVICE_STATUS_PATH], status_type)
+                self._dependencies = frozenset([self._status_path.keys])
             if CONFIG_DEVICE_CONNECTION_TEMPLATE in node:
-                self._connection_template = Template(node[CONFIG_DEVICE_CONNECTION_TEMPLATE])
+                self._connection_template = get_template(node[CONFIG_DEVICE_CONNECTION_TEMPLATE])
             if CONFIG_DEVICE_VALIDATION_TEMPLATE in node:
-                self._validation_template = Template(node[CONFIG_DEVICE_VALIDATION_TEMPLATE])
+                self._validation_template = get_template(node[CONFIG_DEVICE_VALIDATION_TEMPLATE])
             self._connection = self._connection.create_updated(node.get(CONFIG_DEVICE_CONNECTION, {}))
             return True
         return False
 
-    def convert_dev_to_hass(self, dev_value):
+    def convert_dev_to_hass(self, state, dev_value):
         """Convert device state value to HASS."""
         return dev_value
     
-    def update_state(self, device_state, debug):
+    def update_state(self, state, device_state, debug):
         """Update property from device state and return current value."""
-        self._device_state = device_state
+        state.device_state = device_state
+        state.dirty = False
         v = STATE_UNKNOWN
-        if self.status_template is not None and device_state is not None:
-            v = self.status_template.render(device_state=device_state)
+        if self.status_path is not None and device_state is not None:
+            with state.device.metrics.timer(METRIC_RENDER):
+                v = self.status_path.render(device_state)
+        elif self.status_template is not None and device_state is not None:
+            with state.device.metrics.timer(METRIC_RENDER):
+                v = self.status_template.render(device_state=device_state)
         if v is not STATE_UNKNOWN:
-            self._value = self.convert_dev_to_hass(v)
-        return self.value
+            state.current_value = self.convert_dev_to_hass(state, v)
+        return self.get_value(state)
+
+    async def async_update_state(self, state, device_state, debug):
+        """Asynchronous version of update_state. Rendering does not do any I/O so it runs inline."""
+        return self.update_state(state, device_state, debug)
+
+    def update_changed_state(self, state, device_state, debug, changes):
+        """Update property if changes affect its dependencies, changes None means full update.
+        Property with optimistic value is always updated, so device state confirms or reverts it."""
+        if changes is None or state.dirty or changes.affects(self.state_dependencies):
+            return self.update_state(state, device_state, debug)
+        state.device_state = device_state
+        return self.get_value(state)
  
-    @property
-    def state_attributes(self):
+    def get_state_attributes(self, state):
         """Return dictionary with property attributes."""
-        return { self.id : self.value }
+        return { self.id : self.get_value(state) }
 
 @register_status_getter
 class GetJsonStatus(DeviceProperty):
     def __init__(self, name, connection):
         super(GetJsonStatus, self).__init__(name, connection)
-        self._json_status = None
-        self._attrs = {}
 
     @staticmethod
     def match_type(type):
         return type == STATUS_GETTER_JSON
 
-    def update_state(self, device_state, debug):
-        self._device_state = device_state
-        device_state = self.get_connection(None).execute(self.connection_template, None, device_state)
-        self._value = device_state
-        self._json_status = device_state
+    def create_state(self, device):
+        # extra keeps state attributes
+        return PropertyState(self, device, STATE_UNKNOWN, {})
+
+    def update_state(self, state, device_state, debug):
+        state.device_state = device_state
+        with profile_stage(STAGE_NETWORK):
+            device_state = self.get_connection(None).execute(state.device, self.connection_template, None, device_state)
+        return self.process_device_state(state, device_state)
+
+    async def async_update_state(self, state, device_state, debug):
+        state.device_state = device_state
+        with profile_stage(STAGE_NETWORK):
+            device_state = await self.get_connection(None).async_execute(state.device, self.connection_template, None, device_state)
+        return self.process_device_state(state, device_state)
+
+    def process_device_state(self, state, device_state):
+        """Store device state received from connection and return current value."""
+        state.current_value = device_state
         if device_state is not None:
-            self._attrs = { 'device_state' : json.dumps(device_state) }
+            attrs = { 'device_state' : json.dumps(device_state) }
+            attrs.update(state.device.state_attributes)
+            state.extra = attrs
             if self.status_template is not None:
                 try:
-                    v = self.status_template.render(device_state=device_state)
-                    v = v.replace("'", '"')
-                    v = v.replace("True", '"True"')
-                    self._value = json.loads(v)
+                    with profile_stage(STAGE_STATUS_TEMPLATE):
+                        v = self.status_template.render(device_state=device_state)
+                    with profile_stage(STAGE_STATUS_JSON):
+                        v = v.replace("'", '"')
+                        v = v.replace("True", '"True"')
+                        state.current_value = json.loads(v)
                 except:
                     pass # do nothing
         else:
-            self._attrs = { 'device_state' : None }
+            state.extra = { 'device_state' : None }
 
-        return self.value
+        return self.get_value(state)
 
-    @property
-    def state_attributes(self):
+    def get_state_attributes(self, state):
         """Return dictionary with property attributes."""
-        return self._attrs
+        return state.extra
 
 
 class DeviceOperation(DeviceProperty):
     def __init__(self, name, connection):
         super(DeviceOperation, self).__init__(name, connection)
 
-    def set_value(self, v):
+    def set_value(self, state, v):
         """Set device property value."""
-        resp = self.get_connection(v).execute(self.connection_template, self.convert_hass_to_dev(v), self._device_state)
+        resp = self.get_connection(v).execute(state.device, self.connection_template, 
+            self.convert_hass_to_dev(state, v), state.device_state)
+        if resp is not None:
+            self.set_optimistic_value(state, v)
         return resp is not None
 
-    def match_value(self, value):
+    async def async_set_value(self, state, v):
+        """Set device property value asynchronously."""
+        resp = await self.get_connection(v).async_execute(state.device, self.connection_template, 
+            self.convert_hass_to_dev(state, v), state.device_state)
+        if resp is not None:
+            self.set_optimistic_value(state, v)
+        return resp is not None
+
+    def set_optimistic_value(self, state, v):
+        """Show value accepted by device until next device state update confirms or reverts it."""
+        state.dirty = True
+        try:
+            state.current_value = self.convert_dev_to_hass(state, self.convert_hass_to_dev(state, v))
+        except:
+            pass # keep last known value
+
+    def apply_to_device_state(self, state, v, device_state):
+        """Return copy of device state with value written as device reports it, so properties derived 
+        from it can be updated. Return None if value cannot be written back, e.g. status is rendered by template."""
+        if self.status_path is None or device_state is None:
+            return None
+        try:
+            return self.status_path.replace(device_state, self.convert_hass_to_dev(state, v))
+        except:
+            return None
+
+    def prepare_batch(self, state, v):
+        """Prepare write of value to be merged with other writes. Return None if it cannot be batched."""
+        return self.get_connection(v).prepare_batch(state.device, self.connection_template, 
+            self.convert_hass_to_dev(state, v), state.device_state)
+
+    def match_value(self, state, value):
         """Check if value match to operation. True if value is correct."""
         return False
 
-    def convert_hass_to_dev(self, hass_value):
+    def convert_hass_to_dev(self, state, hass_value):
         """Convert HASS state value to device state."""
         return hass_value
 
@@ -240,15 +567,15 @@ class BasicDeviceOperation(DeviceOperation):
     def values(self):
         return self._values
 
-    def match_value(self, value):
+    def match_value(self, state, value):
         """Check if value match to operation. True if value is correct."""
         return value in self._values_ha_to_dev_map  
 
-    def convert_dev_to_hass(self, dev_value):
+    def convert_dev_to_hass(self, state, dev_value):
         """Convert device state value to HASS."""
         return self._values_dev_to_ha_map.get(dev_value, dev_value)
     
-    def convert_hass_to_dev(self, ha_value):
+    def convert_hass_to_dev(self, state, ha_value):
         """Convert HASS state value to device state."""
         return self._values_ha_to_dev_map.get(ha_value, ha_value)
 
@@ -262,11 +589,10 @@ class ModeOperation(BasicDeviceOperation):
     def match_type(type):
         return type == PROPERTY_TYPE_MODE
 
-    @property
-    def state_attributes(self):
+    def get_state_attributes(self, state):
         """Return dictionary with property attributes."""
         data = {}
-        data[self.id] = self.value
+        data[self.id] = self.get_value(state)
         data[self.name + '_modes'] = self.values
         return data
 
@@ -295,13 +621,14 @@ class BasicNumericOperation(DeviceOperation):
         super(BasicNumericOperation, self).__init__(name, connection)
         self._min = None
         self._max = None
-        self._value = 0.0
+
+    def create_state(self, device):
+        return PropertyState(self, device, 0.0)
  
-    @property
-    def value(self):
+    def get_value(self, state):
         f = 0
         try:
-            f = float(self._value)
+            f = float(state.current_value)
         except:
             f = None
         return f
@@ -310,10 +637,10 @@ class BasicNumericOperation(DeviceOperation):
     def config_validation_type(self):
         return cv.positive_int
 
-    def match_value(self, value):
+    def match_value(self, state, value):
         """Check if value match to operation. True if value is correct."""
         try:
-            return self.convert_hass_to_dev(float(value)) == value
+            return self.convert_hass_to_dev(state, float(value)) == value
         except ValueError:
             return False
     
@@ -329,7 +656,7 @@ class BasicNumericOperation(DeviceOperation):
 
         return False
 
-    def convert_hass_to_dev(self, hass_value):
+    def convert_hass_to_dev(self, state, hass_value):
         """Convert HASS state value to device state."""
         if self._min is not None and hass_value < self._min:
             return self._min
@@ -353,38 +680,41 @@ class TemperatureOperation(BasicNumericOperation):
     def __init__(self, name, connection):
         super(TemperatureOperation, self).__init__(name, connection)
         self._unit_template = None
-        self._unit = TEMP_CELSIUS
 
     @staticmethod
     def match_type(type):
         return type == PROPERTY_TYPE_TEMP
 
     def load_from_yaml(self, node):
-        from jinja2 import Template
         """Load configuration from yaml node dictionary. Return True if successful False otherwise."""
         if not super(TemperatureOperation, self).load_from_yaml(node):
             return False
 
         if node is not None and CONFIG_DEVICE_OPERATION_TEMP_UNIT_TEMPLATE in node:
-            self._unit_template = Template(node[CONFIG_DEVICE_OPERATION_TEMP_UNIT_TEMPLATE])
+            self._unit_template = get_template(node[CONFIG_DEVICE_OPERATION_TEMP_UNIT_TEMPLATE])
+            self._dependencies = self._dependencies | template_dependencies(node[CONFIG_DEVICE_OPERATION_TEMP_UNIT_TEMPLATE])
         return True
 
-    def update_state(self, device_state, debug):
+    def create_state(self, device):
+        # extra keeps temperature unit of device
+        return PropertyState(self, device, 0.0, TEMP_CELSIUS)
+
+    def update_state(self, state, device_state, debug):
         if self._unit_template is not None and device_state is not None:
             try:
                 unit = self._unit_template.render(device_state=device_state)
                 if unit in UNIT_MAP:
-                    self._unit = UNIT_MAP[unit]
+                    state.extra = UNIT_MAP[unit]
             except:
                 pass # skip temperature unit rendering
         
-        return super(TemperatureOperation, self).update_state(device_state, debug)
+        return super(TemperatureOperation, self).update_state(state, device_state, debug)
  
-    def convert_dev_to_hass(self, dev_value):
+    def convert_dev_to_hass(self, state, dev_value):
         """Convert device state value to HASS."""
-        return convert_temperature(float(dev_value), self._unit, TEMP_CELSIUS)
+        return convert_temperature(float(dev_value), state.extra, TEMP_CELSIUS)
     
-    def convert_hass_to_dev(self, hass_value):
+    def convert_hass_to_dev(self, state, hass_value):
         v =  hass_value
         """Convert HASS state value to device state."""
         if self._min is not None and hass_value < self._min:
@@ -392,4 +722,4 @@ class TemperatureOperation(BasicNumericOperation):
         if self._max is not None and hass_value > self._max:
             v = self._max
         
-        return convert_temperature(float(v), TEMP_CELSIUS, self._unit)
+        return convert_temperature(float(v), TEMP_CELSIUS, state.extra)
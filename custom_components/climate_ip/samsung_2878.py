@@ -1,14 +1,26 @@
-from .connection import (register_connection, Connection)
+from .connection import (register_connection, Connection, Device, BatchCommand)
 from .yaml_const import (CONFIG_DEVICE_CONNECTION_PARAMS, CONFIG_DEVICE_POWER_TEMPLATE,
     CONFIG_DEVICE_CONNECTION_TEMPLATE, CONF_CERT, CONFIG_DEVICE_CONNECTION,
 )
 from homeassistant.const import (CONF_PORT, CONF_TOKEN, CONF_MAC, CONF_IP_ADDRESS)
 from .properties import (register_status_getter, DeviceProperty)
+from .templates import (get_template)
+from .profiling import (STAGE_PARSE, profile_stage)
+from .metrics import (
+    METRIC_REQUEST, METRIC_HANDSHAKE, METRIC_AUTH, COUNTER_RETRIES, COUNTER_TIMEOUTS, COUNTER_ERRORS,
+    COUNTER_BYTES_IN, COUNTER_BYTES_OUT,
+)
 from socket import * 
+from collections import namedtuple
+from xml.sax.saxutils import unescape
+import codecs
 import json
 import logging
+import select
 import sys
 import ssl
+import threading
+import time
 import traceback
 import re
 import os
@@ -17,6 +29,100 @@ CONNECTION_TYPE_S2878 = 'samsung_2878'
 
 CONF_DUID = 'duid'
 CONST_STATUS_OK_STR = 'Status="Okay"'
+CONST_PUSH_RECONNECT_DELAY = 10 # in seconds
+CONST_PUSH_CONNECT_TIMEOUT = 5 # in seconds
+CONST_RESPONSE_TIMEOUT = 5 # in seconds
+CONST_MAX_FRAME_SIZE = 1024 * 1024
+CONST_SOCKET_READ_SIZE = 4096
+CONST_SSL_CIPHERS = "HIGH:!DH:!aNULL"
+
+FRAME_RESPONSE = 'Response'
+FRAME_UPDATE = 'Update'
+
+REQUEST_TYPE_RE = re.compile('<Request Type="([^"]*)"')
+FRAME_START_RE = re.compile(r'<(Response|Update)(?=[\s/>])')
+XML_ATTRIBUTE_RE = re.compile(r'([\w:.-]+)\s*=\s*"([^"]*)"')
+ATTR_ELEMENT_RE = re.compile(r'<Attr ID="([^"]*)"[^>]*? Value="([^"]*)"')
+CONTROL_REQUEST_RE = re.compile(r'^\s*<Request Type="DeviceControl"><Control ([^>]*)>((?:\s*<Attr [^>]*/>)+)\s*</Control></Request>\s*$')
+ATTR_TAG_RE = re.compile(r'<Attr ID="([^"]*)"[^>]*/>')
+
+Frame = namedtuple('Frame', ['tag', 'type', 'status', 'attributes', 'values', 'raw'])
+Frame.__doc__ = """Single Response or Update document received from device. 
+attributes holds attributes of the root element, values maps Attr ID to Value."""
+
+_SSL_CONTEXTS = {}
+_SSL_CONTEXTS_LOCK = threading.Lock()
+
+def get_ssl_context(cert, ciphers, logger):
+    """Return SSL context shared by all connections using the same certificate and ciphers.
+    Sharing the context is also required to resume TLS sessions after reconnect."""
+    key = (cert, ciphers)
+    with _SSL_CONTEXTS_LOCK:
+        sslContext = _SSL_CONTEXTS.get(key, None)
+        if sslContext is None:
+            logger.info("Creating ssl context")
+            sslContext = ssl.SSLContext(ssl.PROTOCOL_TLSv1)
+            logger.info("Setting up ciphers")
+            sslContext.set_ciphers(ciphers)
+            logger.info("Setting up verify mode")
+            sslContext.verify_mode = ssl.CERT_REQUIRED if cert is not None else ssl.CERT_NONE
+            if cert is not None:
+                logger.info("Setting up verify location: {}".format(cert))
+                sslContext.load_verify_locations(cafile = cert)
+                logger.info("Setting up load cert chain: {}".format(cert))
+                sslContext.load_cert_chain(cert)
+            else:
+                logger.info("Cert is empty, skipping verification")
+            _SSL_CONTEXTS[key] = sslContext
+    return sslContext
+
+class Samsung2878StreamParser():
+    """Incremental parser splitting socket stream into complete Response and Update frames."""
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors = 'replace')
+        self._buffer = ''
+
+    def feed(self, data):
+        """Add received bytes and return list of frames completed by them."""
+        buf = self._buffer + self._decoder.decode(data)
+        frames = []
+        pos = 0
+        while True:
+            f = FRAME_START_RE.search(buf, pos)
+            if f is None:
+                # keep possible beginning of next frame start tag
+                last = buf.rfind('<', pos)
+                pos = last if last != -1 else len(buf)
+                break
+            tag = f.group(1)
+            head_end = buf.find('>', f.end())
+            if head_end == -1:
+                pos = f.start()
+                break
+            if buf[head_end - 1] == '/':
+                end = head_end + 1
+            else:
+                end = buf.find('</' + tag + '>', head_end)
+                if end == -1:
+                    pos = f.start()
+                    break
+                end += len(tag) + 3
+            frames.append(self.parse_frame(tag, buf[f.start():end]))
+            pos = end
+
+        self._buffer = buf[pos:]
+        if len(self._buffer) > CONST_MAX_FRAME_SIZE:
+            self._buffer = ''
+        return frames
+
+    @staticmethod
+    def parse_frame(tag, raw):
+        attributes = dict(XML_ATTRIBUTE_RE.findall(raw, 0, raw.find('>')))
+        values = dict(ATTR_ELEMENT_RE.findall(raw))
+        if '&' in raw:
+            for key, value in values.items():
+                values[key] = unescape(value, { '&quot;' : '"', '&apos;' : "'" })
+        return Frame(tag, attributes.get('Type'), attributes.get('Status'), attributes, values, raw)
 
 xml_test = '<?xml version="1.0" encoding="utf-8" ?><Response Type="DeviceState" Status="Okay"><DeviceState><Device DUID="XXXXXXX" GroupID="AC" ModelID="AC" ><Attr ID="AC_FUN_ENABLE" Type="RW" Value="Enable"/><Attr ID="AC_FUN_TEMPNOW" Type="R" Value="79"/><Attr ID="AC_FUN_TEMPSET" Type="RW" Value="24"/><Attr ID="AC_FUN_POWER" Type="RW" Value="On"/><Attr ID="AC_FUN_OPMODE" Type="RW" Value="Cool"/><Attr ID="AC_FUN_WINDLEVEL" Type="RW" Value="Auto"/><Attr ID="AC_FUN_ERROR" Type="R" Value="30303030"/><Attr ID="AC_ADD_STARTWPS" Type="RW" Value="0"/><Attr ID="AC_ADD_APMODE_END" Type="W" Value="0"/></Device></DeviceState></Response>'
 
@@ -28,247 +134,515 @@ class connection_config():
         self.duid = duid
         self.cert = cert
         self.socket = None
+        self.parser = None
+        self.device_status = {}
+        self.lock = threading.RLock()
+        self.push_callback = None
+        self.push_reader = None
+        self.push_stop = threading.Event()
+        self.push_connected = threading.Event()
+        self.responses = {}
+        self.failed_responses = {}
+        self.responses_cond = threading.Condition()
+        self.last_ack_latency = None
+        self.tls_session = None
+        self.last_handshake_time = None
 
-@register_connection
-class ConnectionSamsung2878(Connection):
-    def __init__(self, hass_config, logger):
-        super(ConnectionSamsung2878, self).__init__(hass_config, logger)
-        self._params = {}
-        self._connection_init_template = None
-        self._cfg = connection_config(None, None, None, None, None)
-        self._device_status = {}
+class Device2878(Device):
+    """Samsung 2878 device. Socket, push reader and received responses are shared by all connections of the device."""
+    def __init__(self, connection, config, logger):
+        super(Device2878, self).__init__(config, logger)
+        self._connection = connection
         self._socket_timeout = 1 # in seconds
-        self.update_configuration_from_hass(hass_config)
-        self._power_template = None
+        cert_file = config.get(CONF_CERT, None)
+        if cert_file == '':
+            cert_file = None
+        if cert_file is not None:
+            if cert_file.find('\\') == -1 and cert_file.find('/') == -1:
+                cert_file = os.path.join(os.path.dirname(__file__), cert_file)
 
-    def update_configuration_from_hass(self, hass_config):
-        if hass_config is not None:
-            cert_file = hass_config.get(CONF_CERT, None)
-            if cert_file == '':
-                cert_file = None
-            if cert_file is not None:
-                if cert_file.find('\\') == -1 and cert_file.find('/') == -1:
-                    cert_file = os.path.join(os.path.dirname(__file__), cert_file)
-
-            duid = None
-            mac = hass_config.get(CONF_MAC, None)
-            if mac is not None:
-                duid = re.sub(':', '', mac)
-            
-            cfg = connection_config(
-                hass_config.get(CONF_IP_ADDRESS, None), 
-                hass_config.get(CONF_PORT, 2878), 
-                hass_config.get(CONF_TOKEN, None),
-                cert_file,
-                duid)
+        duid = None
+        mac = config.get(CONF_MAC, None)
+        if mac is not None:
+            duid = re.sub(':', '', mac)
+        
+        self._cfg = connection_config(
+            config.get(CONF_IP_ADDRESS, None), 
+            config.get(CONF_PORT, 2878), 
+            config.get(CONF_TOKEN, None),
+            cert_file,
+            duid)
+        self._params[CONF_DUID] = self._cfg.duid
+        self._params[CONF_TOKEN] = self._cfg.token
 
-            self._cfg = cfg
-            self._params[CONF_DUID] = cfg.duid
-            self._params[CONF_TOKEN] = cfg.token
+    @property
+    def cfg(self):
+        return self._cfg
 
-    def load_from_yaml(self, node, connection_base):
-        from jinja2 import Template
-        if connection_base is not None:
-            self._params.update(connection_base._params.copy())
-        
-        if node is not None:
-            params_node = node.get(CONFIG_DEVICE_CONNECTION_PARAMS, {})
-            
-            if CONFIG_DEVICE_CONNECTION_TEMPLATE in params_node:
-                self._connection_init_template = Template(params_node[CONFIG_DEVICE_CONNECTION_TEMPLATE])
-            elif connection_base is None:
-                self.logger.error("ERROR: missing 'connection_template' parameter in connection section")
-                return False
+    @property
+    def device_status(self):
+        return self._cfg.device_status
 
-            if CONFIG_DEVICE_POWER_TEMPLATE in params_node:
-                self._power_template = Template(params_node[CONFIG_DEVICE_POWER_TEMPLATE])
-
-            if connection_base is None:
-                if self._cfg.host is None:
-                    self.logger.error("ERROR: missing 'host' parameter in configuration section")
-                    return False
-                if self._cfg.token is None or self._cfg.token == '':
-                    self.logger.error("ERROR: missing 'token' parameter in configuration section")
-                    return False
-                if self._cfg.duid == None:
-                    self.logger.error("ERROR: missing 'mac' parameter in configuration section")
-                    return False
-                if self._cfg.cert is None:
-                    self.logger.warning("WARNING: 'cert' parameter is empty, skipping certificate validation")
-                self.logger.info("Configuration, host: {}:{}".format(self._cfg.host, self._cfg.port))
-                self.logger.info("Configuration, token: {}".format(self._cfg.token))
-                self.logger.info("Configuration, duid: {}".format(self._cfg.duid))
-                self.logger.info("Configuration, cert: {}".format(self._cfg.cert))
-            
-            self._params.update(params_node)    
-            return True
+    @property
+    def push_active(self):
+        return self._cfg.push_reader is not None
 
-        return False
+    def start_push_updates(self, callback):
+        cfg = self._cfg
+        with cfg.lock:
+            cfg.push_callback = callback
+            if cfg.push_reader is None:
+                self.logger.info("Starting push updates reader")
+                cfg.push_stop.clear()
+                cfg.push_reader = threading.Thread(target = self.push_reader_loop, 
+                    name = 'climate_ip_{}'.format(cfg.host), daemon = True)
+                cfg.push_reader.start()
+        return True
 
-    @staticmethod
-    def match_type(type):
-        return type == CONNECTION_TYPE_S2878
+    def stop_push_updates(self):
+        cfg = self._cfg
+        reader = cfg.push_reader
+        if reader is not None:
+            self.logger.info("Stopping push updates reader")
+            cfg.push_stop.set()
+            reader.join(self._socket_timeout * 2)
+            cfg.push_reader = None
+            cfg.push_callback = None
 
-    def create_updated(self, node):
-        from jinja2 import Template
-        c = ConnectionSamsung2878(None, self.logger)
-        c._cfg = self._cfg
-        c._connection_init_template = self._connection_init_template
-        c._power_template = self._power_template
-        c.load_from_yaml(node, self)
-        return c
+    def notify_push_callback(self):
+        callback = self._cfg.push_callback
+        if callback is not None:
+            try:
+                callback(self._cfg.device_status)
+            except:
+                self.logger.error("Push update callback failed")
+                self.logger.error(traceback.format_exc())
 
-    def read_line_from_socket(self, sslSocket):
-        import select
-        reply = None
-        ready = select.select([sslSocket], [], [], self._socket_timeout)
-        self.logger.info("Reading data from socket...")
-        if ready and ready[0]:
-            reply = sslSocket.recv(4096).decode("utf-8")
-            self.logger.info("Response: {}".format(reply))
-        else:
-            self.logger.info("Timed out, no data to read")
-        return reply
+    def drop_connection(self):
+        cfg = self._cfg
+        cfg.push_connected.clear()
+        if cfg.socket is not None:
+            try:
+                cfg.socket.close()
+            except:
+                pass
+            cfg.socket = None
+
+    def push_reader_loop(self):
+        """Keep authenticated connection open and handle frames sent by device until stopped."""
+        cfg = self._cfg
+        if cfg.socket is not None:
+            cfg.push_connected.set()
+        while not cfg.push_stop.is_set():
+            sslSocket = cfg.socket
+            if sslSocket is None:
+                try:
+                    with cfg.lock:
+                        self.create_connection()
+                except:
+                    self.logger.error('Creating push connection failed')
+                    self.logger.error(traceback.format_exc())
+                    self.drop_connection()
+                if cfg.socket is None:
+                    cfg.push_stop.wait(CONST_PUSH_RECONNECT_DELAY)
+                else:
+                    cfg.push_connected.set()
+                    self.notify_push_callback()
+                continue
+
+            try:
+                if sslSocket.pending() == 0 and not select.select([sslSocket], [], [], self._socket_timeout)[0]:
+                    continue
+                with cfg.lock:
+                    frames = self.read_frames_from_socket(sslSocket)
+                updated = False
+                for frame in frames or []:
+                    updated = self.handle_reply(sslSocket, frame) or updated
+                if updated:
+                    self.notify_push_callback()
+            except:
+                self.logger.error('Reading push updates failed')
+                self.logger.error(traceback.format_exc())
+                self.drop_connection()
+
+        self.drop_connection()
+
+    @property
+    def ack_latency(self):
+        """Time in seconds between sending last command and receiving its response."""
+        return self._cfg.last_ack_latency
+
+    @property
+    def state_attributes(self):
+        latency = self.ack_latency
+        handshake = self._cfg.last_handshake_time
+        return { 
+            'ack_latency' : round(latency * 1000) if latency is not None else None,
+            'handshake_time' : round(handshake * 1000) if handshake is not None else None,
+        }
+
+    def read_frames_from_socket(self, sslSocket, timeout = None):
+        """Read available data and return list of completed frames or None if timed out."""
+        if timeout is None:
+            timeout = self._socket_timeout
+        ready = sslSocket.pending() > 0 or select.select([sslSocket], [], [], max(timeout, 0))[0]
+        self.trace.record("Reading data from socket...")
+        if not ready:
+            self.trace.record("Timed out, no data to read")
+            return None
+        data = sslSocket.recv(CONST_SOCKET_READ_SIZE)
+        if not data:
+            raise ConnectionResetError('Connection closed by device')
+        self.metrics.increment(COUNTER_BYTES_IN, len(data))
+        self.trace.record("Response: {}", data)
+        with profile_stage(STAGE_PARSE):
+            return self._cfg.parser.feed(data)
 
     def handle_response_invalidate_account(self, sslSocket, response):
         if sslSocket is not None:
-            if self._connection_init_template is not None:
-                params = self._params
-                init_message = self._connection_init_template.render(**params) + '\n'
-                self.logger.info("Sending auth command: {}".format(init_message))
-                sslSocket.sendall(init_message.encode('utf-8'))
-                self.logger.info("Auth command sent")
+            init_message = self._connection.render_init_message(self)
+            if init_message is not None:
+                self.trace.record("Sending auth command: {}", init_message)
+                self.send_data(sslSocket, init_message)
+                self.trace.record("Auth command sent")
                 self._cfg.socket = sslSocket
 
     def handle_response_auth_success(self, sslSocket, response):
-        self.logger.info('Connection authenticated')
+        self.trace.record('Connection authenticated')
         self._cfg.socket = sslSocket
         command = '<Request Type="DeviceState" DUID="{}"></Request>'.format(self._cfg.duid)
-        self.logger.info("Requesting status with command: {}".format(command))
-        sslSocket.sendall(command.encode('utf-8'))
-        self.logger.info("Status request sent")
+        self.trace.record("Requesting status with command: {}", command)
+        self.send_data(sslSocket, command)
+        self.trace.record("Status request sent")
 
     def handle_response_status_update(self, sslSocket, response):
-        attrs = response.split("><")
-        for attr in attrs:
-            f = re.match('Attr ID="(.*)" Value="(.*)"', attr)
-            if f:
-                k, v = f.group(1, 2)
-                self._device_status[k] = v
+        device_status = dict(self._cfg.device_status)
+        device_status.update(response.values)
+        self._cfg.device_status = device_status
 
     def handle_response_device_state(self, sslSocket, response):
-        attrs = response.split("><")
-        device_status = {}
-        for attr in attrs:
-            f = re.match('Attr ID="(.*)" Type=".*" Value="(.*)"', attr)
-            if f:
-                k, v = f.group(1, 2)
-                device_status[k] = v
-        self._device_status = device_status
-
-    def handle_socket_response(self, sslSocket):
-        reply = self.read_line_from_socket(sslSocket)
-        while reply:
-            if reply.find('Update Type="InvalidateAccount"') != -1:
-                self.handle_response_invalidate_account(sslSocket, reply)
-            elif reply.find('Response Type="AuthToken" Status="Okay"') != -1:
-                self.handle_response_auth_success(sslSocket, reply)
-            elif reply.find('Update Type="Status"') != -1:
-                self.handle_response_status_update(sslSocket, reply)
-            elif reply.find('Response Type="DeviceState" Status="Okay"') != -1:
-                self.handle_response_device_state(sslSocket, reply)
-            elif reply.find('Response Type="DeviceControl" Status="Okay"') != -1:
+        self._cfg.device_status = dict(response.values)
+
+    def response_count(self, response_type):
+        """Return numbers of Okay and failed responses of type received so far."""
+        cfg = self._cfg
+        with cfg.responses_cond:
+            return (cfg.responses.get(response_type, 0), cfg.failed_responses.get(response_type, 0))
+
+    def response_result(self, response_type, count):
+        """Return True if Okay response of type arrived since count was taken, False if failed one arrived
+        or None if none arrived yet. Must be called with responses_cond held."""
+        cfg = self._cfg
+        if cfg.responses.get(response_type, 0) > count[0]:
+            return True
+        if cfg.failed_responses.get(response_type, 0) > count[1]:
+            return False
+        return None
+
+    def register_response(self, frame):
+        """Count received response and wake up threads waiting for it. Only Okay responses acknowledge commands."""
+        cfg = self._cfg
+        responses = cfg.responses if frame.status == 'Okay' else cfg.failed_responses
+        with cfg.responses_cond:
+            responses[frame.type] = responses.get(frame.type, 0) + 1
+            cfg.responses_cond.notify_all()
+
+    def handle_reply(self, sslSocket, frame):
+        """Handle single frame read from socket. Return True if device status was updated."""
+        if frame.tag == FRAME_UPDATE:
+            if frame.type == 'InvalidateAccount':
+                self.handle_response_invalidate_account(sslSocket, frame)
+            elif frame.type == 'Status':
+                self.handle_response_status_update(sslSocket, frame)
+                return True
+            return False
+
+        updated = False
+        if frame.status == 'Okay':
+            if frame.type == 'AuthToken':
+                self.handle_response_auth_success(sslSocket, frame)
+            elif frame.type == 'DeviceState':
+                self.handle_response_device_state(sslSocket, frame)
+                updated = True
+            elif frame.type == 'DeviceControl':
                 pass # do we need to handle this?
-            reply = self.read_line_from_socket(sslSocket)
+        else:
+            self.logger.error("Device responded with error: {}".format(frame.raw))
+        self.register_response(frame)
+        return updated
+
+    def handle_socket_response(self, sslSocket, expected_response = None, count = (0, 0)):
+        """Handle replies until response of expected type arrives, count is taken by response_count before
+        command was sent. Without expected response read until socket is quiet. 
+        Return True if Okay response arrived, False if device rejected command or timed out."""
+        if expected_response is None:
+            frames = self.read_frames_from_socket(sslSocket)
+            while frames is not None:
+                for frame in frames:
+                    self.handle_reply(sslSocket, frame)
+                frames = self.read_frames_from_socket(sslSocket)
+            return True
+
+        deadline = time.monotonic() + CONST_RESPONSE_TIMEOUT
+        while True:
+            with self._cfg.responses_cond:
+                result = self.response_result(expected_response, count)
+            if result is not None:
+                return self.check_response_result(expected_response, result)
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                self.logger.error("Timed out waiting for {} response".format(expected_response))
+                self.metrics.increment(COUNTER_TIMEOUTS)
+                self.trace.dump("Timed out waiting for {} response".format(expected_response))
+                return False
+            frames = self.read_frames_from_socket(sslSocket, timeout)
+            if frames is None:
+                continue
+            for frame in frames:
+                self.handle_reply(sslSocket, frame)
+
+    def wait_for_response(self, expected_response, count):
+        """Wait until push reader receives response of expected type, see handle_socket_response."""
+        cfg = self._cfg
+        with cfg.responses_cond:
+            received = cfg.responses_cond.wait_for(lambda: self.response_result(expected_response, count) is not None, 
+                CONST_RESPONSE_TIMEOUT)
+            result = self.response_result(expected_response, count)
+        if not received:
+            self.metrics.increment(COUNTER_TIMEOUTS)
+            self.trace.dump("Timed out waiting for {} response".format(expected_response))
+            return False
+        return self.check_response_result(expected_response, result)
+
+    def check_response_result(self, expected_response, result):
+        if not result:
+            self.metrics.increment(COUNTER_ERRORS)
+            self.trace.dump("Device rejected {} request".format(expected_response))
+        return result
+
+    def send_data(self, sslSocket, message):
+        data = message.encode('utf-8')
+        sslSocket.sendall(data)
+        self.metrics.increment(COUNTER_BYTES_OUT, len(data))
 
     def send_socket_command(self, command, retries = 1):
+        """Send command and wait for its response. Return True if response was received."""
         sslSocket = None
         command_sent = False
+        acknowledged = False
         try:
-            self.logger.info("Getting socket connection")
+            self.trace.record("Getting socket connection")
             sslSocket = self.socket
+            expected_response = None
+            if command:
+                f = REQUEST_TYPE_RE.search(command)
+                expected_response = f.group(1) if f else None
+            count = self.response_count(expected_response)
             if sslSocket and command:
-                self.logger.info("Sending command")
-                sslSocket.sendall(command.encode('utf-8'))
+                self.trace.record("Sending command")
+                sent_time = time.monotonic()
+                with self._cfg.lock:
+                    self.send_data(sslSocket, command)
                 command_sent = True
             else:
-                self.logger.info("Command empty, skipping sending")
+                self.trace.record("Command empty, skipping sending")
                 command_sent = sslSocket is not None
-            self.logger.info("Handling socket response")
-            if sslSocket:
-                self.handle_socket_response(sslSocket)
-            self.logger.info("Handling finished")
+            if sslSocket and self.push_active:
+                # in push mode responses are handled by reader thread
+                acknowledged = expected_response is None or self.wait_for_response(expected_response, count)
+            elif sslSocket:
+                self.trace.record("Handling socket response")
+                acknowledged = self.handle_socket_response(sslSocket, expected_response, count)
+            if command_sent and acknowledged and expected_response is not None:
+                self._cfg.last_ack_latency = time.monotonic() - sent_time
+                self.metrics.observe(METRIC_REQUEST, self._cfg.last_ack_latency)
+                self.trace.record("Command acknowledged in {:.3f}s", self._cfg.last_ack_latency)
+            self.trace.record("Handling finished")
         except:
             self.logger.error('Sending command failed')
+            self.metrics.increment(COUNTER_ERRORS)
             if sslSocket is not None:
-                sslSocket.close()
-                self._cfg.socket = None
+                self.drop_connection()
             self.logger.error(traceback.format_exc())
+            self.trace.dump('Sending command failed')
 
         if not command_sent and retries > 0:
-            self.logger.info("Retrying sending command...")
-            self.send_socket_command(command, retries -1)
+            self.trace.record("Retrying sending command...")
+            self.metrics.increment(COUNTER_RETRIES)
+            return self.send_socket_command(command, retries -1)
+
+        return command_sent and acknowledged
         
     def create_connection(self):
         sslSocket = None
         cfg = self._cfg
-        self.logger.info("Creating ssl context")
-        sslContext = ssl.SSLContext(ssl.PROTOCOL_TLSv1)
-        self.logger.info("Setting up ciphers")
-        sslContext.set_ciphers("HIGH:!DH:!aNULL")
-        self.logger.info("Setting up verify mode")
-        sslContext.verify_mode = ssl.CERT_REQUIRED if cfg.cert is not None else ssl.CERT_NONE
-        if cfg.cert is not None:
-            self.logger.info("Setting up verify location: {}".format(cfg.cert))
-            sslContext.load_verify_locations(cafile = cfg.cert)
-            self.logger.info("Setting up load cert chain: {}".format(cfg.cert))
-            sslContext.load_cert_chain(cfg.cert)
-        else:
-            self.logger.info("Cert is empty, skipping verification")
-        self.logger.info("Wrapping socket")
-        sslSocket = sslContext.wrap_socket(socket(AF_INET, SOCK_STREAM), server_hostname = cfg.host)
-        self.logger.info("Socket wrapped: {}".format(True if sslSocket is not None else False))
+        sslContext = get_ssl_context(cfg.cert, CONST_SSL_CIPHERS, self.logger)
+        self.trace.record("Wrapping socket")
+        sslSocket = sslContext.wrap_socket(socket(AF_INET, SOCK_STREAM), server_hostname = cfg.host, 
+            session = cfg.tls_session)
+        self.trace.record("Socket wrapped: {}", True if sslSocket is not None else False)
 
         if sslSocket is not None:
-            self.logger.info("Connecting with {}:{}".format(cfg.host, cfg.port))
+            self.trace.record("Connecting with {}:{}", cfg.host, cfg.port)
+            start_time = time.monotonic()
             sslSocket.connect((cfg.host, cfg.port))
+            cfg.last_handshake_time = time.monotonic() - start_time
+            self.metrics.observe(METRIC_HANDSHAKE, cfg.last_handshake_time)
+            self.trace.record("Connected, TLS session reused: {}", sslSocket.session_reused)
+            cfg.tls_session = sslSocket.session
             #sslSocket.setblocking(0)
-            self.handle_socket_response(sslSocket)
+            cfg.parser = Samsung2878StreamParser()
+            # authentication ends with the response to status request sent after AuthToken
+            start_time = time.monotonic()
+            if self.handle_socket_response(sslSocket, 'DeviceState', self.response_count('DeviceState')):
+                self.metrics.observe(METRIC_AUTH, time.monotonic() - start_time)
         else:
-            self.logger.info("Wrapping socket failed")
+            self.trace.record("Wrapping socket failed")
 
     @property
     def socket(self):
+        if self.push_active:
+            # connection is created and owned by push reader
+            self._cfg.push_connected.wait(CONST_PUSH_CONNECT_TIMEOUT)
+            return self._cfg.socket
         sslSocket = self._cfg.socket
         if sslSocket is None:
-            self.logger.info("Connection invalid, creating!")
+            self.trace.record("Connection invalid, creating!")
             self.create_connection()
             sslSocket = self._cfg.socket
             if sslSocket is None:
                 self.logger.error("Creating socket failed!")
         return sslSocket
 
-    def execute(self, template, v, device_state):
-        params = self._params
+@register_connection
+class ConnectionSamsung2878(Connection):
+    __slots__ = ('_connection_init_template', '_power_template')
+
+    def __init__(self, logger):
+        super(ConnectionSamsung2878, self).__init__(logger)
+        self._connection_init_template = None
+        self._power_template = None
+
+    def load_from_yaml(self, node, connection_base):
+        if connection_base is not None:
+            self._params = connection_base._params
+        
+        if node is not None:
+            params_node = node.get(CONFIG_DEVICE_CONNECTION_PARAMS, {})
+            
+            if CONFIG_DEVICE_CONNECTION_TEMPLATE in params_node:
+                self._connection_init_template = get_template(params_node[CONFIG_DEVICE_CONNECTION_TEMPLATE])
+            elif connection_base is None:
+                self.logger.error("ERROR: missing 'connection_template' parameter in connection section")
+                return False
+
+            if CONFIG_DEVICE_POWER_TEMPLATE in params_node:
+                self._power_template = get_template(params_node[CONFIG_DEVICE_POWER_TEMPLATE])
+            
+            self._params = self._params.updated(params_node)
+            return True
+
+        return False
+
+    @staticmethod
+    def match_type(type):
+        return type == CONNECTION_TYPE_S2878
+
+    def create_device(self, config, logger):
+        device = Device2878(self, config, logger)
+        cfg = device.cfg
+        if cfg.host is None:
+            logger.error("ERROR: missing 'host' parameter in configuration section")
+            return None
+        if cfg.token is None or cfg.token == '':
+            logger.error("ERROR: missing 'token' parameter in configuration section")
+            return None
+        if cfg.duid == None:
+            logger.error("ERROR: missing 'mac' parameter in configuration section")
+            return None
+        if cfg.cert is None:
+            logger.warning("WARNING: 'cert' parameter is empty, skipping certificate validation")
+        logger.info("Configuration, host: {}:{}".format(cfg.host, cfg.port))
+        logger.info("Configuration, token: {}".format(cfg.token))
+        logger.info("Configuration, duid: {}".format(cfg.duid))
+        logger.info("Configuration, cert: {}".format(cfg.cert))
+        return device
+
+    def create_updated(self, node):
+        if not node:
+            return self
+        c = ConnectionSamsung2878(self.logger)
+        c._connection_init_template = self._connection_init_template
+        c._power_template = self._power_template
+        c.load_from_yaml(node, self)
+        return c
+
+    def render_init_message(self, device):
+        """Return authentication message of device or None if profile has no connection template."""
+        if self._connection_init_template is None:
+            return None
+        return self._connection_init_template.render(**device.bind_params(self._params)) + '\n'
+
+    def render_messages(self, device, template, v, device_state):
+        """Return power on message (or None) and command message for value."""
+        params = device.bind_params(self._params)
         params.update({ 'value' : v })
         params.update({ 'device_state' : device_state })
-        self.logger.info("Executing params: {}".format(params))
+        device.trace.record("Executing params: {}", params)
         message = v
         if template is not None:
             message = template.render(**params) + '\n'
         elif CONFIG_DEVICE_CONNECTION_TEMPLATE in params:
             message = params[CONFIG_DEVICE_CONNECTION_TEMPLATE]
 
-        self.logger.info("Checking power on template: {}".format(self._power_template))
+        power_message = None
+        device.trace.record("Checking power on template: {}", self._power_template)
         if self._power_template:
-            self.logger.info("Power on template found, rendering")
+            device.trace.record("Power on template found, rendering")
             power_message = self._power_template.render(**params)
-            self.logger.info("Power on message: {}".format(power_message))
-            if power_message and power_message != '':
-                self.logger.info("Executing power command")
-                self.send_socket_command(power_message, 1)
+            device.trace.record("Power on message: {}", power_message)
+        return (power_message if power_message else None, message)
 
-        self.logger.info("Executing command: {}".format(message))
-        self.send_socket_command(message, 1)
+    def execute(self, device, template, v, device_state):
+        power_message, message = self.render_messages(device, template, v, device_state)
+        if power_message:
+            device.trace.record("Executing power command")
+            device.send_socket_command(power_message, 1)
+
+        device.trace.record("Executing command: {}", message)
+        if not device.send_socket_command(message, 1):
+            # command not acknowledged by device
+            return None
         #self.handle_response_device_state(None, xml_test)
-        return self._device_status
+        return device.device_status
+
+    def prepare_batch(self, device, template, v, device_state):
+        """DeviceControl requests containing only Attr elements are batched."""
+        power_message, message = self.render_messages(device, template, v, device_state)
+        m = CONTROL_REQUEST_RE.match(message) if message else None
+        if m is None:
+            return None
+        return BatchCommand(self, (power_message, m.group(1), m.group(2)))
+
+    def execute_batch(self, device, commands):
+        """Send single DeviceControl request with Attr elements of all commands.
+        Power on message is sent once, before the control request."""
+        power_messages = []
+        attrs = {}
+        for command in commands:
+            power_message, control, attr_elements = command.data
+            if power_message and power_message not in power_messages:
+                power_messages.append(power_message)
+            for m in ATTR_TAG_RE.finditer(attr_elements):
+                # last write of the same attribute wins
+                attrs.pop(m.group(1), None)
+                attrs[m.group(1)] = m.group(0)
+
+        for power_message in power_messages:
+            device.trace.record("Executing power command")
+            device.send_socket_command(power_message, 1)
+
+        control = commands[0].data[1]
+        message = '<Request Type="DeviceControl"><Control {}>{}</Control></Request>\n'.format(control, ''.join(attrs.values()))
+        device.trace.record("Executing batched command: {}", message)
+        return device.send_socket_command(message, 1)
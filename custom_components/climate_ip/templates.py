@@ -0,0 +1,195 @@
+import functools as ft
+import hashlib
+import logging
+import re
+import threading
+
+CONST_BYTECODE_CACHE_PATTERN = 'climate_ip-%s.cache'
+
+TAG_RE = re.compile(r'\{%-?\s*(\w+)(.*?)-?%\}', re.S)
+ITEMS_LOOP_RE = re.compile(r'\{%\s*for\s+key\s*,\s*value\s+in\s+device_state\.items\(\)\s*%\}')
+KEY_CONDITION_RE = re.compile(r'\{%\s*if\s+key\s*==\s*(["\'])([^"\'\\]*)\1\s*%\}')
+VALUE_EXPRESSION_RE = re.compile(r'^\{\{\s*value\s*\}\}$')
+LOOP_VARIABLE_RE = re.compile(r'\bloop\b')
+IDENTIFIER_RE = re.compile(r'^[A-Za-z_]\w*$')
+STATE_ITEMS_RE = re.compile(r'device_state\s*\.\s*items\s*\(')
+WHITESPACE_CONTROL_RE = re.compile(r'\{[%{]-|-[%}]\}')
+
+_ENVIRONMENT = None
+_BYTECODE_CACHE = None
+_TEMPLATES = {}
+_UNOPTIMIZED = []
+_LOCK = threading.Lock()
+_LOGGER = logging.getLogger(__name__)
+
+def get_environment():
+    """Return Jinja environment shared by all climate_ip templates."""
+    global _ENVIRONMENT, _BYTECODE_CACHE
+    if _ENVIRONMENT is None:
+        from jinja2 import Environment, FileSystemBytecodeCache
+        try:
+            _BYTECODE_CACHE = FileSystemBytecodeCache(pattern = CONST_BYTECODE_CACHE_PATTERN)
+        except (OSError, RuntimeError):
+            _BYTECODE_CACHE = None # no usable temporary directory, compile every time
+        _ENVIRONMENT = Environment()
+    return _ENVIRONMENT
+
+def cache_directory():
+    """Return directory of the bytecode cache, private to the current user, or None if there is no cache."""
+    get_environment()
+    return _BYTECODE_CACHE.directory if _BYTECODE_CACHE is not None else None
+
+def compile_template(source):
+    """Compile template source, use code from bytecode cache if available."""
+    env = get_environment()
+    if _BYTECODE_CACHE is None:
+        return env.from_string(source)
+
+    # templates are not loaded by Jinja loader, so bytecode cache is used the same way loader does it
+    name = hashlib.sha1(source.encode('utf-8')).hexdigest()
+    bucket = _BYTECODE_CACHE.get_bucket(env, name, None, source)
+    code = bucket.code
+    if code is None:
+        code = env.compile(source, name)
+        bucket.code = code
+        try:
+            _BYTECODE_CACHE.set_bucket(bucket)
+        except OSError:
+            pass # cache is optional
+    return env.template_class.from_code(env, code, env.make_globals(None))
+
+def find_block_end(source, pos, open_tag, close_tag):
+    """Return match of the tag closing block opened just before pos or None if block is not closed."""
+    depth = 1
+    for m in TAG_RE.finditer(source, pos):
+        if m.group(1) == open_tag:
+            depth += 1
+        elif m.group(1) == close_tag:
+            depth -= 1
+            if depth == 0:
+                return m
+    return None
+
+def has_top_level_else(source):
+    """Check if source contains else or elif which does not belong to a nested block."""
+    depth = 0
+    for m in TAG_RE.finditer(source):
+        tag = m.group(1)
+        if tag in ('if', 'for'):
+            depth += 1
+        elif tag in ('endif', 'endfor'):
+            depth -= 1
+        elif tag in ('else', 'elif') and depth == 0:
+            return True
+    return False
+
+def optimize_items_loop(source):
+    """Rewrite first innermost loop looking up a single key in device state.
+    Return new source or None if there is nothing more to rewrite."""
+    for loop in ITEMS_LOOP_RE.finditer(source):
+        end = find_block_end(source, loop.end(), 'for', 'endfor')
+        if end is None:
+            continue
+        if WHITESPACE_CONTROL_RE.search(source, loop.start(), end.end()):
+            continue # stripped whitespace depends on tags around, which are rewritten
+        body = source[loop.end():end.start()]
+        if ITEMS_LOOP_RE.search(body):
+            continue # rewrite inner loops first
+        condition = KEY_CONDITION_RE.match(body)
+        if condition is None:
+            continue
+        endif = find_block_end(body, condition.end(), 'if', 'endif')
+        if endif is None or endif.end() != len(body):
+            continue
+        inner = body[condition.end():endif.start()]
+        if has_top_level_else(inner) or LOOP_VARIABLE_RE.search(inner):
+            continue
+
+        key = condition.group(2)
+        if VALUE_EXPRESSION_RE.match(inner) and IDENTIFIER_RE.match(key) and not hasattr(dict, key):
+            # missing key renders as empty string, the same as loop which never matches
+            replacement = '{{ device_state.' + key + ' }}'
+        else:
+            replacement = '{% if "' + key + '" in device_state %}{% with key = "' + key + '", value = device_state["' + \
+                key + '"] %}' + inner + '{% endwith %}{% endif %}'
+        return source[:loop.start()] + replacement + source[end.end():]
+    return None
+
+@ft.lru_cache(maxsize = None)
+def optimize_template(source):
+    """Return source with loops over device_state.items() which look for a single key 
+    replaced by direct dictionary lookup."""
+    source = str(source)
+    while True:
+        optimized = optimize_items_loop(source)
+        if optimized is None:
+            return source
+        source = optimized
+
+def state_path(node):
+    """Return device state path read by expression node or None if node is not a constant lookup."""
+    from jinja2 import nodes
+    if isinstance(node, nodes.Name):
+        return () if node.name == 'device_state' else None
+    if isinstance(node, nodes.Getattr):
+        key = node.attr
+    elif isinstance(node, nodes.Getitem) and isinstance(node.arg, nodes.Const):
+        key = node.arg.value
+    else:
+        return None
+    if not isinstance(key, (str, int)) or (isinstance(key, str) and (hasattr(dict, key) or hasattr(list, key))):
+        return None # dict or list method, treated as read of the whole container
+    path = state_path(node.node)
+    return path + (key,) if path is not None else None
+
+@ft.lru_cache(maxsize = None)
+def template_dependencies(source):
+    """Return set of device state paths read by template. Empty path means whole device state."""
+    from jinja2 import nodes
+    dependencies = set()
+
+    def visit(node):
+        path = state_path(node)
+        if path is not None:
+            dependencies.add(path)
+            return
+        if isinstance(node, nodes.Compare) and isinstance(node.expr, nodes.Const) and len(node.ops) == 1 \
+                and node.ops[0].op in ('in', 'notin'):
+            # "key" in device_state reads only existence of the key
+            path = state_path(node.ops[0].expr)
+            if path is not None and isinstance(node.expr.value, (str, int)):
+                dependencies.add(path + (node.expr.value,))
+                return
+        for child in node.iter_child_nodes():
+            visit(child)
+
+    visit(get_environment().parse(optimize_template(source)))
+    return frozenset(dependencies)
+
+def clear_cache():
+    """Drop compiled templates and results of template analysis, e.g. to measure cold start."""
+    with _LOCK:
+        _TEMPLATES.clear()
+        del _UNOPTIMIZED[:]
+    optimize_template.cache_clear()
+    template_dependencies.cache_clear()
+
+def unoptimized_templates():
+    """Return list of loaded templates which still iterate over device state."""
+    return list(_UNOPTIMIZED)
+
+def get_template(source):
+    """Return compiled template for source. Templates are shared by all users of the same source text."""
+    source = str(source)
+    template = _TEMPLATES.get(source, None)
+    if template is None:
+        with _LOCK:
+            template = _TEMPLATES.get(source, None)
+            if template is None:
+                optimized = optimize_template(source)
+                if STATE_ITEMS_RE.search(optimized):
+                    _UNOPTIMIZED.append(source)
+                    _LOGGER.info("Template iterating over device state could not be optimized: {}".format(source))
+                template = compile_template(optimized)
+                _TEMPLATES[source] = template
+    return template
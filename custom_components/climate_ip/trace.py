@@ -0,0 +1,45 @@
+import collections
+import logging
+import threading
+import time
+
+CONST_TRACE_SIZE = 200
+
+TraceEvent = collections.namedtuple('TraceEvent', ['time', 'thread', 'message', 'args'])
+
+class TraceBuffer():
+    """Ring buffer of the last trace events of a device. Events keep format string and its arguments,
+    message is formatted only when trace is dumped or logger is enabled for INFO."""
+    def __init__(self, logger, size = CONST_TRACE_SIZE):
+        self._logger = logger
+        self._events = collections.deque(maxlen = size)
+
+    def record(self, message, *args):
+        self._events.append(TraceEvent(time.time(), threading.current_thread().name, message, args))
+        if self._logger is not None and self._logger.isEnabledFor(logging.INFO):
+            self._logger.info(format_message(message, args))
+
+    def clear(self):
+        self._events.clear()
+
+    def format_events(self):
+        """Return list of formatted events, oldest first."""
+        lines = []
+        for event in list(self._events):
+            lines.append('{}.{:03d} [{}] {}'.format(time.strftime('%H:%M:%S', time.localtime(event.time)),
+                int(event.time * 1000) % 1000, event.thread, format_message(event.message, event.args)))
+        return lines
+
+    def dump(self, reason):
+        """Log events recorded since the last dump as single error message, e.g. when request failed.
+        Nothing is logged when events were already logged as they were recorded."""
+        lines = self.format_events()
+        self.clear()
+        if lines and self._logger is not None and not self._logger.isEnabledFor(logging.INFO):
+            self._logger.error("{}, last {} trace events:\n{}".format(reason, len(lines), '\n'.join(lines)))
+
+def format_message(message, args):
+    try:
+        return message.format(*args)
+    except Exception:
+        return '{} {}'.format(message, args)
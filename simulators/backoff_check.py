@@ -0,0 +1,65 @@
+"""
+Check that REST devices which do not answer do not hold climate_ip executor threads while waiting for retry.
+
+As many controllers as there are executor threads are initialized against an address nobody listens on.
+While all of them wait before retrying their first update, a probe job is submitted to the executor.
+Its wait time is reported for the synchronous API, where the calling thread sleeps before retry, and
+for the asynchronous API used by climate entities, where it must not. Results are printed as JSON,
+exit status is 1 if the probe waited for the asynchronous API too:
+
+    probe_wait_ms       time probe job waited for an executor thread
+    init_sec            time to initialize all controllers
+
+Requires Home Assistant installed, as the integration itself. Run from repository root on Linux:
+    python -m simulators.backoff_check
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+
+from custom_components.climate_ip.connection import CLIMATE_IP_EXECUTOR_WORKERS, async_run_in_executor
+from custom_components.climate_ip.controller_yaml import YamlController
+
+CONST_PROBE_DELAY = 0.3 # in seconds, first attempts fail at once, retries are delayed by about 1 s
+CONST_MAX_PROBE_WAIT = 0.1 # in seconds
+CONST_UNUSED_ADDRESS = '127.0.99.1' # loopback, connections are refused (Linux only)
+
+async def async_probe(initialize):
+    """Run initialize coroutine and measure how long executor job waits while it runs."""
+    start = time.monotonic()
+    task = asyncio.ensure_future(initialize)
+    await asyncio.sleep(CONST_PROBE_DELAY)
+    probe_start = time.monotonic()
+    await async_run_in_executor(time.monotonic)
+    probe_wait = time.monotonic() - probe_start
+    await task
+    return { 'probe_wait_ms' : round(probe_wait * 1000, 1), 'init_sec' : round(time.monotonic() - start, 2) }
+
+async def async_check(config_file, logger):
+    config = { 'ip_address' : CONST_UNUSED_ADDRESS, 'config_file' : config_file,
+        'token' : 'token', 'mac' : '00:00:00:00:00:00', 'cert' : None }
+    controllers = [YamlController(config, logger) for _ in range(CLIMATE_IP_EXECUTOR_WORKERS)]
+    sync_result = await async_probe(asyncio.gather(*[async_run_in_executor(c.initialize) for c in controllers]))
+    controllers = [YamlController(config, logger) for _ in range(CLIMATE_IP_EXECUTOR_WORKERS)]
+    async_result = await async_probe(asyncio.gather(*[c.async_initialize() for c in controllers]))
+    return { 'config_file' : config_file, 'devices' : len(controllers), 'sync' : sync_result, 'async' : async_result }
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = 'python -m simulators.backoff_check',
+        description = 'Check that retries of failing devices do not hold executor threads.')
+    parser.add_argument('--config-file', default = 'samsungrac.yaml', help = 'REST device profile (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level = logging.CRITICAL)
+    result = asyncio.run(async_check(args.config_file, logging.getLogger('climate_ip.backoff_check')))
+    json.dump(result, sys.stdout, indent = 2)
+    sys.stdout.write('\n')
+    if result['async']['probe_wait_ms'] > CONST_MAX_PROBE_WAIT * 1000:
+        sys.stderr.write('executor thread held by failing device while waiting for retry\n')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
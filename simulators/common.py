@@ -0,0 +1,77 @@
+"""
+Helpers shared by simulated device servers: fault injection and TLS setup.
+
+Simulators use standard library only, so they can run on a box without Home Assistant.
+"""
+import argparse
+import asyncio
+import os
+import random
+import ssl
+
+CONST_DEFAULT_CERT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'custom_components', 'climate_ip', 'ac14k_m.pem')
+
+FAULT_NONE = 'none'
+FAULT_ERROR = 'error' # device answers with error status
+FAULT_DROP = 'drop' # device closes connection without answer
+FAULT_HANG = 'hang' # device never answers, client has to time out
+
+class FaultInjector():
+    """Delay answers by latency +- jitter (in seconds) and inject faults with given probabilities."""
+    def __init__(self, latency = 0.0, jitter = 0.0, error_rate = 0.0, drop_rate = 0.0, hang_rate = 0.0, seed = None):
+        self._latency = latency
+        self._jitter = jitter
+        self._rates = [(FAULT_ERROR, error_rate), (FAULT_DROP, drop_rate), (FAULT_HANG, hang_rate)]
+        self._random = random.Random(seed)
+        self.counts = { FAULT_NONE : 0, FAULT_ERROR : 0, FAULT_DROP : 0, FAULT_HANG : 0 }
+
+    @property
+    def delay(self):
+        return max(0.0, self._latency + self._random.uniform(-self._jitter, self._jitter))
+
+    def choose(self):
+        """Return fault injected into the next answer."""
+        r = self._random.random()
+        fault = FAULT_NONE
+        for name, rate in self._rates:
+            if r < rate:
+                fault = name
+                break
+            r -= rate
+        self.counts[fault] += 1
+        return fault
+
+    async def async_answer(self):
+        """Wait as device would before answering and return fault to inject. Hanging never returns."""
+        fault = self.choose()
+        await asyncio.sleep(self.delay)
+        if fault == FAULT_HANG:
+            await asyncio.Event().wait()
+        return fault
+
+def add_fault_arguments(parser):
+    parser.add_argument('--latency', type = float, default = 0.02, help = 'answer delay in seconds (default: %(default)s)')
+    parser.add_argument('--jitter', type = float, default = 0.01, help = 'random +- delay in seconds (default: %(default)s)')
+    parser.add_argument('--error-rate', type = float, default = 0.0, help = 'probability of error answer')
+    parser.add_argument('--drop-rate', type = float, default = 0.0, help = 'probability of closing connection without answer')
+    parser.add_argument('--hang-rate', type = float, default = 0.0, help = 'probability of never answering')
+    parser.add_argument('--seed', type = int, default = None, help = 'random seed for reproducible faults')
+
+def create_fault_injector(args, seed_offset = 0):
+    seed = args.seed + seed_offset if args.seed is not None else None
+    return FaultInjector(args.latency, args.jitter, args.error_rate, args.drop_rate, args.hang_rate, seed)
+
+def create_server_ssl_context(cert = CONST_DEFAULT_CERT):
+    """Return TLS context of device server. Devices use old TLS versions and ciphers, so all are enabled."""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.MINIMUM_SUPPORTED
+    context.set_ciphers('ALL:@SECLEVEL=0')
+    context.load_cert_chain(cert)
+    return context
+
+def create_argument_parser(prog, description):
+    parser = argparse.ArgumentParser(prog = prog, description = description)
+    parser.add_argument('--cert', default = CONST_DEFAULT_CERT, help = 'certificate chain with private key')
+    add_fault_arguments(parser)
+    return parser
@@ -0,0 +1,138 @@
+"""
+Launch a fleet of simulated units in a single process.
+
+Profiles use fixed ports (8888 for REST, 2878 for Samsung 2878), so every unit gets its own loopback
+address 127.0.x.y. On Linux the whole 127.0.0.0/8 network is routed to loopback without any setup.
+
+When all units are listening, description of the fleet is printed as single JSON line to standard output:
+    {"units": [{"ip_address": "127.0.1.1", "port": 8888, "config_file": "samsungrac.yaml", "token": ..., "mac": ...}]}
+Each unit description is a valid climate_ip platform configuration. Fleet runs until interrupted
+or, with --stdin, until standard input is closed. Request statistics are printed to standard error at exit.
+
+Run from repository root:
+    python -m simulators.fleet --units 100 --protocol mixed --latency 0.05 --jitter 0.02 --error-rate 0.01
+"""
+import asyncio
+import json
+import resource
+import signal
+import sys
+
+from .common import (
+    create_argument_parser, create_fault_injector, create_server_ssl_context,
+)
+from .rest_server import (
+    CONST_DEFAULT_PORT as CONST_REST_PORT, RestDevice, async_start_rest_server,
+)
+from .samsung_2878_server import (
+    CONST_DEFAULT_PORT as CONST_2878_PORT, Samsung2878Device, async_start_2878_server,
+)
+
+PROTOCOL_REST = 'rest'
+PROTOCOL_HEAT_PUMP = 'heatpump'
+PROTOCOL_2878 = 'samsung_2878'
+PROTOCOL_MIXED = 'mixed'
+PROTOCOLS = [PROTOCOL_REST, PROTOCOL_HEAT_PUMP, PROTOCOL_2878]
+
+CONFIG_FILES = {
+    PROTOCOL_REST : 'samsungrac.yaml',
+    PROTOCOL_HEAT_PUMP : 'mim-h03_heatpump.yaml',
+    PROTOCOL_2878 : 'samsung_2878.yaml',
+}
+
+CONST_UNITS_PER_NETWORK = 250
+
+def unit_address(index):
+    return '127.0.{}.{}'.format(1 + index // CONST_UNITS_PER_NETWORK, 1 + index % CONST_UNITS_PER_NETWORK)
+
+def unit_protocol(protocol, index):
+    return PROTOCOLS[index % len(PROTOCOLS)] if protocol == PROTOCOL_MIXED else protocol
+
+def raise_file_limit():
+    """Every unit needs listening socket and socket per client connection."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+class Fleet():
+    def __init__(self):
+        self._servers = []
+        self._devices = []
+        self._faults = []
+        self.units = []
+
+    async def async_start(self, args):
+        ssl_context = create_server_ssl_context(args.cert)
+        for index in range(args.units):
+            protocol = unit_protocol(args.protocol, index)
+            host = unit_address(index)
+            mac = '02:00:00:00:{:02x}:{:02x}'.format(index // 256 % 256, index % 256)
+            token = 'token{:05d}'.format(index)
+            faults = create_fault_injector(args, index)
+            if protocol == PROTOCOL_2878:
+                port = CONST_2878_PORT
+                device = Samsung2878Device(token, mac.replace(':', ''))
+                server = await async_start_2878_server(host, port, device, faults, ssl_context)
+            else:
+                port = CONST_REST_PORT
+                device = RestDevice()
+                server = await async_start_rest_server(host, port, device, faults, ssl_context)
+            self._servers.append(server)
+            self._devices.append(device)
+            self._faults.append(faults)
+            self.units.append({ 'ip_address' : host, 'port' : port, 'config_file' : CONFIG_FILES[protocol],
+                'token' : token, 'mac' : mac })
+
+    def stop(self):
+        for server in self._servers:
+            server.close()
+
+    @property
+    def statistics(self):
+        faults = {}
+        for injector in self._faults:
+            for fault, count in injector.counts.items():
+                faults[fault] = faults.get(fault, 0) + count
+        return {
+            'units' : len(self._devices),
+            'requests' : sum(device.requests for device in self._devices),
+            'writes' : sum(device.writes for device in self._devices),
+            'faults' : faults,
+        }
+
+async def async_wait_for_stdin_close():
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    while await reader.read(4096):
+        pass
+
+async def async_main(args):
+    raise_file_limit()
+    fleet = Fleet()
+    await fleet.async_start(args)
+    print(json.dumps({ 'units' : fleet.units }), flush = True)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    watcher = None
+    if args.stdin:
+        watcher = loop.create_task(async_wait_for_stdin_close())
+        watcher.add_done_callback(lambda task: stop.set())
+    await stop.wait()
+
+    fleet.stop()
+    sys.stderr.write(json.dumps(fleet.statistics) + '\n')
+
+def main(argv = None):
+    parser = create_argument_parser('python -m simulators.fleet', 'Run fleet of simulated units.')
+    parser.add_argument('--units', type = int, default = 10, help = 'number of units (default: %(default)s)')
+    parser.add_argument('--protocol', choices = PROTOCOLS + [PROTOCOL_MIXED], default = PROTOCOL_REST,
+        help = 'protocol of units, mixed cycles through all (default: %(default)s)')
+    parser.add_argument('--stdin', action = 'store_true', help = 'stop when standard input is closed')
+    asyncio.run(async_main(parser.parse_args(argv)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+End-to-end load test of the integration against a fleet of simulated units.
+
+For every fleet size, fleet is started in a separate process, a controller is created for every unit
+and registered for polling with ClimateIPHub, the same way climate entities are. While the test runs,
+commands are sent to random units and event loop lag is sampled. Results are printed as JSON:
+
+    setup_sec           time to create controllers of all units
+    polls_per_sec       completed polls, failed polls are counted separately
+    poll_latency_ms     p50/p95/max of single poll, including waiting for hub
+    command_latency_ms  p50/p95/max of single command
+    loop_lag_ms         p50/p99/max delay of event loop wake ups, stalls counts lags over 100 ms
+
+Requires Home Assistant installed, as the integration itself. Run from repository root on Linux:
+    python -m simulators.load_test --devices 10 100 500 --duration 60 --protocol rest
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from custom_components.climate_ip.connection import async_run_in_executor
+from custom_components.climate_ip.controller_yaml import YamlController
+from custom_components.climate_ip.hub import ClimateIPHub, PollStatus
+
+from .common import add_fault_arguments
+from .fleet import PROTOCOL_MIXED, PROTOCOLS, raise_file_limit
+
+CONST_LAG_INTERVAL = 0.01 # in seconds
+CONST_STALL_THRESHOLD = 0.1 # in seconds
+CONST_FLEET_STOP_TIMEOUT = 10 # in seconds
+
+def percentiles(values, points):
+    """Return dictionary with given percentiles of values in milliseconds."""
+    values = sorted(values)
+    result = {}
+    for point in points:
+        key = 'max' if point == 100 else 'p{}'.format(point)
+        result[key] = round(values[min(len(values) - 1, int(len(values) * point / 100))] * 1000, 1) if values else None
+    return result
+
+class LoadTestUnit():
+    """Polled stand-in of climate entity."""
+    def __init__(self, hub, host, controller, stats):
+        self._hub = hub
+        self._host = host
+        self._controller = controller
+        self._stats = stats
+
+    @property
+    def poll_status(self):
+        return PollStatus(self._controller.failed_updates, False, False, None)
+
+    async def async_poll(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await self._hub.async_run(self._host, self._controller.async_update_state)
+        self._stats['poll_latency'].append(loop.time() - start)
+        self._stats['failed_polls' if self._controller.failed_updates > 0 else 'polls'] += 1
+
+    async def async_command(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            ok = await self._hub.async_run(self._host, self._controller.async_set_property, 'temperature',
+                random.randint(18, 26))
+        except Exception:
+            ok = False
+        self._stats['command_latency'].append(loop.time() - start)
+        self._stats['commands' if ok else 'failed_commands'] += 1
+
+async def async_monitor_loop_lag(lags):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(CONST_LAG_INTERVAL)
+        lags.append(max(0.0, loop.time() - start - CONST_LAG_INTERVAL))
+
+async def async_send_commands(units, rate, tasks):
+    """Send commands to random units, tasks of commands in flight are kept in tasks set."""
+    while True:
+        await asyncio.sleep(random.expovariate(rate))
+        task = asyncio.get_running_loop().create_task(random.choice(units).async_command())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+def create_controller(unit, cert, logger):
+    config = dict(unit, cert = cert)
+    controller = YamlController(config, logger)
+    return controller if controller.initialize() else None
+
+def start_fleet(args, size):
+    command = [sys.executable, '-m', 'simulators.fleet', '--units', str(size), '--protocol', args.protocol, '--stdin',
+        '--latency', str(args.latency), '--jitter', str(args.jitter), '--error-rate', str(args.error_rate),
+        '--drop-rate', str(args.drop_rate), '--hang-rate', str(args.hang_rate)]
+    if args.seed is not None:
+        command += ['--seed', str(args.seed)]
+    # fleet output is not read until it stops, file does not block it when pipe buffer is full
+    errors = tempfile.TemporaryFile()
+    fleet = subprocess.Popen(command, stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = errors)
+    fleet.errors = errors
+    line = fleet.stdout.readline()
+    if not line:
+        fleet.wait()
+        errors.seek(0)
+        raise RuntimeError('Fleet failed to start: {}'.format(errors.read().decode('utf-8', errors = 'replace')))
+    return fleet, json.loads(line)['units']
+
+def read_fleet_statistics(fleet):
+    fleet.errors.seek(0)
+    for line in fleet.errors.read().splitlines():
+        if line.startswith(b'{"units"'):
+            return json.loads(line)
+    return None
+
+def stop_fleet(fleet):
+    """Stop fleet and return its statistics. Fleet is killed as soon as it reports statistics,
+    closing TLS connections still open by clients could take long."""
+    fleet.stdin.close()
+    deadline = time.monotonic() + CONST_FLEET_STOP_TIMEOUT
+    statistics = None
+    while statistics is None and fleet.poll() is None and time.monotonic() < deadline:
+        time.sleep(0.1)
+        statistics = read_fleet_statistics(fleet)
+    if statistics is None:
+        statistics = read_fleet_statistics(fleet)
+    fleet.kill()
+    fleet.wait()
+    fleet.stdout.close()
+    fleet.errors.close()
+    return statistics
+
+async def async_run_size(args, units, logger):
+    loop = asyncio.get_running_loop()
+    lags = []
+    stats = { 'polls' : 0, 'failed_polls' : 0, 'commands' : 0, 'failed_commands' : 0,
+        'poll_latency' : [], 'command_latency' : [] }
+    monitor = loop.create_task(async_monitor_loop_lag(lags))
+    hub = ClimateIPHub(args.max_concurrent_requests, args.poll_interval)
+
+    start = loop.time()
+    controllers = await asyncio.gather(*[hub.async_run(unit['ip_address'], async_run_in_executor,
+        create_controller, unit, args.client_cert, logger) for unit in units])
+    setup = loop.time() - start
+    test_units = [LoadTestUnit(hub, unit['ip_address'], controller, stats)
+        for unit, controller in zip(units, controllers) if controller is not None]
+    setup_lags = len(lags)
+
+    for unit in test_units:
+        hub.async_register(unit)
+    command_tasks = set()
+    commands = loop.create_task(async_send_commands(test_units, args.command_rate, command_tasks)) \
+        if args.command_rate > 0 and test_units else None
+    await asyncio.sleep(args.duration)
+
+    for task in [commands, monitor]:
+        if task is not None:
+            task.cancel()
+    tasks = list(command_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions = True)
+    await hub.async_stop()
+    for controller in controllers:
+        if controller is not None:
+            controller.stop_push_updates()
+
+    run_lags = lags[setup_lags:]
+    return {
+        'devices' : len(units),
+        'initialized' : len(test_units),
+        'setup_sec' : round(setup, 2),
+        'polls' : stats['polls'],
+        'failed_polls' : stats['failed_polls'],
+        'polls_per_sec' : round((stats['polls'] + stats['failed_polls']) / args.duration, 2),
+        'poll_latency_ms' : percentiles(stats['poll_latency'], [50, 95, 100]),
+        'commands' : stats['commands'],
+        'failed_commands' : stats['failed_commands'],
+        'command_latency_ms' : percentiles(stats['command_latency'], [50, 95, 100]),
+        'loop_lag_ms' : dict(percentiles(run_lags, [50, 99, 100]),
+            stalls = sum(1 for lag in run_lags if lag > CONST_STALL_THRESHOLD)),
+        'setup_loop_lag_ms' : percentiles(lags[:setup_lags], [50, 99, 100]),
+    }
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = 'python -m simulators.load_test', description = 'Load test against simulated units.')
+    parser.add_argument('--devices', type = int, nargs = '+', default = [10, 100, 500], help = 'fleet sizes (default: %(default)s)')
+    parser.add_argument('--protocol', choices = PROTOCOLS + [PROTOCOL_MIXED], default = PROTOCOL_MIXED,
+        help = 'protocol of units (default: %(default)s)')
+    parser.add_argument('--duration', type = float, default = 60, help = 'seconds of polling per fleet size (default: %(default)s)')
+    parser.add_argument('--poll-interval', type = float, default = 15, help = 'poll interval in seconds (default: %(default)s)')
+    parser.add_argument('--max-concurrent-requests', type = int, default = 8, help = 'hub limit (default: %(default)s)')
+    parser.add_argument('--command-rate', type = float, default = 1.0, help = 'commands per second (default: %(default)s)')
+    parser.add_argument('--client-cert', default = 'ac14k_m.pem', help = 'client certificate (default: %(default)s)')
+    parser.add_argument('--no-client-cert', dest = 'client_cert', action = 'store_const', const = None,
+        help = 'connect without client certificate, e.g. when OpenSSL rejects the SHA-1 signed default one')
+    add_fault_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level = logging.ERROR)
+    logger = logging.getLogger('climate_ip.load_test')
+    raise_file_limit()
+    results = []
+    for size in args.devices:
+        fleet, units = start_fleet(args, size)
+        try:
+            result = asyncio.run(async_run_size(args, units, logger))
+        finally:
+            result_fleet = stop_fleet(fleet)
+        result['fleet'] = result_fleet
+        results.append(result)
+        sys.stderr.write('{} devices: {} polls/s, loop lag max {} ms\n'.format(size, result['polls_per_sec'],
+            result['loop_lag_ms']['max']))
+    json.dump({ 'protocol' : args.protocol, 'results' : results }, sys.stdout, indent = 2)
+    sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
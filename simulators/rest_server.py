@@ -0,0 +1,204 @@
+"""
+Simulated REST device, stand-in for the port 8888 /devices API used by samsungrac.yaml
+and mim-h03_heatpump.yaml profiles.
+
+Unit reports air conditioner with id 0 and heat pump with id 032000000 (read as Devices.1),
+so both profiles can be used with the same server. Supported requests:
+
+    GET /devices                        state of all devices
+    GET /devices/<id>                   state of single device
+    PUT /devices/<id>[/<resource>[/<n>]]  JSON body is merged into device or its resource
+
+Current temperature follows desired temperature while device is on.
+
+Run from repository root:
+    python -m simulators.rest_server --port 8888 --latency 0.05 --error-rate 0.01
+"""
+import asyncio
+import copy
+import json
+import ssl
+import time
+
+from .common import (
+    FAULT_DROP, FAULT_ERROR, create_argument_parser, create_fault_injector, create_server_ssl_context,
+)
+
+CONST_DEFAULT_PORT = 8888
+CONST_TEMPERATURE_DRIFT = 0.5 # degrees per minute
+CONST_MAX_BODY_SIZE = 65536
+
+AIR_CONDITIONER = {
+    'Alarms' : [], 'ConfigurationLink' : { 'href' : '/devices/0/configuration' },
+    'Diagnosis' : { 'diagnosisStart' : 'Ready' }, 'EnergyConsumption' : { 'saveLocation' : '/files/usage.db' },
+    'InformationLink' : { 'href' : '/devices/0/information' },
+    'Mode' : { 'modes' : ['Auto'], 'options' : ['Comode_Off', 'Sleep_0', 'Autoclean_Off', 'Spi_Off', 'FilterCleanAlarm_0',
+        'OutdoorTemp_63', 'CoolCapa_35', 'WarmCapa_40', 'UsagesDB_254', 'FilterTime_10000', 'OptionCode_54458',
+        'UpdateAllow_0', 'FilterAlarmTime_500', 'Function_15', 'Volume_100'], 'supportedModes' : ['Cool', 'Dry', 'Wind', 'Auto'] },
+    'Operation' : { 'power' : 'Off' },
+    'Temperatures' : [{ 'current' : 22.0, 'desired' : 25.0, 'id' : '0', 'maximum' : 30, 'minimum' : 16, 'unit' : 'Celsius' }],
+    'Wind' : { 'direction' : 'Fix', 'maxSpeedLevel' : 4, 'speedLevel' : 0 },
+    'connected' : True, 'description' : 'TP6X_RAC_16K', 'id' : '0', 'name' : 'RAC',
+    'resources' : ['Alarms', 'Configuration', 'Diagnosis', 'EnergyConsumption', 'Information', 'Mode', 'Operation',
+        'Temperatures', 'Wind'],
+    'type' : 'Air_Conditioner', 'uuid' : '00000000-0000-0000-0000-000000000000',
+}
+
+HEAT_PUMP = {
+    'Alarms' : [], 'Mode' : { 'modes' : ['Opmode_Heat'], 'options' : ['Volume_100'], 'supportedModes' : ['Opmode_Cool', 'Opmode_Heat'] },
+    'Operation' : { 'power' : 'On' },
+    'Temperatures' : [
+        { 'current' : 45.0, 'desired' : 50.0, 'id' : '0', 'maximum' : 65, 'minimum' : 25, 'unit' : 'Celsius' },
+        { 'current' : 40.0, 'desired' : 40.0, 'id' : '1', 'maximum' : 65, 'minimum' : 25, 'unit' : 'Celsius' },
+        { 'current' : 8.0, 'desired' : 8.0, 'id' : '2', 'maximum' : 50, 'minimum' : -30, 'unit' : 'Celsius' },
+    ],
+    'connected' : True, 'description' : 'MIM-H03', 'id' : '032000000', 'name' : 'EHS',
+    'resources' : ['Alarms', 'Mode', 'Operation', 'Temperatures'],
+    'type' : 'Heat_Pump', 'uuid' : '00000000-0000-0000-0000-000000000001',
+}
+
+def option_name(option):
+    return option.split('_', 1)[0]
+
+def merge(target, patch):
+    """Merge JSON patch into target. Options replace options with the same name (e.g. Spi_On replaces Spi_Off)."""
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(target.get(key, None), dict):
+            merge(target[key], value)
+        elif key == 'options' and isinstance(value, list) and isinstance(target.get(key, None), list):
+            names = set(option_name(option) for option in value)
+            target[key] = [option for option in target[key] if option_name(option) not in names] + value
+        else:
+            target[key] = value
+
+class RestDevice():
+    """State of devices reported by a single simulated unit."""
+    def __init__(self):
+        self._devices = [copy.deepcopy(AIR_CONDITIONER), copy.deepcopy(HEAT_PUMP)]
+        self._updated = time.monotonic()
+        self.requests = 0
+        self.writes = 0
+
+    def find(self, device_id):
+        for device in self._devices:
+            if device['id'] == device_id:
+                return device
+        return None
+
+    def drift(self):
+        now = time.monotonic()
+        step = (now - self._updated) / 60 * CONST_TEMPERATURE_DRIFT
+        if step < 0.1:
+            return
+        self._updated = now
+        for device in self._devices:
+            if device['Operation']['power'] != 'On':
+                continue
+            t = device['Temperatures'][0]
+            delta = t['desired'] - t['current']
+            t['current'] = round(t['current'] + max(-step, min(step, delta)), 1)
+
+    def write(self, device, path, patch):
+        """Merge patch into resource at path. Keys of device resources (e.g. Operation) are merged into device."""
+        target = device
+        if path:
+            key = path[0][:1].upper() + path[0][1:]
+            target = device.get(key, None)
+            if isinstance(target, list) and len(path) > 1:
+                target = next((item for item in target if item.get('id', None) == path[1]), None)
+        if not isinstance(target, dict) or not isinstance(patch, dict):
+            return False
+        for key, value in patch.items():
+            merge(device if key in device and key[:1].isupper() else target, { key : value })
+        self.writes += 1
+        return True
+
+    def handle(self, method, target, body):
+        """Return status code and JSON answer for request."""
+        self.requests += 1
+        self.drift()
+        path = [part for part in target.split('?', 1)[0].split('/') if part]
+        if not path or path[0] != 'devices':
+            return 404, { 'error' : 'Not Found' }
+        if method == 'GET' and len(path) == 1:
+            return 200, { 'Devices' : self._devices }
+        device = self.find(path[1]) if len(path) > 1 else None
+        if device is None:
+            return 404, { 'error' : 'Not Found' }
+        if method == 'GET' and len(path) == 2:
+            return 200, device
+        if method == 'PUT':
+            try:
+                patch = json.loads(body.decode('utf-8')) if body else {}
+            except ValueError:
+                return 400, { 'error' : 'Bad Request' }
+            if self.write(device, path[2:], patch):
+                return 200, {}
+            return 400, { 'error' : 'Bad Request' }
+        return 405, { 'error' : 'Method Not Allowed' }
+
+REASONS = { 200 : 'OK', 400 : 'Bad Request', 404 : 'Not Found', 405 : 'Method Not Allowed', 500 : 'Internal Server Error' }
+
+async def async_handle_connection(device, faults, reader, writer):
+    """Serve HTTP/1.1 requests of a single keep-alive connection."""
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            method, target, _ = line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                header = await reader.readline()
+                if header in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = header.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            size = int(headers.get('content-length', 0))
+            if size > CONST_MAX_BODY_SIZE:
+                break
+            body = await reader.readexactly(size) if size > 0 else b''
+
+            fault = await faults.async_answer()
+            if fault == FAULT_DROP:
+                break
+            if fault == FAULT_ERROR:
+                code, answer = 500, { 'error' : 'Internal Server Error' }
+            else:
+                code, answer = device.handle(method, target, body)
+            payload = json.dumps(answer).encode('utf-8')
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+                code, REASONS.get(code, ''), len(payload), 'keep-alive' if keep_alive else 'close').encode('latin-1') + payload)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, ValueError, asyncio.IncompleteReadError, ssl.SSLError):
+        pass
+    finally:
+        writer.close()
+
+async def async_start_rest_server(host, port, device, faults, ssl_context):
+    """Start simulated REST unit and return asyncio server."""
+    return await asyncio.start_server(lambda r, w: async_handle_connection(device, faults, r, w),
+        host, port, ssl = ssl_context, reuse_address = True)
+
+async def async_main(args):
+    server = await async_start_rest_server(args.host, args.port, RestDevice(), create_fault_injector(args),
+        create_server_ssl_context(args.cert) if not args.plain else None)
+    print('Serving REST device on {}:{}'.format(args.host, args.port), flush = True)
+    async with server:
+        await server.serve_forever()
+
+def main(argv = None):
+    parser = create_argument_parser('python -m simulators.rest_server', 'Run simulated REST device.')
+    parser.add_argument('--host', default = '127.0.0.1', help = 'address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type = int, default = CONST_DEFAULT_PORT, help = 'port (default: %(default)s)')
+    parser.add_argument('--plain', action = 'store_true', help = 'serve plain HTTP instead of HTTPS')
+    try:
+        asyncio.run(async_main(parser.parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
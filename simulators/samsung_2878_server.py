@@ -0,0 +1,185 @@
+"""
+Simulated Samsung 2878 device, TLS socket server speaking the protocol used by samsung_2878.yaml profile.
+
+After connection is accepted device sends Update Type="InvalidateAccount" and expects AuthToken request.
+Authenticated client can send DeviceState and DeviceControl requests. Every accepted DeviceControl is
+acknowledged and followed by Update Type="Status" with changed attributes, which is also sent to all
+other connections of the unit, as real devices do.
+
+Run from repository root:
+    python -m simulators.samsung_2878_server --port 2878 --token 0123456789 --latency 0.1
+"""
+import asyncio
+import re
+import ssl
+import time
+
+from .common import (
+    FAULT_DROP, FAULT_ERROR, create_argument_parser, create_fault_injector, create_server_ssl_context,
+)
+
+CONST_DEFAULT_PORT = 2878
+CONST_TEMPERATURE_DRIFT = 1 # degrees per minute
+CONST_MAX_REQUEST_SIZE = 65536
+
+XML_HEADER = '<?xml version="1.0" encoding="utf-8" ?>'
+REQUEST_END = '</Request>'
+REQUEST_TYPE_RE = re.compile(r'<Request Type="([^"]*)"')
+TOKEN_RE = re.compile(r'<User Token="([^"]*)"')
+COMMAND_ID_RE = re.compile(r'CommandID="([^"]*)"')
+DUID_RE = re.compile(r'DUID="([^"]*)"')
+ATTR_RE = re.compile(r'<Attr ID="([^"]*)" Value="([^"]*)"')
+
+DEVICE_STATE = [
+    ('AC_FUN_ENABLE', 'RW', 'Enable'), ('AC_FUN_POWER', 'RW', 'Off'), ('AC_FUN_OPMODE', 'RW', 'Cool'),
+    ('AC_FUN_TEMPSET', 'RW', '24'), ('AC_FUN_TEMPNOW', 'R', '26'), ('AC_FUN_WINDLEVEL', 'RW', 'Auto'),
+    ('AC_FUN_DIRECTION', 'RW', 'Fixed'), ('AC_FUN_COMODE', 'RW', 'Off'), ('AC_ADD_SPI', 'RW', 'Off'),
+    ('AC_ADD_AUTOCLEAN', 'RW', 'Off'), ('AC_FUN_ERROR', 'R', '30303030'), ('AC_ADD_STARTWPS', 'RW', '0'),
+    ('AC_ADD_APMODE_END', 'W', '0'),
+]
+
+class Samsung2878Device():
+    """State of a single simulated unit, shared by all its connections."""
+    def __init__(self, token = None, duid = None):
+        self._token = token
+        self._duid = duid
+        self._types = dict((key, access) for key, access, _ in DEVICE_STATE)
+        self._values = dict((key, value) for key, _, value in DEVICE_STATE)
+        self._updated = time.monotonic()
+        self._writers = set()
+        self.requests = 0
+        self.writes = 0
+
+    def drift(self):
+        now = time.monotonic()
+        step = int((now - self._updated) / 60 * CONST_TEMPERATURE_DRIFT)
+        if step < 1:
+            return
+        self._updated = now
+        if self._values['AC_FUN_POWER'] == 'On':
+            current = int(self._values['AC_FUN_TEMPNOW'])
+            delta = int(self._values['AC_FUN_TEMPSET']) - current
+            self._values['AC_FUN_TEMPNOW'] = str(current + max(-step, min(step, delta)))
+
+    def state_response(self, duid):
+        attrs = ''.join('<Attr ID="{}" Type="{}" Value="{}"/>'.format(key, self._types[key], value)
+            for key, value in self._values.items())
+        return '{}<Response Type="DeviceState" Status="Okay"><DeviceState><Device DUID="{}" GroupID="AC" ModelID="AC" >{}</Device></DeviceState></Response>'.format(
+            XML_HEADER, duid, attrs)
+
+    def status_update(self, duid, attrs):
+        return '{}<Update Type="Status"><Status DUID="{}" GroupID="AC" ModelID="AC">{}</Status></Update>'.format(
+            XML_HEADER, duid, ''.join('<Attr ID="{}" Value="{}" />'.format(key, value) for key, value in attrs))
+
+    def handle(self, connection, request):
+        """Return list of (answer, broadcast) tuples, broadcast answers are sent to all authenticated connections."""
+        self.requests += 1
+        self.drift()
+        f = REQUEST_TYPE_RE.search(request)
+        request_type = f.group(1) if f else ''
+        if request_type == 'AuthToken':
+            f = TOKEN_RE.search(request)
+            if self._token is not None and (f is None or f.group(1) != self._token):
+                return [('{}<Response Type="AuthToken" Status="Fail" ErrorCode="301" />'.format(XML_HEADER), False)]
+            connection.authenticated = True
+            return [('{}<Response Type="AuthToken" Status="Okay" StartFrom="{}"/>'.format(XML_HEADER,
+                time.strftime('%Y-%m-%d/%H:%M:%S')), False)]
+        if not connection.authenticated:
+            return [('{}<Response Type="{}" Status="Fail" ErrorCode="401" />'.format(XML_HEADER, request_type), False)]
+
+        f = DUID_RE.search(request)
+        duid = f.group(1) if f else self._duid
+        if self._duid is not None and duid != self._duid:
+            return [('{}<Response Type="{}" Status="Fail" ErrorCode="103" />'.format(XML_HEADER, request_type), False)]
+        if request_type == 'DeviceState':
+            return [(self.state_response(duid), False)]
+        if request_type == 'DeviceControl':
+            f = COMMAND_ID_RE.search(request)
+            attrs = [(key, value) for key, value in ATTR_RE.findall(request) if self._types.get(key, 'R') != 'R']
+            for key, value in attrs:
+                self._values[key] = value
+            self.writes += 1
+            answers = [('{}<Response Type="DeviceControl" Status="Okay" DUID="{}" CommandID="{}"/>'.format(
+                XML_HEADER, duid, f.group(1) if f else ''), False)]
+            if attrs:
+                answers.append((self.status_update(duid, attrs), True))
+            return answers
+        return [('{}<Response Type="{}" Status="Fail" ErrorCode="100" />'.format(XML_HEADER, request_type), False)]
+
+    def add_writer(self, writer):
+        self._writers.add(writer)
+
+    def remove_writer(self, writer):
+        self._writers.discard(writer)
+
+    @property
+    def writers(self):
+        return list(self._writers)
+
+class Connection2878():
+    def __init__(self):
+        self.authenticated = False
+
+async def async_handle_connection(device, faults, reader, writer):
+    """Handle requests of a single client connection."""
+    connection = Connection2878()
+    device.add_writer(writer)
+    try:
+        writer.write('{}<Update Type="InvalidateAccount"/>\r\n'.format(XML_HEADER).encode('utf-8'))
+        await writer.drain()
+        buf = ''
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            buf += data.decode('utf-8', errors = 'replace')
+            if len(buf) > CONST_MAX_REQUEST_SIZE:
+                break
+            while REQUEST_END in buf:
+                request, buf = buf.split(REQUEST_END, 1)
+                fault = await faults.async_answer()
+                if fault == FAULT_DROP:
+                    return
+                if fault == FAULT_ERROR:
+                    f = REQUEST_TYPE_RE.search(request)
+                    answers = [('{}<Response Type="{}" Status="Fail" ErrorCode="500" />'.format(
+                        XML_HEADER, f.group(1) if f else ''), False)]
+                else:
+                    answers = device.handle(connection, request)
+                for answer, broadcast in answers:
+                    message = (answer + '\r\n').encode('utf-8')
+                    for target in (device.writers if broadcast else [writer]):
+                        target.write(message)
+                await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+        pass
+    finally:
+        device.remove_writer(writer)
+        writer.close()
+
+async def async_start_2878_server(host, port, device, faults, ssl_context):
+    """Start simulated 2878 unit and return asyncio server."""
+    return await asyncio.start_server(lambda r, w: async_handle_connection(device, faults, r, w),
+        host, port, ssl = ssl_context, reuse_address = True)
+
+async def async_main(args):
+    device = Samsung2878Device(args.token, args.duid)
+    server = await async_start_2878_server(args.host, args.port, device, create_fault_injector(args),
+        create_server_ssl_context(args.cert))
+    print('Serving 2878 device on {}:{}'.format(args.host, args.port), flush = True)
+    async with server:
+        await server.serve_forever()
+
+def main(argv = None):
+    parser = create_argument_parser('python -m simulators.samsung_2878_server', 'Run simulated Samsung 2878 device.')
+    parser.add_argument('--host', default = '127.0.0.1', help = 'address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type = int, default = CONST_DEFAULT_PORT, help = 'port (default: %(default)s)')
+    parser.add_argument('--token', default = None, help = 'accepted token, any token is accepted if not set')
+    parser.add_argument('--duid', default = None, help = 'device DUID (MAC without colons), any is accepted if not set')
+    try:
+        asyncio.run(async_main(parser.parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()